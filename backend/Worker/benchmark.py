@@ -1,119 +1,662 @@
 import pennylane as qml
 import jax
 import jax.numpy as jnp
+import numpy as np
 import optax
-import re
+import os
+import threading
+import time
+import checkpoint
 import loading
+from encoding_cache import content_version
 
+from collections import OrderedDict
+from itertools import product
 
-def run_benchmark(ansatz_id: int, dataset_id: int, encoding_id: int, n_qubits: int, measure_wire: int, n_epochs=100, learning_rate=0.2, n_layers=2, progress_update=None) -> dict:
-    X_train, X_test, y_train, y_test = loading.load_dataset_by_id(dataset_id, n_qubits)
 
-    ansatz_func   = loading.load_ansatz_by_id(ansatz_id)
-    encoding_spec = loading.load_encoding_from_db(encoding_id, n_qubits)
-    dev           = qml.device("default.qubit", wires=n_qubits)
-
-    def simple_encoding(x):
-        gates = encoding_spec['gates']
-        for gate in gates:
-            gate_type = gate.get('gate')
-            wires = gate.get('wires', [])
-            params = gate.get('params', [])
-            # Map params-Strings wie 'theta_0' oder 'x_1' auf x[index]
-            resolved_params = []
-            for p in params:
-                if isinstance(p, (int, float)):
-                    resolved_params.append(p)
-                elif isinstance(p, str):
-                    m = re.match(r"input_(\d+)", p)
-                    if m:
-                        idx = int(m.group(1))
-                        if idx < len(x):
-                            resolved_params.append(x[idx])
-                        else:
-                            raise ValueError(f"Parameter-Index {idx} außerhalb von x (len={len(x)})")
-                    else:
-                        raise ValueError(f"Unbekanntes params-Format: {p}")
-                else:
-                    raise ValueError(f"Unbekannter Parametertyp: {type(p)}")
-            # Gate anwenden
-            if gate_type == 'RY':
-                qml.RY(*resolved_params, wires=wires)
-            elif gate_type == 'RX':
-                qml.RX(*resolved_params, wires=wires)
-            elif gate_type == 'RZ':
-                qml.RZ(*resolved_params, wires=wires)
-            elif gate_type == 'H':
-                qml.Hadamard(wires=wires)
-            elif gate_type == 'X':
-                qml.PauliX(wires=wires)
-            elif gate_type == 'Z':
-                qml.PauliZ(wires=wires)
-            elif gate_type == 'CNOT':
-                qml.CNOT(wires=wires)
+# XLA executables are stored in COMPILATION_CACHE_DIR (empty disables it) and shared
+# by all worker processes using the directory, so a new worker loads the compiled
+# steps of known configurations instead of compiling them again.
+COMPILATION_CACHE_DIR = os.getenv("COMPILATION_CACHE_DIR", "/tmp/jax_cache")
+if COMPILATION_CACHE_DIR:
+    jax.config.update("jax_compilation_cache_dir", COMPILATION_CACHE_DIR)
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", float(os.getenv("COMPILATION_CACHE_MIN_SECONDS", "0.5")))
+
+# Number of jitted models (step and predict functions) kept per process
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "32"))
+
+# LRU of jitted models: (ansatz, encoding, qubits, measured wire, learning rate) -> model
+_models: OrderedDict = OrderedDict()
+# Models are built by the training loop and the warm-up thread
+_models_lock = threading.Lock()
+
+
+def shard_rows(x, n_devices: int):
+    """
+    Pads ``x`` along its first axis to a multiple of ``n_devices`` and reshapes it to
+    ``(n_devices, rows_per_device, ...)`` so that it can be fed into ``jax.pmap``.
+
+    :param x: Array whose first axis holds the samples.
+    :param n_devices: Number of devices to shard across.
+    :return: The sharded (and zero padded) array.
+    """
+    pad = (-x.shape[0]) % n_devices
+    if pad:
+        x = jnp.concatenate([x, jnp.zeros((pad,) + x.shape[1:], dtype=x.dtype)])
+    return x.reshape((n_devices, -1) + x.shape[1:])
+
+
+def apply_encoding(encoding_spec: dict, x):
+    """
+    Applies the compiled operations of an encoding spec, resolving ``input_<k>`` params to ``x[k]``.
+
+    :param encoding_spec: Encoding as returned by ``loading.load_encoding_from_db``.
+    :param x: Feature vector of one sample.
+    """
+    if encoding_spec.get('state_prep'):
+        # Initialises the simulator state directly from the prepared amplitudes
+        wires, amplitude_count = encoding_spec['state_prep']
+        qml.StatePrep(x[:amplitude_count], wires=wires)
+
+    for operation, wires, params in encoding_spec['operations']:
+        resolved_params = []
+        for index, constant in params:
+            if index is None:
+                resolved_params.append(constant)
+            elif index < len(x):
+                resolved_params.append(x[index])
             else:
-                raise ValueError(f"Unbekanntes Gate: {gate_type}")
+                raise ValueError(f"Parameter-Index {index} außerhalb von x (len={len(x)})")
+        operation(*resolved_params, wires=wires)
+
+
+def build_circuit(encoding_spec: dict, ansatz_func, n_qubits: int, measure_wire: int):
+    """
+    Builds the classifier QNode: encoding followed by the ansatz, measuring Z on ``measure_wire``.
+
+    :return: QNode with signature ``circuit(x, params)``.
+    """
+    dev = qml.device("default.qubit", wires=n_qubits)
 
     @qml.qnode(dev, interface="jax")
     def circuit(x, params):
-        simple_encoding(x)
+        apply_encoding(encoding_spec, x)
         ansatz_func(params, wires=range(n_qubits))
         return qml.expval(qml.PauliZ(measure_wire))
 
-    @qml.qnode(dev, interface="jax")
-    def kernel_circuit(x1, x2):
-        simple_encoding(x1)
-        qml.adjoint(simple_encoding)(x2)
-        return qml.expval(qml.Identity(0))
+    return circuit
 
-    def circuit_classification():
-        def cost(params, x, y):
-            preds = jax.vmap(lambda xi: circuit(xi, params))(x)
-            labels = 1 - 2 * y  # map {0,1} → {+1, -1}
-            return jnp.mean((preds - labels) ** 2)
-        cost = jax.jit(cost)
 
-        @jax.jit
+class Model:
+    """
+    Jitted step and predict functions (and the pmapped step of data-parallel runs) of
+    a classifier. They only depend on the circuit and the optimizer, so runs of the
+    same configuration share them and only the first one traces and compiles (once
+    per input shape).
+    """
+
+    def __init__(self, circuit, learning_rate: float):
+        self.circuit   = circuit
+        self.optimizer = optax.adam(learning_rate=learning_rate)
+
         def predict(x, params):
             return jax.vmap(lambda xi: circuit(xi, params))(x)
-        key = jax.random.PRNGKey(0)
-        shape = ansatz_func.shape(n_layers=n_layers, n_wires=n_qubits)
-        params = 0.01 * jax.random.normal(key, shape)
-        optimizer = optax.adam(learning_rate=learning_rate)
-        opt_state = optimizer.init(params)
 
-        @jax.jit
+        def cost(params, x, y):
+            labels = 1 - 2 * y  # map {0,1} → {+1, -1}
+            return jnp.mean((predict(x, params) - labels) ** 2)
+
         def step(params, opt_state, x, y):
             loss, grads = jax.value_and_grad(cost)(params, x, y)
-            updates, opt_state = optimizer.update(grads, opt_state)
+            updates, opt_state = self.optimizer.update(grads, opt_state)
+            new_params = optax.apply_updates(params, updates)
+            return new_params, opt_state, loss
+
+        # Data-parallel step: every device trains on its own shard of the samples. The
+        # weights hold 1 / (global sample count) per row and 0 for padded rows, so
+        # summing the per-shard losses (and their gradients) across devices yields
+        # exactly the full-batch mean.
+        def shard_cost(params, x, y, w):
+            labels = 1 - 2 * y
+            return jnp.sum(w * (predict(x, params) - labels) ** 2)
+
+        def shard_step(params, opt_state, x, y, w):
+            loss, grads = jax.value_and_grad(shard_cost)(params, x, y, w)
+            loss = jax.lax.psum(loss, axis_name="devices")
+            grads = jax.lax.psum(grads, axis_name="devices")
+            updates, opt_state = self.optimizer.update(grads, opt_state)
             new_params = optax.apply_updates(params, updates)
             return new_params, opt_state, loss
+
+        self.predict       = jax.jit(predict)
+        self.step          = jax.jit(step)
+        self.parallel_step = jax.pmap(shard_step, axis_name="devices")
+
+
+def compiled_model(ansatz_id: int, encoding_spec: dict, n_qubits: int, measure_wire: int, learning_rate: float) -> Model:
+    """
+    Returns the (cached) jitted model of a configuration.
+
+    :param encoding_spec: Encoding as returned by ``loading.load_encoding_from_db``.
+    :return: The ``Model``; its functions are compiled on first use.
+    """
+    key = (ansatz_id, content_version(encoding_spec["gates"]), n_qubits, measure_wire, learning_rate)
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+        ansatz_func = loading.load_ansatz_by_id(ansatz_id)
+        model = Model(build_circuit(encoding_spec, ansatz_func, n_qubits, measure_wire), learning_rate)
+        _models[key] = model
+        while len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+        return model
+
+
+def warm_up(ansatz_id: int, dataset_id: int, encoding_id: int, n_qubits: int, measure_wire: int, learning_rate=0.2, n_layers=2, train_fraction=1.0, reduction=None):
+    """
+    Loads the dataset and compiles the step and predict functions of a configuration
+    for the shapes ``run_benchmark`` calls them with, without training.
+    """
+    ansatz_func   = loading.load_ansatz_by_id(ansatz_id)
+    encoding_spec = loading.load_encoding_from_db(encoding_id, n_qubits)
+    amplitude_count = encoding_spec["state_prep"][1] if encoding_spec.get("state_prep") else None
+    (X_train, X_test, y_train, _), _ = loading.load_cached_dataset(dataset_id, n_qubits, reduction, amplitude_count)
+    X_train, y_train = loading.stratified_subsample(X_train, y_train, train_fraction)
+
+    model = compiled_model(ansatz_id, encoding_spec, n_qubits, measure_wire, learning_rate)
+    params = jnp.zeros(ansatz_func.shape(n_layers=n_layers, n_wires=n_qubits))
+    jax.block_until_ready(model.step(params, model.optimizer.init(params), X_train, y_train))
+    jax.block_until_ready(model.predict(X_train, params))
+    jax.block_until_ready(model.predict(X_test, params))
+
+
+def run_benchmark(ansatz_id: int, dataset_id: int, encoding_id: int, n_qubits: int, measure_wire: int, n_epochs=100, learning_rate=0.2, n_layers=2, progress_update=None, data_parallel=False, scaling_probe=False, run_id=None, checkpoint_interval=0, train_fraction=1.0, initial_params=None, reduction=None, encoding_circuit=None) -> dict:
+    load_start = time.perf_counter()
+    ansatz_func   = loading.load_ansatz_by_id(ansatz_id)
+    encoding_spec = loading.load_encoding_from_db(encoding_id, n_qubits, encoding_circuit)
+    amplitude_count = encoding_spec["state_prep"][1] if encoding_spec.get("state_prep") else None
+
+    dataset_start = time.perf_counter()
+    (X_train, X_test, y_train, y_test), dataset_source = loading.load_cached_dataset(dataset_id, n_qubits, reduction, amplitude_count)
+    dataset_load_time = time.perf_counter() - dataset_start
+    # Preview runs train on a stratified subsample of the training set.
+    X_train, y_train = loading.stratified_subsample(X_train, y_train, train_fraction)
+
+    # Time the run waited for its dataset and encoding (close to zero when prewarmed)
+    data_wait_time = time.perf_counter() - load_start
+
+    model = compiled_model(ansatz_id, encoding_spec, n_qubits, measure_wire, learning_rate)
+
+    def circuit_classification():
+        predict = model.predict
+        step    = model.step
+        key = jax.random.PRNGKey(0)
+        shape = ansatz_func.shape(n_layers=n_layers, n_wires=n_qubits)
+        params = 0.01 * jax.random.normal(key, shape)
+        if initial_params is not None:
+            # Warm start, e.g. a full run promoted from a preview run.
+            if tuple(jnp.shape(initial_params)) == tuple(shape):
+                params = jnp.asarray(initial_params, dtype=params.dtype)
+            else:
+                print(f"Ignoring initial params of shape {jnp.shape(initial_params)}, expected {tuple(shape)}.", flush=True)
+        optimizer = model.optimizer
+        opt_state = optimizer.init(params)
+
         training_losses = []
-        for i in range(n_epochs):
-            params, opt_state, loss = step(params, opt_state, X_train, y_train)
+        start_epoch = 0
+        if run_id is not None:
+            checkpoint_config = checkpoint.config_key({
+                "ansatz_id":        ansatz_id,
+                "dataset_id":       dataset_id,
+                "encoding_id":      encoding_id,
+                "encoding_circuit": encoding_circuit,
+                "n_qubits":         n_qubits,
+                "measure_wire":     measure_wire,
+                "learning_rate":    learning_rate,
+                "n_layers":         n_layers,
+                "train_fraction":   train_fraction,
+                "reduction":        reduction,
+                "initial_params":   None if initial_params is None else np.asarray(initial_params).tolist(),
+            })
+            restored = checkpoint.load_checkpoint(run_id, checkpoint_config, params, opt_state)
+            if restored:
+                params          = restored["params"]
+                opt_state       = restored["opt_state"]
+                key             = restored["key"]
+                start_epoch     = restored["epoch"]
+                training_losses = restored["training_losses"]
+                print(f"Resuming run {run_id} from epoch {start_epoch}.", flush=True)
+
+        n_devices = jax.local_device_count() if data_parallel else 1
+        epoch_times = []
+
+        if n_devices > 1:
+            # Data-parallel mode, see Model.parallel_step
+            n_samples = X_train.shape[0]
+            x_shards = shard_rows(X_train, n_devices)
+            y_shards = shard_rows(y_train, n_devices)
+            w_shards = shard_rows(jnp.full(n_samples, 1 / n_samples), n_devices)
+            state = jax.device_put_replicated((params, opt_state), jax.local_devices()[:n_devices])
+
+            def train_step(state):
+                params, opt_state, loss = model.parallel_step(*state, x_shards, y_shards, w_shards)
+                return (params, opt_state), loss[0]
+
+            def host_state(state):
+                return jax.tree_util.tree_map(lambda leaf: leaf[0], state)
+        else:
+            state = (params, opt_state)
+
+            def train_step(state):
+                params, opt_state, loss = step(*state, X_train, y_train)
+                return (params, opt_state), loss
+
+            def host_state(state):
+                return state
+
+        for i in range(start_epoch, n_epochs):
+            start = time.perf_counter()
+            state, loss = train_step(state)
             training_losses.append(float(loss))
+            epoch_times.append(time.perf_counter() - start)
+            if run_id is not None and checkpoint_interval and ((i + 1) % checkpoint_interval == 0 or i + 1 == n_epochs):
+                checkpoint.save_checkpoint(run_id, checkpoint_config, *host_state(state), key, i + 1, training_losses)
             if progress_update:
-                progress_update(i, n_epochs)
+                progress_update(i, n_epochs, training_losses[-1])
+        params, opt_state = host_state(state)
+
+        # The first epoch includes tracing and compilation.
+        steady_epoch_times = epoch_times[1:] or epoch_times
+        epoch_time = sum(steady_epoch_times) / len(steady_epoch_times) if steady_epoch_times else None
+        instrumentation = {
+            "device_count":       n_devices,
+            "compile_time":       epoch_times[0] - epoch_time if len(epoch_times) > 1 else None,
+            "epoch_time":         epoch_time,
+            "resumed_from_epoch": start_epoch,
+            "dataset_cache":      dataset_source,
+            "dataset_load_time":  dataset_load_time,
+            "data_wait_time":     data_wait_time,
+        }
+        if scaling_probe and n_devices > 1 and epoch_time:
+            # Scaling efficiency: single-device epoch time divided by (devices x
+            # data-parallel epoch time). Measured with one warm-up and one timed
+            # serial step, so the probe costs one extra compilation.
+            jax.block_until_ready(step(params, opt_state, X_train, y_train))
+            start = time.perf_counter()
+            jax.block_until_ready(step(params, opt_state, X_train, y_train))
+            serial_epoch_time = time.perf_counter() - start
+            instrumentation["serial_epoch_time"] = serial_epoch_time
+            instrumentation["scaling_efficiency"] = serial_epoch_time / (n_devices * epoch_time)
+
         train_predictions = predict(X_train, params)
         test_predictions  = predict(X_test, params)
         train_labels      = (train_predictions < 0).astype(int)
         test_labels       = (test_predictions < 0).astype(int)
         train_accuracy    = jnp.mean(train_labels == y_train)
         test_accuracy     = jnp.mean(test_labels == y_test)
+        # Training loss of the final params (the epoch losses lag one update behind).
+        trained_loss      = jnp.mean((train_predictions - (1 - 2 * y_train)) ** 2)
         return {
             "training_accuracy": float(train_accuracy),
             "test_accuracy":     float(test_accuracy),
             "final_loss":        training_losses[-1],
-            "training_losses":   training_losses
+            "trained_loss":      float(trained_loss),
+            "params":            params,
+            "training_losses":   training_losses,
+            "instrumentation":   instrumentation,
         }
 
     circuit_results = circuit_classification()
 
     results = {
         "loss": circuit_results["final_loss"],
-        "accuracy": circuit_results["test_accuracy"]
+        "accuracy": circuit_results["test_accuracy"],
+        "trained_loss": circuit_results["trained_loss"],
+        "params": np.asarray(circuit_results["params"]),
+        "training_losses": np.asarray(circuit_results["training_losses"], dtype=np.float32),
+        "instrumentation": circuit_results["instrumentation"],
     }
 
     return results
 
 
+def run_fused_benchmark(ansatz_id: int, dataset_id: int, encoding_ids: list[int], n_qubits: int, measure_wire: int, n_epochs=100, learning_rate=0.2, n_layers=2, progress_update=None, reduction=None, encoding_circuits=None, is_cancelled=None) -> list[dict | None]:
+    """
+    Trains several benchmark runs sharing dataset, ansatz and qubit count as one job.
+
+    The dataset is loaded and placed on the device once, and every epoch dispatches
+    the jitted steps of all runs before waiting for any of them, so XLA overlaps
+    their execution and the per-epoch host round trips are paid once per batch. Each
+    run keeps its own (cached) model, params and optimizer state (tracing the circuits
+    of different encodings into one step makes its compilation grow faster than the
+    runs), so it trains exactly as it would alone.
+
+    :param encoding_ids: Encodings of the fused runs.
+    :param progress_update: Called as ``progress_update(epoch_index, n_epochs, losses, runs)``
+                            with the losses of the epoch (a device array), where
+                            ``losses[k]`` belongs to the run with index ``runs[k]``.
+    :param encoding_circuits: Circuits embedded in the tasks, one per encoding (or None).
+    :param is_cancelled: Called as ``is_cancelled(index)`` before every epoch; a cancelled
+                         run stops training while the others continue.
+    :return: One result dictionary per run, shaped like the one of ``run_benchmark``,
+             or None for a cancelled run.
+    """
+    load_start = time.perf_counter()
+    ansatz_func    = loading.load_ansatz_by_id(ansatz_id)
+    encoding_circuits = encoding_circuits or [None] * len(encoding_ids)
+    encoding_specs = [loading.load_encoding_from_db(encoding_id, n_qubits, circuit) for encoding_id, circuit in zip(encoding_ids, encoding_circuits)]
+    amplitude_counts = {spec["state_prep"][1] if spec.get("state_prep") else None for spec in encoding_specs}
+    if len(amplitude_counts) > 1:
+        raise ValueError("Fused runs must all or none use an amplitude embedding of the same size")
+
+    dataset_start = time.perf_counter()
+    (X_train, X_test, y_train, y_test), dataset_source = loading.load_cached_dataset(dataset_id, n_qubits, reduction, amplitude_counts.pop())
+    X_train, X_test, y_train = jax.device_put((X_train, X_test, y_train))
+    dataset_load_time = time.perf_counter() - dataset_start
+    data_wait_time = time.perf_counter() - load_start
+
+    models = [compiled_model(ansatz_id, spec, n_qubits, measure_wire, learning_rate) for spec in encoding_specs]
+
+    # Every run starts from the same params as it would alone.
+    key = jax.random.PRNGKey(0)
+    shape = ansatz_func.shape(n_layers=n_layers, n_wires=n_qubits)
+    params = [0.01 * jax.random.normal(key, shape) for _ in models]
+    opt_states = [model.optimizer.init(run_params) for model, run_params in zip(models, params)]
+
+    runs = list(range(len(models)))
+    training_losses = []
+    epoch_times = []
+    for i in range(n_epochs):
+        if is_cancelled:
+            runs = [index for index in runs if not is_cancelled(index)]
+            if not runs:
+                break
+        start = time.perf_counter()
+        outputs = [models[index].step(params[index], opt_states[index], X_train, y_train) for index in runs]
+        for index, output in zip(runs, outputs):
+            params[index], opt_states[index] = output[0], output[1]
+        losses = jnp.stack([output[2] for output in outputs])
+        losses.block_until_ready()
+        training_losses.append((runs, losses))
+        epoch_times.append(time.perf_counter() - start)
+        if progress_update:
+            progress_update(i, n_epochs, losses, runs)
+
+    # The first epoch includes tracing and compilation.
+    steady_epoch_times = epoch_times[1:] or epoch_times
+    epoch_time = sum(steady_epoch_times) / len(steady_epoch_times) if steady_epoch_times else None
+    loss_curves = [[] for _ in models]
+    for epoch_runs, losses in training_losses:
+        for index, loss in zip(epoch_runs, np.asarray(losses, dtype=np.float32)):
+            loss_curves[index].append(loss)
+
+    results = []
+    for index, model in enumerate(models):
+        if index not in runs:
+            results.append(None)
+            continue
+        train_predictions = model.predict(X_train, params[index])
+        test_predictions  = model.predict(X_test, params[index])
+        results.append({
+            "loss":            float(loss_curves[index][-1]),
+            "accuracy":        float(jnp.mean((test_predictions < 0).astype(int) == y_test)),
+            "trained_loss":    float(jnp.mean((train_predictions - (1 - 2 * y_train)) ** 2)),
+            "params":          np.asarray(params[index]),
+            "training_losses": np.asarray(loss_curves[index], dtype=np.float32),
+            "instrumentation": {
+                "fused_count":       len(models),
+                "compile_time":      epoch_times[0] - epoch_time if len(epoch_times) > 1 else None,
+                "epoch_time":        epoch_time,
+                "dataset_cache":     dataset_source,
+                "dataset_load_time": dataset_load_time,
+                "data_wait_time":    data_wait_time,
+            },
+        })
+    return results
+
+
+def run_cross_validation(ansatz_id: int, dataset_id: int, encoding_id: int, n_qubits: int, measure_wire: int, k_folds=5, n_epochs=100, learning_rate=0.2, n_layers=2, progress_update=None, reduction=None, encoding_circuit=None) -> dict:
+    """
+    Runs a stratified k-fold cross-validation in one job.
+
+    The dataset is loaded once and all of its samples (both splits) are assigned to
+    folds. Fold membership becomes a ``(k_folds, n_samples)`` mask, and the folds are
+    trained as one vmapped batch of params with a mask-weighted cost, so the step
+    function compiles once and every fold works on the same sample array.
+
+    :return: Dictionary with the mean ``loss``/``accuracy``, the per-fold table and
+             mean/std statistics under ``cross_validation`` and instrumentation.
+    """
+    cv_start = time.perf_counter()
+    ansatz_func   = loading.load_ansatz_by_id(ansatz_id)
+    encoding_spec = loading.load_encoding_from_db(encoding_id, n_qubits, encoding_circuit)
+    amplitude_count = encoding_spec["state_prep"][1] if encoding_spec.get("state_prep") else None
+    (X_train, X_test, y_train, y_test), dataset_source = loading.load_cached_dataset(dataset_id, n_qubits, reduction, amplitude_count)
+    data_wait_time = time.perf_counter() - cv_start
+    circuit       = build_circuit(encoding_spec, ansatz_func, n_qubits, measure_wire)
+
+    X = jnp.concatenate([X_train, X_test])
+    y = jnp.concatenate([y_train, y_test])
+    fold_ids    = loading.stratified_folds(y, k_folds)
+    test_masks  = jnp.asarray(fold_ids[None, :] == np.arange(k_folds)[:, None], dtype=X.dtype)
+    train_masks = 1 - test_masks
+    labels      = 1 - 2 * y  # map {0,1} → {+1, -1}
+
+    def predict(params, x):
+        return jax.vmap(lambda xi: circuit(xi, params))(x)
+
+    def cost(params, x, y, mask):
+        return jnp.sum(mask * (predict(params, x) - (1 - 2 * y)) ** 2) / jnp.sum(mask)
+
+    def masked_mean(values, masks):
+        return jnp.sum(values * masks, axis=-1) / jnp.sum(masks, axis=-1)
+
+    # Every fold starts from the same initial params.
+    key = jax.random.PRNGKey(0)
+    shape = ansatz_func.shape(n_layers=n_layers, n_wires=n_qubits)
+    params = jnp.broadcast_to(0.01 * jax.random.normal(key, shape), (k_folds,) + tuple(shape))
+    optimizer = optax.adam(learning_rate=learning_rate)
+    opt_state = jax.vmap(optimizer.init)(params)
+
+    def fold_step(params, opt_state, x, y, mask):
+        loss, grads = jax.value_and_grad(cost)(params, x, y, mask)
+        updates, opt_state = optimizer.update(grads, opt_state)
+        return optax.apply_updates(params, updates), opt_state, loss
+
+    step          = jax.jit(jax.vmap(fold_step, in_axes=(0, 0, None, None, 0)))
+    batch_predict = jax.jit(jax.vmap(predict, in_axes=(0, None)))
+
+    epoch_times = []
+    for i in range(n_epochs):
+        start = time.perf_counter()
+        params, opt_state, losses = step(params, opt_state, X, y, train_masks)
+        losses.block_until_ready()
+        epoch_times.append(time.perf_counter() - start)
+        if progress_update:
+            progress_update(i, n_epochs, losses)
+
+    predictions = batch_predict(params, X)
+    correct     = ((predictions < 0).astype(int) == y).astype(X.dtype)
+    train_accuracies = masked_mean(correct, train_masks)
+    test_accuracies  = masked_mean(correct, test_masks)
+    test_losses      = masked_mean((predictions - labels) ** 2, test_masks)
+
+    folds = [
+        {
+            "fold":              fold,
+            "loss":              float(losses[fold]),
+            "test_loss":         float(test_losses[fold]),
+            "training_accuracy": float(train_accuracies[fold]),
+            "accuracy":          float(test_accuracies[fold]),
+        }
+        for fold in range(k_folds)
+    ]
+    summary = {
+        "k_folds":        k_folds,
+        "folds":          folds,
+        "accuracy_mean":  float(jnp.mean(test_accuracies)),
+        "accuracy_std":   float(jnp.std(test_accuracies)),
+        "loss_mean":      float(jnp.mean(losses)),
+        "loss_std":       float(jnp.std(losses)),
+        "test_loss_mean": float(jnp.mean(test_losses)),
+        "test_loss_std":  float(jnp.std(test_losses)),
+    }
+
+    # The first epoch includes tracing and compilation.
+    steady_epoch_times = epoch_times[1:] or epoch_times
+    epoch_time = sum(steady_epoch_times) / len(steady_epoch_times) if steady_epoch_times else None
+
+    return {
+        "loss":             summary["loss_mean"],
+        "accuracy":         summary["accuracy_mean"],
+        "cross_validation": summary,
+        "instrumentation": {
+            "fold_count":      k_folds,
+            "compile_count":   1,
+            "compile_time":    epoch_times[0] - epoch_time if len(epoch_times) > 1 else None,
+            "epoch_time":      epoch_time,
+            "cv_time":         time.perf_counter() - cv_start,
+            "dataset_cache":   dataset_source,
+            "data_wait_time":  data_wait_time,
+        },
+    }
+
+
+OPTIMIZERS = {
+    "adam":    optax.adam,
+    "sgd":     optax.sgd,
+    "rmsprop": optax.rmsprop,
+    "adagrad": optax.adagrad,
+}
+
+
+def expand_search_space(search_space: dict, default_n_layers: int) -> list[dict]:
+    """
+    Turns a hyperparameter search space into the list of candidate configurations.
+
+    Grid search takes the cartesian product of ``learning_rates``, ``optimizers`` and
+    ``layer_counts``. Random search draws ``sample_count`` candidates, sampling the
+    learning rate log-uniformly from the ``[low, high]`` range given in ``learning_rates``.
+
+    :param search_space: Search space as sent by the API.
+    :param default_n_layers: Layer count used if the search space does not define any.
+    :return: List of dictionaries with ``optimizer``, ``learning_rate`` and ``n_layers``.
+    """
+    learning_rates = search_space["learning_rates"]
+    optimizers     = search_space.get("optimizers") or ["adam"]
+    layer_counts   = search_space.get("layer_counts") or [default_n_layers]
+
+    for name in optimizers:
+        if name not in OPTIMIZERS:
+            raise ValueError(f"Unbekannter Optimizer: {name}")
+
+    if search_space.get("strategy", "grid") == "random":
+        low, high = learning_rates
+        rng = np.random.default_rng(search_space.get("seed", 0))
+        return [
+            {
+                "optimizer":     str(rng.choice(optimizers)),
+                "learning_rate": float(np.exp(rng.uniform(np.log(low), np.log(high)))),
+                "n_layers":      int(rng.choice(layer_counts)),
+            }
+            for _ in range(search_space.get("sample_count", 10))
+        ]
+
+    return [
+        {"optimizer": name, "learning_rate": float(lr), "n_layers": int(layers)}
+        for name, lr, layers in product(optimizers, learning_rates, layer_counts)
+    ]
+
+
+def run_hyperparameter_search(ansatz_id: int, dataset_id: int, encoding_id: int, n_qubits: int, measure_wire: int, search_space: dict, n_epochs=100, n_layers=2, progress_update=None, reduction=None, encoding_circuit=None) -> dict:
+    """
+    Trains all candidates of a hyperparameter search space in one job.
+
+    Candidates sharing optimizer and layer count form a group. A group is trained as
+    one vmapped batch of params and ``optax.inject_hyperparams`` states whose learning
+    rate is a per-candidate array, so each group compiles its step function once no
+    matter how many learning rates it contains.
+
+    :return: Dictionary with the ``candidates`` table, the ``best`` candidate (highest
+             test accuracy, then lowest loss), its ``loss``/``accuracy`` and instrumentation.
+    """
+    search_start = time.perf_counter()
+    ansatz_func   = loading.load_ansatz_by_id(ansatz_id)
+    encoding_spec = loading.load_encoding_from_db(encoding_id, n_qubits, encoding_circuit)
+    amplitude_count = encoding_spec["state_prep"][1] if encoding_spec.get("state_prep") else None
+    (X_train, X_test, y_train, y_test), dataset_source = loading.load_cached_dataset(dataset_id, n_qubits, reduction, amplitude_count)
+    data_wait_time = time.perf_counter() - search_start
+    circuit       = build_circuit(encoding_spec, ansatz_func, n_qubits, measure_wire)
+    candidates    = expand_search_space(search_space, n_layers)
+
+    groups = {}
+    for index, candidate in enumerate(candidates):
+        groups.setdefault((candidate["optimizer"], candidate["n_layers"]), []).append(index)
+
+    def predict(params, x):
+        return jax.vmap(lambda xi: circuit(xi, params))(x)
+
+    def cost(params, x, y):
+        labels = 1 - 2 * y  # map {0,1} → {+1, -1}
+        return jnp.mean((predict(params, x) - labels) ** 2)
+
+    def accuracy(predictions, y):
+        return jnp.mean((predictions < 0).astype(int) == y, axis=-1)
+
+    key = jax.random.PRNGKey(0)
+    table = [None] * len(candidates)
+    total_epochs = len(groups) * n_epochs
+
+    for group_index, ((optimizer_name, group_layers), indices) in enumerate(groups.items()):
+        learning_rates = jnp.asarray([candidates[index]["learning_rate"] for index in indices])
+
+        # Every candidate starts from the same initial params.
+        shape = ansatz_func.shape(n_layers=group_layers, n_wires=n_qubits)
+        params = jnp.broadcast_to(0.01 * jax.random.normal(key, shape), (len(indices),) + tuple(shape))
+        optimizer = optax.inject_hyperparams(OPTIMIZERS[optimizer_name])(learning_rate=candidates[indices[0]]["learning_rate"])
+        opt_state = jax.vmap(optimizer.init)(params)
+        opt_state = opt_state._replace(hyperparams={**opt_state.hyperparams, "learning_rate": learning_rates})
+
+        def candidate_step(params, opt_state, x, y):
+            loss, grads = jax.value_and_grad(cost)(params, x, y)
+            updates, opt_state = optimizer.update(grads, opt_state, params)
+            return optax.apply_updates(params, updates), opt_state, loss
+
+        step          = jax.jit(jax.vmap(candidate_step, in_axes=(0, 0, None, None)))
+        batch_predict = jax.jit(jax.vmap(predict, in_axes=(0, None)))
+
+        if n_epochs < 1:
+            # Nothing to train, the table holds the losses of the initial params
+            losses = jax.vmap(cost, in_axes=(0, None, None))(params, X_train, y_train)
+        for i in range(n_epochs):
+            params, opt_state, losses = step(params, opt_state, X_train, y_train)
+            if progress_update:
+                progress_update(group_index * n_epochs + i, total_epochs, losses)
+
+        train_accuracies = accuracy(batch_predict(params, X_train), y_train)
+        test_accuracies  = accuracy(batch_predict(params, X_test), y_test)
+        for position, index in enumerate(indices):
+            table[index] = {
+                **candidates[index],
+                "loss":              float(losses[position]),
+                "training_accuracy": float(train_accuracies[position]),
+                "accuracy":          float(test_accuracies[position]),
+            }
+
+    best = max(table, key=lambda row: (row["accuracy"], -row["loss"]))
+
+    return {
+        "loss":       best["loss"],
+        "accuracy":   best["accuracy"],
+        "candidates": table,
+        "best":       best,
+        "instrumentation": {
+            "candidate_count": len(candidates),
+            "compile_count":   len(groups),
+            "search_time":     time.perf_counter() - search_start,
+            "dataset_cache":   dataset_source,
+            "data_wait_time":  data_wait_time,
+        },
+    }
@@ -0,0 +1,78 @@
+import threading
+
+import db
+
+
+# Fanout exchange the API broadcasts control messages (e.g. cancellations) on
+CONTROL_EXCHANGE = 'control'
+
+# Runs cancelled while this worker was running; filled by the control consumer on
+# the connection thread and read by the compute thread between epochs. Runs are
+# dropped again once their task finished.
+_cancelled: set = set()
+_lock = threading.Lock()
+
+
+class RunCancelled(Exception):
+    """
+    Raised between two epochs of a run that was cancelled through the API.
+    """
+
+    def __init__(self, run_id):
+        super().__init__(f"Run {run_id} was cancelled")
+        self.run_id = run_id
+
+
+def cancel(run_id):
+    """
+    Marks a run as cancelled, so its training stops at the next epoch.
+
+    :param run_id: The benchmarkRuns id.
+    """
+    with _lock:
+        _cancelled.add(run_id)
+
+
+def is_cancelled(run_id) -> bool:
+    with _lock:
+        return run_id in _cancelled
+
+
+def forget(run_ids):
+    """
+    Drops runs whose task finished, so the set does not grow with every cancellation
+    a long-lived worker sees.
+
+    :param run_ids: The benchmarkRuns ids of the task.
+    """
+    with _lock:
+        _cancelled.difference_update(run_ids)
+
+
+def check(run_id):
+    """
+    Raises ``RunCancelled`` if the run was cancelled.
+
+    :param run_id: The benchmarkRuns id.
+    """
+    if is_cancelled(run_id):
+        raise RunCancelled(run_id)
+
+
+def cancelled_in_db(run_ids: list) -> set:
+    """
+    Returns the runs of a task that were cancelled or deleted before it was dequeued.
+    Best effort: if the DB is not reachable no run counts as cancelled.
+
+    :param run_ids: The benchmarkRuns ids of the task.
+    :return: Set of cancelled run ids.
+    """
+    try:
+        active = {doc["id"] for doc in db.get_db()["benchmarkRuns"].find({"id": {"$in": list(run_ids)}, "status": {"$ne": "cancelled"}}, {"id": 1})}
+    except Exception as e:
+        print(f"Could not check for cancelled runs: {e}", flush=True)
+        return set()
+    cancelled = set(run_ids) - active
+    for run_id in cancelled:
+        cancel(run_id)
+    return cancelled
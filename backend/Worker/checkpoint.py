@@ -0,0 +1,118 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/tmp/checkpoints")
+
+
+def config_key(config: dict) -> str:
+    """
+    Returns a short digest of the training configuration of a run. It is part of the
+    checkpoint path, so a run resubmitted under the same id with another configuration
+    starts from scratch instead of resuming a foreign training state.
+
+    :param config: Everything the training state depends on as plain Python values
+                   (not the epoch budget, which grows between the rungs of a sweep).
+    :return: Hex digest of the configuration.
+    """
+    return hashlib.sha1(repr(sorted(config.items())).encode()).hexdigest()[:16]
+
+
+def checkpoint_path(run_id, config: str) -> str:
+    """
+    Returns the path of the checkpoint file of a benchmark run.
+
+    :param run_id: The benchmarkRuns id.
+    :param config: The ``config_key`` of the run.
+    :return: Path of the ``.npz`` checkpoint file.
+    """
+    return os.path.join(CHECKPOINT_DIR, f"run_{run_id}_{config}.npz")
+
+
+def save_checkpoint(run_id, config: str, params, opt_state, key, epoch: int, training_losses: list[float]):
+    """
+    Stores the training state of a run as a single ``.npz`` file.
+
+    Params and optimizer state are stored as their flattened pytree leaves; the tree
+    structure is rebuilt from a freshly initialised state on load. The file is written
+    to a temporary path first and then renamed, so a crash never leaves a partial
+    checkpoint behind.
+
+    :param run_id: The benchmarkRuns id.
+    :param config: The ``config_key`` of the run.
+    :param params: Current circuit parameters.
+    :param opt_state: Current optax optimizer state.
+    :param key: Current PRNG key.
+    :param epoch: Number of completed epochs.
+    :param training_losses: Loss history of the completed epochs.
+    """
+    # Imported here, the worker process deletes checkpoints without loading jax
+    import jax
+
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    leaves = jax.tree_util.tree_leaves((params, opt_state))
+    arrays = {f"leaf_{index}": np.asarray(leaf) for index, leaf in enumerate(leaves)}
+
+    path = checkpoint_path(run_id, config)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(
+            f,
+            key             = np.asarray(key),
+            epoch           = np.int64(epoch),
+            training_losses = np.asarray(training_losses, dtype=np.float64),
+            **arrays
+        )
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(run_id, config: str, params, opt_state) -> dict | None:
+    """
+    Loads the latest checkpoint of a run.
+
+    :param run_id: The benchmarkRuns id.
+    :param config: The ``config_key`` of the run.
+    :param params: Freshly initialised params, used as the pytree template.
+    :param opt_state: Freshly initialised optimizer state, used as the pytree template.
+    :return: Dictionary with params, opt_state, key, epoch and training_losses or None
+             if no (compatible) checkpoint exists.
+    """
+    import jax
+
+    path = checkpoint_path(run_id, config)
+    if not os.path.exists(path):
+        return None
+
+    treedef = jax.tree_util.tree_structure((params, opt_state))
+    with np.load(path) as data:
+        leaf_count = len([name for name in data.files if name.startswith("leaf_")])
+        if leaf_count != treedef.num_leaves:
+            print(f"Ignoring incompatible checkpoint {path}.", flush=True)
+            return None
+
+        leaves = [data[f"leaf_{index}"] for index in range(leaf_count)]
+        restored_params, restored_opt_state = jax.tree_util.tree_unflatten(treedef, leaves)
+
+        return {
+            "params":          restored_params,
+            "opt_state":       restored_opt_state,
+            "key":             data["key"],
+            "epoch":           int(data["epoch"]),
+            "training_losses": data["training_losses"].tolist(),
+        }
+
+
+def delete_checkpoint(run_id):
+    """
+    Removes the checkpoints of a run (of any configuration), if there are any.
+
+    :param run_id: The benchmarkRuns id.
+    """
+    for path in glob.glob(os.path.join(CHECKPOINT_DIR, f"run_{run_id}_*.npz*")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,271 @@
+import fcntl
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+DATASET_CACHE_DIR  = os.getenv("DATASET_CACHE_DIR", "/tmp/datasets")
+DATASET_CACHE_SIZE = int(os.getenv("DATASET_CACHE_SIZE", "8"))
+
+# Host-shared segment on a RAM-backed file system (e.g. /dev/shm/datasets), shared
+# by all worker processes and containers that mount it. Disabled if empty.
+SHARED_DATASET_DIR     = os.getenv("SHARED_DATASET_DIR", "")
+SHARED_DATASET_SIZE_MB = int(os.getenv("SHARED_DATASET_SIZE_MB", "1024"))
+
+# Bump whenever the preprocessing in loading.py changes its output, so stale
+# entries of the on-disk store are no longer used.
+PREPROCESSING_VERSION = 1
+
+# In-process LRU in front of the on-disk store: key -> dict of arrays
+_memory_cache: OrderedDict = OrderedDict()
+
+# Leases this process holds on entries of the shared segment: key -> file descriptor
+_leases: dict[str, int] = {}
+
+# Guards the LRU and leases; the per-key locks make a thread that needs an entry
+# wait for another thread (e.g. the prewarmer) that is already building it. A key's
+# lock is dropped once no thread uses it: key -> [lock, number of users]
+_lock = threading.Lock()
+_key_locks: dict[str, list] = {}
+
+LEASE_FILE = ".lease"
+
+
+def dataset_key(dataset_id: int, n_qubits: int, version: str = "", variant: str = "") -> str:
+    """
+    Returns the store key of a preprocessed dataset.
+
+    :param dataset_id: The dataset id.
+    :param n_qubits: The qubit count the dataset was preprocessed for.
+    :param version: Content version of the dataset (set for uploaded datasets).
+    :param variant: Preprocessing variant, e.g. ``native`` or the name of a feature reduction.
+    :return: Key consisting of dataset id, qubit count, variant, preprocessing and content version.
+    """
+    key = f"dataset_{dataset_id}_q{n_qubits}"
+    if variant:
+        key = f"{key}_{variant}"
+    key = f"{key}_v{PREPROCESSING_VERSION}"
+    return f"{key}_{version}" if version else key
+
+
+def reduction_key(dataset_id: int, method: str, n_native: int, version: str = "") -> str:
+    """
+    Returns the store key of a fitted feature reduction. A fit covers every feature
+    count, so it is shared by all qubit counts of a dataset.
+
+    :param dataset_id: The dataset id.
+    :param method: The reduction method.
+    :param n_native: Native feature count the reduction was fitted on.
+    :param version: Content version of the dataset (set for uploaded datasets).
+    :return: Key consisting of dataset id, method, native feature count and versions.
+    """
+    key = f"reduction_{dataset_id}_{method}_d{n_native}_v{PREPROCESSING_VERSION}"
+    return f"{key}_{version}" if version else key
+
+
+def _remember(key: str, arrays: dict):
+    _memory_cache[key] = arrays
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > DATASET_CACHE_SIZE:
+        evicted, _ = _memory_cache.popitem(last=False)
+        _release(evicted)
+
+
+@contextmanager
+def _key_lock(key: str):
+    with _lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+
+def _read(directory: str, names: list[str]) -> dict:
+    # Memory-mapped, so only the pages that are actually used get read
+    return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in names}
+
+
+def _write(directory: str, arrays: dict, lease: bool = False):
+    # Write into a private directory first and rename it, so readers never see a
+    # partially written entry.
+    temp_directory = f"{directory}.tmp-{os.getpid()}"
+    os.makedirs(temp_directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_directory, f"{name}.npy"), np.asarray(array))
+    if lease:
+        open(os.path.join(temp_directory, LEASE_FILE), "w").close()
+    try:
+        os.rename(temp_directory, directory)
+    except OSError:
+        # Another process stored the same entry in the meantime
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+#
+#   Host-shared segment.
+#
+#   One process populates an entry (under a per-key lock), all others attach to it
+#   read-only through memory maps, so co-located workers share a single copy of
+#   every dataset. Each attached process holds a shared flock on the entry's lease
+#   file; the kernel drops it when the process exits, so the flock holders are the
+#   reference count and crashed workers never leak references. Entries beyond the
+#   size budget are evicted least recently used first, but only once no process
+#   holds a lease on them.
+#
+@contextmanager
+def _locked(name: str):
+    directory = os.path.join(SHARED_DATASET_DIR, ".locks")
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _lease(directory: str) -> int | None:
+    # Returns a file descriptor holding a shared lock on the entry or None if the
+    # entry does not exist (anymore).
+    path = os.path.join(directory, LEASE_FILE)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        # The entry may have been evicted while waiting for the lock
+        current = os.stat(path).st_ino == os.fstat(fd).st_ino
+    except FileNotFoundError:
+        current = False
+    if not current:
+        os.close(fd)
+        return None
+    # The modification time of the lease file orders the entries for eviction
+    os.utime(path)
+    return fd
+
+
+def _release(key: str):
+    fd = _leases.pop(key, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def _entry_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def evict_shared(keep: str | None = None):
+    """
+    Evicts unreferenced entries of the shared segment, least recently used first,
+    until it fits into ``SHARED_DATASET_SIZE_MB``.
+
+    :param keep: Key of an entry that must not be evicted (e.g. the one just added).
+    """
+    with _locked("evict"):
+        entries = []
+        for entry in os.scandir(SHARED_DATASET_DIR):
+            lease_path = os.path.join(entry.path, LEASE_FILE)
+            if entry.name.startswith(".") or entry.name == keep or not os.path.exists(lease_path):
+                continue
+            entries.append((os.stat(lease_path).st_mtime, entry.name, entry.path))
+
+        budget = SHARED_DATASET_SIZE_MB * 2 ** 20
+        total = sum(_entry_size(entry.path) for entry in os.scandir(SHARED_DATASET_DIR) if entry.is_dir() and not entry.name.startswith("."))
+
+        for _, name, directory in sorted(entries):
+            if total <= budget:
+                break
+            fd = os.open(os.path.join(directory, LEASE_FILE), os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still attached by some process
+                os.close(fd)
+                continue
+            size = _entry_size(directory)
+            evicted_directory = os.path.join(SHARED_DATASET_DIR, f".evicted-{name}-{os.getpid()}")
+            os.rename(directory, evicted_directory)
+            os.close(fd)
+            shutil.rmtree(evicted_directory, ignore_errors=True)
+            total -= size
+
+
+def _shared_arrays(key: str, load) -> tuple[dict, str]:
+    directory = os.path.join(SHARED_DATASET_DIR, key)
+    source = "shared"
+
+    fd = _lease(directory)
+    if fd is None:
+        os.makedirs(SHARED_DATASET_DIR, exist_ok=True)
+        with _locked(key):
+            fd = _lease(directory)
+            if fd is None:
+                arrays, source = load()
+                try:
+                    _write(directory, arrays, lease=True)
+                except OSError as e:
+                    # Segment full: serve this process from the on-disk store
+                    print(f"Could not add {key} to the shared dataset segment: {e}", flush=True)
+                    shutil.rmtree(f"{directory}.tmp-{os.getpid()}", ignore_errors=True)
+                    return arrays, source
+                fd = _lease(directory)
+                if fd is None:
+                    # Evicted right after it was written
+                    return arrays, source
+        evict_shared(keep=key)
+
+    with _lock:
+        _release(key)
+        _leases[key] = fd
+    names = [file[:-len(".npy")] for file in os.listdir(directory) if file.endswith(".npy")]
+    return _read(directory, names), source
+
+
+def _stored_arrays(key: str, build) -> tuple[dict, str]:
+    directory = os.path.join(DATASET_CACHE_DIR, key)
+    source = "disk"
+    if not os.path.isdir(directory):
+        source = "miss"
+        arrays = build()
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        _write(directory, arrays)
+        names = list(arrays)
+    else:
+        names = [file[:-len(".npy")] for file in os.listdir(directory) if file.endswith(".npy")]
+
+    return _read(directory, names), source
+
+
+def cached_arrays(key: str, build) -> tuple[dict, str]:
+    """
+    Returns named arrays from the in-process LRU, the host-shared segment or the
+    on-disk store, building and storing them on a miss.
+
+    :param key: Store key, see ``dataset_key``.
+    :param build: Function returning a dict of numpy arrays, called on a miss.
+    :return: Tuple ``(arrays, source)`` where source is ``memory``, ``shared``,
+             ``disk`` or ``miss``.
+    """
+    with _key_lock(key):
+        with _lock:
+            if key in _memory_cache:
+                _memory_cache.move_to_end(key)
+                return _memory_cache[key], "memory"
+
+        if SHARED_DATASET_DIR:
+            arrays, source = _shared_arrays(key, lambda: _stored_arrays(key, build))
+        else:
+            arrays, source = _stored_arrays(key, build)
+
+        with _lock:
+            _remember(key, arrays)
+        return arrays, source
@@ -0,0 +1,250 @@
+import csv
+import os
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+
+import numpy as np
+
+
+#
+#   Dataset providers.
+#
+#   Every provider imports the libraries it needs lazily, so a worker only pays the
+#   import cost (pennylane datasets, scikit-learn, scikit-image) of the datasets it
+#   actually serves. The ids and names match the 'datasets' collection seeded from
+#   MongoDB/init/json/dataset.json.
+#
+@dataclass(frozen=True)
+class DatasetProvider:
+    id:         int
+    name:       str
+    # Loads the dataset for a qubit count: (n_qubits, native=False) -> (X_train, X_test, y_train, y_test).
+    # With native=True the features keep their original resolution, so a feature
+    # reduction (see preprocessing.py) can map them onto the qubit count instead.
+    load:       Callable[..., tuple]
+    # Relative cost of loading and preprocessing (1 = in-memory, 3 = download + HDF5)
+    cost:       int
+    # Number of classes after filtering
+    classes:    int
+    # Highest qubit count the dataset can be prepared for (None = no fixed limit)
+    max_qubits: int | None = None
+    # Identifies the content of uploaded datasets, whose ids can be reused
+    version:    str = ""
+
+
+def split(X, y):
+    from sklearn.model_selection import train_test_split
+    return train_test_split(X, y, test_size=0.2, random_state=42)
+
+
+def load_bars_and_stripes(n_qubits: int, native: bool = False):
+    # Reference: https://pennylane.ai/datasets/bars-and-stripes
+    import pennylane as qml
+    import preprocessing
+
+    key = str(n_qubits)
+    [ds] = qml.data.load("other", name="bars-and-stripes")
+    if key not in ds.train:
+        raise ValueError(f"Bars-and-Stripes nicht für {n_qubits} Qubits verfügbar! Verfügbare: {list(ds.train.keys())}")
+    X = ds.train[key]['inputs']
+    Y = ds.train[key]['labels']
+    X_flat = preprocessing.images_to_features(np.reshape(X, (len(X), n_qubits, n_qubits)))
+    X_train, X_test, y_train, y_test = split(X_flat, Y)
+    # Labels von -1/+1 auf 0/1 mappen
+    y_train = np.array(y_train)
+    y_test = np.array(y_test)
+    y_train = ((y_train + 1) // 2).astype(int)
+    y_test = ((y_test + 1) // 2).astype(int)
+    return X_train, X_test, y_train, y_test
+
+
+def load_digits(n_qubits: int, native: bool = False):
+    # Reference: https://scikit-learn.org/stable/modules/generated/sklearn.datasets.load_digits.html
+    from sklearn import datasets as sklearn_datasets
+    import preprocessing
+
+    digits = sklearn_datasets.load_digits()
+    X_full = digits.images
+    y_full = digits.target
+    mask = (y_full == 0) | (y_full == 1)
+    X_img = X_full[mask]
+    y = y_full[mask]
+    # Dynamische Zielgröße abhängig von n_qubits
+    side = None if native else int(np.sqrt(2 ** n_qubits))
+    X_flat = preprocessing.images_to_features(X_img, side)
+    return split(X_flat, y)
+
+
+def load_binary_blobs(n_qubits: int, native: bool = False):
+    # Reference: https://pennylane.ai/datasets/binary-blobs
+    import pennylane as qml
+    import preprocessing
+
+    [ds] = qml.data.load("other", name="binary-blobs")
+    X = ds.train['inputs']
+    y = ds.train['labels']
+    # Filter only labels 0 and 1
+    mask = (y == 0) | (y == 1)
+    X_filtered = X[mask]
+    y_filtered = y[mask]
+    # Dynamisch die Seitenlänge bestimmen
+    side = int(np.sqrt(len(X_filtered[0])))
+    X_flat = preprocessing.images_to_features(np.reshape(X_filtered, (len(X_filtered), side, side)))
+    return split(X_flat, y_filtered)
+
+
+def load_wine(n_qubits: int, native: bool = False):
+    # Reference: https://scikit-learn.org/stable/modules/generated/sklearn.datasets.load_wine.html#sklearn.datasets.load_wine
+    from sklearn import datasets as sklearn_datasets
+
+    wine = sklearn_datasets.load_wine()
+    X_full = wine.data
+    y_full = wine.target
+    mask = (y_full == 0) | (y_full == 1)
+
+    if len(X_full[0]) < n_qubits:
+        raise ValueError(f'Wine dataset has a maximum of {len(X_full[0])} input parameters ({n_qubits = }).')
+
+    X = np.array(X_full[mask])
+    y = np.array(y_full[mask])
+    return split(X, y)
+
+
+DATASETS: dict[int, DatasetProvider] = {
+    1: DatasetProvider(id=1, name="Bars and Stribes", load=load_bars_and_stripes, cost=3, classes=2),
+    2: DatasetProvider(id=2, name="Digits",           load=load_digits,           cost=2, classes=2),
+    3: DatasetProvider(id=3, name="Binary Blobs",     load=load_binary_blobs,     cost=3, classes=2),
+    4: DatasetProvider(id=4, name="Wine",             load=load_wine,             cost=1, classes=2, max_qubits=13),
+}
+
+
+#
+#   Uploaded datasets.
+#
+#   Files uploaded through the API live in the GridFS bucket 'userDatasets' and are
+#   described by an entry with source 'upload' in the 'datasets' collection. They are
+#   downloaded chunk by chunk next to the dataset cache and parsed from there, the
+#   preprocessed splits then go through the regular dataset cache.
+#
+UPLOAD_BUCKET     = "userDatasets"
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def fetch_upload(doc: dict) -> str:
+    """
+    Downloads the file of an uploaded dataset into the local upload directory, unless
+    it is already there.
+
+    :param doc: The 'datasets' entry of the upload.
+    :return: Path of the local copy.
+    """
+    import dataset_cache
+    import db
+    from gridfs import GridFSBucket
+
+    directory = os.path.join(dataset_cache.DATASET_CACHE_DIR, "uploads")
+    path = os.path.join(directory, f"{doc['file_id']}.{doc['format']}")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    bucket = GridFSBucket(db.get_db(), bucket_name=UPLOAD_BUCKET)
+    with bucket.open_download_stream(doc["file_id"]) as stream, open(temp_path, "wb") as f:
+        while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+            f.write(chunk)
+    os.replace(temp_path, path)
+    return path
+
+
+def read_upload(path: str, format: str, label_column: str):
+    """
+    Parses a downloaded upload into a feature matrix and raw labels.
+
+    :param path: Path of the local copy.
+    :param format: One of ``csv``, ``npy`` or ``parquet``.
+    :param label_column: Name of the label column (the last column for ``npy``).
+    :return: Tuple ``(X, labels)``.
+    """
+    if format == "npy":
+        data = np.load(path, mmap_mode="r")
+        return np.asarray(data[:, :-1], dtype=np.float64), np.asarray(data[:, -1])
+
+    if format == "csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f))
+        label_index = header.index(label_column)
+        feature_indices = [index for index in range(len(header)) if index != label_index]
+        X = np.loadtxt(path, delimiter=",", skiprows=1, usecols=feature_indices, dtype=np.float64, ndmin=2, encoding="utf-8")
+        labels = np.loadtxt(path, delimiter=",", skiprows=1, usecols=label_index, dtype=str, ndmin=1, encoding="utf-8")
+        return X, labels
+
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    labels = table.column(label_column).to_numpy()
+    X = np.column_stack([table.column(name).to_numpy() for name in table.column_names if name != label_column]).astype(np.float64)
+    return X, labels
+
+
+def load_upload(doc: dict, n_qubits: int, native: bool = False):
+    X, labels = read_upload(fetch_upload(doc), doc["format"], doc["label_column"])
+    # Labels are mapped to 0/1 in sorted order, the same order as the class
+    # statistics of the upload. The API only accepts binary uploads.
+    classes, y = np.unique(labels, return_inverse=True)
+    if len(classes) != 2:
+        raise ValueError(f"Uploaded dataset '{doc['name']}' has {len(classes)} classes, the classifier needs exactly two")
+    return split(X, y.astype(int))
+
+
+def upload_provider(dataset_id: int) -> DatasetProvider | None:
+    """
+    Builds a provider for a dataset uploaded through the API.
+
+    :param dataset_id: The dataset id.
+    :return: The provider or None if there is no upload with this id.
+    """
+    import db
+
+    doc = db.get_db()["datasets"].find_one({"id": dataset_id, "source": "upload"})
+    if not doc:
+        return None
+
+    return DatasetProvider(
+        id         = dataset_id,
+        name       = doc["name"],
+        load       = partial(load_upload, doc),
+        cost       = 2,
+        classes    = len(doc["class_counts"]),
+        max_qubits = doc["feature_count"],
+        version    = str(doc["file_id"]),
+    )
+
+
+def register_dataset(provider: DatasetProvider):
+    """
+    Adds a dataset provider to the registry (or replaces the one with the same id).
+
+    :param provider: The provider to register.
+    """
+    DATASETS[provider.id] = provider
+
+
+def get_provider(dataset_id: int, n_qubits: int | None = None) -> DatasetProvider:
+    """
+    Looks up the provider of a dataset and checks that it supports the qubit count.
+    Ids that are not registered are looked up among the uploaded datasets.
+
+    :param dataset_id: The dataset id.
+    :param n_qubits: The requested qubit count, if known.
+    :return: The registered provider.
+    """
+    provider = DATASETS.get(dataset_id) or upload_provider(dataset_id)
+
+    if not provider:
+        raise ValueError(f"Unbekannte dataset_id: {dataset_id}")
+
+    if n_qubits is not None and provider.max_qubits is not None and n_qubits > provider.max_qubits:
+        raise ValueError(f'{provider.name} dataset supports at most {provider.max_qubits} qubits ({n_qubits = }).')
+
+    return provider
@@ -1,14 +1,20 @@
 from pymongo import MongoClient
 import os
 
+# One pooled client per process. MongoClient is thread-safe and keeps its own
+# connection pool, so it is created once instead of on every call.
+_clients: dict[str, MongoClient] = {}
+
 def get_db():
     """
-    Establish and return a connection to the MongoDB 'Quantum-Encoding-DB' database.
+    Return the MongoDB 'Quantum-Encoding-DB' database of the process-wide pooled client.
 
     Returns:
         Database object representing 'Quantum-Encoding-DB'.
     """
     url =  os.getenv("MONGO_URI", "mongodb://host.docker.internal:27017/")
-    client = MongoClient(url)
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = MongoClient(url)
     db = client["Quantum-Encoding-DB"]
-    return db
\ No newline at end of file
+    return db
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pennylane as qml
+
+
+ENCODING_CACHE_SIZE = int(os.getenv("ENCODING_CACHE_SIZE", "64"))
+# Seconds a content version read from the DB is trusted before the encoding is read again
+ENCODING_CACHE_TTL  = float(os.getenv("ENCODING_CACHE_TTL", "300"))
+
+GATE_OPERATIONS = {
+    'RY':   qml.RY,
+    'RX':   qml.RX,
+    'RZ':   qml.RZ,
+    'H':    qml.Hadamard,
+    'X':    qml.PauliX,
+    'Z':    qml.PauliZ,
+    'CNOT': qml.CNOT,
+}
+
+# Prepares the state of its wires from the normalised amplitude vector of a sample
+AMPLITUDE_GATE = 'AMPLITUDE'
+
+# LRU of compiled encodings: (encoding_id, version) -> encoding spec
+_compiled: OrderedDict = OrderedDict()
+# Latest content version read from the DB: encoding_id -> (version, read at)
+_versions: dict[int, tuple[str, float]] = {}
+# Encodings are resolved from the training loop and the prewarm thread
+_lock = threading.Lock()
+
+
+def content_version(gates) -> str:
+    """
+    Returns a short hash of the gates of an encoding, so edited encodings get a new
+    cache entry.
+
+    :param gates: The gate list of the encoding.
+    :return: Hex digest identifying the content.
+    """
+    return hashlib.sha1(json.dumps(gates, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def compile_encoding(gates: list) -> dict:
+    """
+    Resolves the gate list of an encoding once: gate names are looked up as pennylane
+    operations and ``input_<k>`` params are parsed to feature indices, so tracing a
+    circuit only has to index ``x``.
+
+    An amplitude embedding (only allowed as the first gate) becomes the encoding's
+    ``state_prep``. Its samples start with the ``2 ** len(wires)`` amplitudes followed
+    by the original features (see ``preprocessing.with_amplitudes``), so the input
+    indices of the other gates are shifted behind the amplitudes.
+
+    :param gates: The gate list of the encoding.
+    :return: Encoding spec with the original ``gates``, the ``state_prep`` ``(wires,
+             amplitude_count)`` or None and the compiled ``operations``
+             ``(operation, wires, params)``, where every param is ``(feature_index, None)``
+             or ``(None, constant)``.
+    """
+    operations = []
+    state_prep = None
+    offset = 0
+    for gate_index, gate in enumerate(gates):
+        gate_type = gate.get('gate')
+        if gate_type == AMPLITUDE_GATE:
+            if gate_index != 0:
+                raise ValueError("Amplitude-Embedding muss das erste Gate sein")
+            wires = list(gate.get('wires', []))
+            offset = 2 ** len(wires)
+            state_prep = (wires, offset)
+            continue
+
+        operation = GATE_OPERATIONS.get(gate_type)
+        if operation is None:
+            raise ValueError(f"Unbekanntes Gate: {gate_type}")
+
+        params = []
+        for p in gate.get('params', []):
+            if isinstance(p, (int, float)):
+                params.append((None, p))
+            elif isinstance(p, str):
+                m = re.match(r"input_(\d+)", p)
+                if not m:
+                    raise ValueError(f"Unbekanntes params-Format: {p}")
+                params.append((int(m.group(1)) + offset, None))
+            else:
+                raise ValueError(f"Unbekannter Parametertyp: {type(p)}")
+
+        operations.append((operation, list(gate.get('wires', [])), tuple(params)))
+
+    return {"gates": gates, "state_prep": state_prep, "operations": operations}
+
+
+def _remember(key: tuple, spec: dict) -> dict:
+    _compiled[key] = spec
+    _compiled.move_to_end(key)
+    while len(_compiled) > ENCODING_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return spec
+
+
+def resolve_encoding(encoding_id: int, fetch, gates: list | None = None) -> dict:
+    """
+    Returns the compiled encoding, compiling it only once per content version.
+
+    :param encoding_id: The encoding id.
+    :param fetch: Function returning the gate list from the DB. It is only called when
+                  no gates are given and the known version is older than ``ENCODING_CACHE_TTL``.
+    :param gates: Gate list embedded in the task, if any. Skips the DB entirely.
+    :return: Compiled encoding spec, see ``compile_encoding``.
+    """
+    with _lock:
+        if gates is None:
+            known = _versions.get(encoding_id)
+            if known and time.monotonic() - known[1] < ENCODING_CACHE_TTL and (encoding_id, known[0]) in _compiled:
+                key = (encoding_id, known[0])
+                _compiled.move_to_end(key)
+                return _compiled[key]
+
+            gates = fetch()
+            _versions[encoding_id] = (content_version(gates), time.monotonic())
+
+        key = (encoding_id, content_version(gates))
+        if key in _compiled:
+            _compiled.move_to_end(key)
+            return _compiled[key]
+        return _remember(key, compile_encoding(gates))
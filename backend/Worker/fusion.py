@@ -0,0 +1,21 @@
+def fuse_key(message_dict: dict, retried: bool = False):
+    """
+    Returns the key under which a task can be fused with others, or None if it has to
+    run alone. Only plain benchmark tasks on their first delivery are fused: retried
+    and redelivered tasks may have a checkpoint to resume from, and warm-started runs
+    do not start from the shared initial params.
+
+    :param message_dict: The decoded task.
+    :param retried: Whether the task message was retried or redelivered.
+    """
+    if message_dict.get("task_type", "benchmark") != "benchmark" or message_dict.get("warm_start_params") is not None:
+        return None
+    if retried:
+        return None
+    return (
+        message_dict.get("data_id"),
+        message_dict.get("ansatz_id"),
+        message_dict.get("qubit_count"),
+        message_dict.get("measure_index"),
+        repr(message_dict.get("reduction")),
+    )
@@ -1,76 +1,150 @@
-import pennylane as qml
 import jax.numpy as jnp
 import numpy as np
-from sklearn.datasets import load_digits, load_wine
-from sklearn.model_selection import train_test_split
-from skimage.transform import resize
 
 import ansaetze
+import dataset_cache
+import datasets
 import db
+import encoding_cache
+import preprocessing
 
 
 def load_dataset_by_id(dataset_id: int, n_qubits: int):
-    key = str(n_qubits)
-    if dataset_id == 1:
-        # Reference: https://pennylane.ai/datasets/bars-and-stripes
-        [ds] = qml.data.load("other", name="bars-and-stripes")
-        if key not in ds.train:
-            raise ValueError(f"Bars-and-Stripes nicht für {n_qubits} Qubits verfügbar! Verfügbare: {list(ds.train.keys())}")
-        X = ds.train[key]['inputs']
-        Y = ds.train[key]['labels']
-        X_img = np.array([np.reshape(x, (n_qubits, n_qubits)) for x in X])
-        X_flat = X_img.reshape((X_img.shape[0], -1)) / X_img.max()
-        X_train, X_test, y_train, y_test = train_test_split(X_flat, Y, test_size=0.2, random_state=42)
-        # Labels von -1/+1 auf 0/1 mappen
-        y_train = np.array(y_train)
-        y_test = np.array(y_test)
-        y_train = ((y_train + 1) // 2).astype(int)
-        y_test = ((y_test + 1) // 2).astype(int)
-    elif dataset_id == 2:
-        # Reference: https://scikit-learn.org/stable/modules/generated/sklearn.datasets.load_digits.html
-        digits = load_digits()
-        X_full = digits.images
-        y_full = digits.target
-        mask = (y_full == 0) | (y_full == 1)
-        X_img = X_full[mask]
-        y = y_full[mask]
-        # Dynamische Zielgröße abhängig von n_qubits
-        side = int(np.sqrt(2 ** n_qubits))
-        X_small = np.array([resize(img, (side, side), mode='reflect') for img in X_img])
-        X_flat = X_small.reshape((X_small.shape[0], -1)) / X_small.max()
-        X_train, X_test, y_train, y_test = train_test_split(X_flat, y, test_size=0.2, random_state=42)
-    elif dataset_id == 3:
-        # Reference: https://pennylane.ai/datasets/binary-blobs
-        [ds] = qml.data.load("other", name="binary-blobs")
-        X = ds.train['inputs']
-        y = ds.train['labels']
-        # Filter only labels 0 and 1
-        mask = (y == 0) | (y == 1)
-        X_filtered = X[mask]
-        y_filtered = y[mask]
-        # Dynamisch die Seitenlänge bestimmen
-        side = int(np.sqrt(len(X_filtered[0])))
-        X_img = np.array([np.reshape(x, (side, side)) for x in X_filtered])
-        X_flat = X_img.reshape((X_img.shape[0], -1)) / X_img.max()
-        X_train, X_test, y_train, y_test = train_test_split(X_flat, y_filtered, test_size=0.2, random_state=42)
-    elif dataset_id == 4:
-        # Reference: https://scikit-learn.org/stable/modules/generated/sklearn.datasets.load_wine.html#sklearn.datasets.load_wine
-        wine = load_wine()
-        X_full = wine.data
-        y_full = wine.target
-        mask = (y_full == 0) | (y_full == 1)
-
-        if len(X_full[0]) < n_qubits:
-            raise ValueError(f'Wine dataset has a maximum of {len(X_full[0])} input parameters ({n_qubits = }).')
-
-        X = np.array(X_full[mask])
-        y = np.array(y_full[mask])
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    else:
-        raise ValueError(f"Unbekannte dataset_id: {dataset_id}")
+    """
+    Loads and preprocesses a dataset with the provider registered in ``datasets.DATASETS``.
+
+    :param dataset_id: The dataset id.
+    :param n_qubits: The qubit count to preprocess the dataset for.
+    :return: Tuple ``(X_train, X_test, y_train, y_test)``.
+    """
+    provider = datasets.get_provider(dataset_id, n_qubits)
+    X_train, X_test, y_train, y_test = provider.load(n_qubits)
     return jnp.array(X_train), jnp.array(X_test), jnp.array(y_train), jnp.array(y_test)
 
 
+def cached_dataset_arrays(dataset_id: int, n_qubits: int, reduction: str | None = None, amplitude_count: int | None = None):
+    """
+    Returns the preprocessed splits of a dataset from the dataset cache, preprocessing
+    them with the registered provider only if neither the in-process LRU nor the
+    shared or on-disk store holds them yet.
+
+    With a ``reduction`` the provider loads the dataset at its native resolution and
+    the fitted reduction maps it onto ``n_qubits`` features. The fit is cached per
+    dataset, method and native feature count, so all qubit counts share it.
+
+    With an ``amplitude_count`` (encodings starting with an amplitude embedding) the
+    features are prefixed with their normalised, padded amplitude vectors, which are
+    cached alongside the preprocessed splits.
+
+    :param dataset_id: The dataset id.
+    :param n_qubits: The qubit count to preprocess the dataset for.
+    :param reduction: Optional feature reduction, see ``preprocessing.REDUCTIONS``.
+    :param amplitude_count: Number of amplitudes of an amplitude embedding, if any.
+    :return: Tuple ``(arrays, source)`` with the numpy splits ``X_train``, ``X_test``,
+             ``y_train`` and ``y_test`` and the cache tier they came from.
+    """
+    provider = datasets.get_provider(dataset_id, None if reduction else n_qubits)
+
+    def build():
+        X_train, X_test, y_train, y_test = provider.load(n_qubits)
+        return {"X_train": X_train, "X_test": X_test, "y_train": y_train, "y_test": y_test}
+
+    def build_reduced():
+        native_key = dataset_cache.dataset_key(dataset_id, n_qubits, provider.version, "native")
+        native, _ = dataset_cache.cached_arrays(native_key, lambda: dict(zip(
+            ("X_train", "X_test", "y_train", "y_test"), provider.load(n_qubits, native=True)
+        )))
+
+        n_native = native["X_train"].shape[1]
+        fit_key = dataset_cache.reduction_key(dataset_id, reduction, n_native, provider.version)
+        fit, _ = dataset_cache.cached_arrays(fit_key, lambda: preprocessing.fit_reduction(reduction, native["X_train"], native["y_train"]))
+
+        return {
+            "X_train": preprocessing.apply_reduction(fit, native["X_train"], n_qubits),
+            "X_test":  preprocessing.apply_reduction(fit, native["X_test"], n_qubits),
+            "y_train": native["y_train"],
+            "y_test":  native["y_test"],
+        }
+
+    if reduction and reduction not in preprocessing.REDUCTIONS:
+        raise ValueError(f"Unbekannte Reduktion: {reduction}")
+
+    def features():
+        key = dataset_cache.dataset_key(dataset_id, n_qubits, provider.version, reduction or "")
+        return dataset_cache.cached_arrays(key, build_reduced if reduction else build)
+
+    if not amplitude_count:
+        return features()
+
+    def build_amplitudes():
+        arrays, _ = features()
+        return {
+            "X_train": preprocessing.with_amplitudes(arrays["X_train"], amplitude_count),
+            "X_test":  preprocessing.with_amplitudes(arrays["X_test"], amplitude_count),
+            "y_train": arrays["y_train"],
+            "y_test":  arrays["y_test"],
+        }
+
+    variant = f"{reduction}_amp{amplitude_count}" if reduction else f"amp{amplitude_count}"
+    key = dataset_cache.dataset_key(dataset_id, n_qubits, provider.version, variant)
+    return dataset_cache.cached_arrays(key, build_amplitudes)
+
+
+def load_cached_dataset(dataset_id: int, n_qubits: int, reduction: str | None = None, amplitude_count: int | None = None):
+    """
+    Loads a preprocessed dataset through the dataset cache, see ``cached_dataset_arrays``.
+
+    :param dataset_id: The dataset id.
+    :param n_qubits: The qubit count to preprocess the dataset for.
+    :param reduction: Optional feature reduction, see ``preprocessing.REDUCTIONS``.
+    :param amplitude_count: Number of amplitudes of an amplitude embedding, if any.
+    :return: Tuple ``((X_train, X_test, y_train, y_test), source)`` where source is
+             ``memory``, ``shared``, ``disk`` or ``miss``.
+    """
+    arrays, source = cached_dataset_arrays(dataset_id, n_qubits, reduction, amplitude_count)
+    splits = tuple(jnp.asarray(arrays[name]) for name in ("X_train", "X_test", "y_train", "y_test"))
+    return splits, source
+
+
+def stratified_subsample(X, y, fraction: float, seed: int = 42):
+    """
+    Draws a stratified subsample that keeps the class ratios of ``y``.
+
+    :param X: Feature matrix.
+    :param y: Labels.
+    :param fraction: Fraction of the samples to keep.
+    :param seed: Random seed of the split.
+    :return: Tuple ``(X_subsample, y_subsample)``.
+    """
+    if fraction >= 1:
+        return X, y
+    n_classes = len(np.unique(np.asarray(y)))
+    n_samples = max(int(fraction * len(y)), 2 * n_classes)
+    if n_samples >= len(y):
+        return X, y
+    from sklearn.model_selection import train_test_split
+    X_sub, _, y_sub, _ = train_test_split(np.asarray(X), np.asarray(y), train_size=n_samples, stratify=np.asarray(y), random_state=seed)
+    return jnp.array(X_sub), jnp.array(y_sub)
+
+
+def stratified_folds(y, k_folds: int, seed: int = 42):
+    """
+    Assigns every sample to one of ``k_folds`` stratified folds.
+
+    :param y: Labels.
+    :param k_folds: Number of folds.
+    :param seed: Random seed of the shuffle.
+    :return: Integer array with the fold index of every sample.
+    """
+    from sklearn.model_selection import StratifiedKFold
+    y = np.asarray(y)
+    fold_ids = np.empty(len(y), dtype=int)
+    splitter = StratifiedKFold(n_splits=k_folds, shuffle=True, random_state=seed)
+    for fold, (_, test_indices) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        fold_ids[test_indices] = fold
+    return fold_ids
+
+
 def load_ansatz_by_id(ansatz_id: int):
     ansatz = ansaetze.ANSAETZE[ansatz_id]
 
@@ -80,23 +154,29 @@ def load_ansatz_by_id(ansatz_id: int):
     return ansatz
 
 
-def load_encoding_from_db(encoding_id: int, n_qubits: int = 4) -> dict:
+def load_encoding_from_db(encoding_id: int, n_qubits: int = 4, circuit: list | None = None) -> dict:
+    """
+    Resolves an encoding through the encoding cache.
 
+    :param encoding_id: The encoding id (0 is the built-in RY test encoding).
+    :param n_qubits: The qubit count (only used by the test encoding).
+    :param circuit: Gate list embedded in the task by the API, if any.
+    :return: Compiled encoding spec, see ``encoding_cache.compile_encoding``.
+    """
     if encoding_id == 0:
         # Test-Encoding: RY auf jedem Qubit, jedes Feature auf einen Qubit gemappt
-        return {
-            "gates": [
-                {"gate": "RY", "wires": [i], "params": [f"input_{i}"]} for i in range(n_qubits)
-            ]
-        }
+        circuit = [
+            {"gate": "RY", "wires": [i], "params": [f"input_{i}"]} for i in range(n_qubits)
+        ]
 
-    database = db.get_db()
-    collection = database["encodings"]
-    encoding_doc = collection.find_one({"id": encoding_id})
+    def fetch():
+        database = db.get_db()
+        collection = database["encodings"]
+        encoding_doc = collection.find_one({"id": encoding_id}, {"circuit": 1})
 
-    if not encoding_doc:
-        raise ValueError(f"Encoding mit ID {encoding_id} nicht gefunden")
+        if not encoding_doc:
+            raise ValueError(f"Encoding mit ID {encoding_id} nicht gefunden")
 
-    gates = encoding_doc.get("circuit", {})
+        return encoding_doc.get("circuit", [])
 
-    return {"gates": gates}
+    return encoding_cache.resolve_encoding(encoding_id, fetch, circuit)
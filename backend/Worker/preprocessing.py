@@ -0,0 +1,129 @@
+import numpy as np
+
+
+def images_to_features(images, side: int | None = None):
+    """
+    Turns a stack of images into normalised feature vectors in one vectorized pass.
+
+    The whole stack is resized with a single ``skimage.transform.resize`` call over a
+    ``(n_images, side, side)`` output shape. The image axis keeps its size, so it is
+    neither interpolated nor smoothed and every image is resized exactly as it would be
+    on its own. The images are then flattened and divided by the global maximum.
+
+    :param images: Array of shape ``(n_images, height, width)``.
+    :param side: Target side length, or None to keep the original resolution.
+    :return: Array of shape ``(n_images, side * side)`` with values in ``[0, 1]``.
+    """
+    images = np.asarray(images)
+    if side is not None and images.shape[1:] != (side, side):
+        from skimage.transform import resize
+        images = resize(images, (images.shape[0], side, side), mode='reflect')
+    features = images.reshape((images.shape[0], -1))
+    return features / features.max()
+
+
+#
+#   Feature reduction.
+#
+#   A reduction maps the native features of a dataset onto the requested feature count.
+#   Fitting produces a ranked basis over all native features, so one fit per dataset
+#   and method serves every feature count: the first n columns give the n most
+#   important directions (PCA), n random directions (random projection) or the n
+#   highest scoring features (selection).
+#
+REDUCTIONS = ("pca", "random_projection", "select")
+
+
+def fit_reduction(method: str, X_train, y_train, seed: int = 42) -> dict:
+    """
+    Fits a feature reduction on the training split.
+
+    :param method: One of ``pca``, ``random_projection`` or ``select``.
+    :param X_train: Training features of shape ``(n_samples, n_native_features)``.
+    :param y_train: Training labels (used by ``select`` only).
+    :param seed: Seed of the random projection.
+    :return: Dict with the centering ``mean``, the ranked ``components`` of shape
+             ``(n_native_features, n_native_features)`` and the range (``low``,
+             ``high``) of every projected training feature.
+    """
+    X_train = np.asarray(X_train, dtype=np.float64)
+    n_native = X_train.shape[1]
+
+    if method == "pca":
+        mean = X_train.mean(axis=0)
+        _, _, vt = np.linalg.svd(X_train - mean, full_matrices=False)
+        components = np.zeros((n_native, n_native))
+        components[:, :vt.shape[0]] = vt.T
+    elif method == "random_projection":
+        mean = np.zeros(n_native)
+        components = np.random.default_rng(seed).normal(size=(n_native, n_native))
+    elif method == "select":
+        import warnings
+        from sklearn.feature_selection import f_classif
+        mean = np.zeros(n_native)
+        # Constant features get a NaN score (and a warning) and are ranked last
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            scores, _ = f_classif(X_train, np.asarray(y_train))
+        order = np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind="stable")
+        components = np.eye(n_native)[:, order]
+    else:
+        raise ValueError(f"Unbekannte Reduktion: {method}")
+
+    projected = (X_train - mean) @ components
+    return {"mean": mean, "components": components, "low": projected.min(axis=0), "high": projected.max(axis=0)}
+
+
+def apply_reduction(reduction: dict, X, n_features: int):
+    """
+    Projects features onto the first ``n_features`` columns of a fitted reduction and
+    scales them to ``[0, 1]`` with the range seen on the training split, the same
+    range the image datasets are normalised to.
+
+    :param reduction: Fitted reduction, see ``fit_reduction``.
+    :param X: Features of shape ``(n_samples, n_native_features)``.
+    :param n_features: Requested feature count.
+    :return: Array of shape ``(n_samples, n_features)``.
+    """
+    components = np.asarray(reduction["components"])
+    if n_features > components.shape[1]:
+        raise ValueError(f'Dataset has only {components.shape[1]} features, can not map to {n_features}.')
+
+    low = np.asarray(reduction["low"][:n_features])
+    span = np.asarray(reduction["high"][:n_features]) - low
+    projected = (np.asarray(X, dtype=np.float64) - reduction["mean"]) @ components[:, :n_features]
+    return (projected - low) / np.where(span > 0, span, 1)
+
+
+def amplitude_vectors(X, amplitude_count: int):
+    """
+    Turns feature vectors into amplitude vectors in one vectorized pass: every row is
+    zero padded to ``amplitude_count`` entries and normalised to unit length. All-zero
+    rows become the ``|0...0>`` state.
+
+    :param X: Features of shape ``(n_samples, n_features)``.
+    :param amplitude_count: Number of amplitudes (``2 ** n_wires``).
+    :return: Array of shape ``(n_samples, amplitude_count)``.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.shape[1] > amplitude_count:
+        raise ValueError(f'{X.shape[1]} features do not fit into {amplitude_count} amplitudes.')
+
+    amplitudes = np.zeros((X.shape[0], amplitude_count))
+    amplitudes[:, :X.shape[1]] = X
+    norms = np.linalg.norm(amplitudes, axis=1, keepdims=True)
+    amplitudes = np.divide(amplitudes, norms, out=np.zeros_like(amplitudes), where=norms > 0)
+    amplitudes[norms[:, 0] == 0, 0] = 1
+    return amplitudes
+
+
+def with_amplitudes(X, amplitude_count: int):
+    """
+    Prepends the amplitude vectors to the features, the sample layout expected by
+    encodings starting with an amplitude embedding.
+
+    :param X: Features of shape ``(n_samples, n_features)``.
+    :param amplitude_count: Number of amplitudes (``2 ** n_wires``).
+    :return: Array of shape ``(n_samples, amplitude_count + n_features)``.
+    """
+    return np.hstack([amplitude_vectors(X, amplitude_count), np.asarray(X, dtype=np.float64)])
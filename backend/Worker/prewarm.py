@@ -0,0 +1,79 @@
+import os
+import threading
+
+import db
+import loading
+
+
+# Number of pending runs whose data is prepared ahead of time (0 disables prewarming)
+PREWARM_LOOKAHEAD = int(os.getenv("PREWARM_LOOKAHEAD", "2"))
+# Seconds between two looks at the pending runs while nothing wakes the prewarmer
+PREWARM_INTERVAL  = float(os.getenv("PREWARM_INTERVAL", "5"))
+
+
+def pending_runs(limit: int) -> list[dict]:
+    """
+    Returns the oldest pending benchmark runs.
+
+    :param limit: Maximum number of runs.
+    :return: List of benchmarkRuns documents.
+    """
+    collection = db.get_db()["benchmarkRuns"]
+    projection = {"id": 1, "encoding_id": 1, "data_id": 1, "qubit_count": 1, "reduction": 1}
+    return list(collection.find({"status": "pending"}, projection).sort("id", 1).limit(limit))
+
+
+def prewarm_run(run: dict):
+    """
+    Loads and preprocesses the dataset and resolves the encoding of a run into the
+    worker's caches, so the run finds them there once it is dequeued.
+
+    :param run: The benchmarkRuns document.
+    """
+    n_qubits = int(run.get("qubit_count") or 5)
+    encoding_spec = loading.load_encoding_from_db(int(run["encoding_id"]), n_qubits)
+    amplitude_count = encoding_spec["state_prep"][1] if encoding_spec.get("state_prep") else None
+    loading.cached_dataset_arrays(int(run["data_id"]), n_qubits, run.get("reduction"), amplitude_count)
+
+
+class Prewarmer(threading.Thread):
+    """
+    Background thread that prepares the data of upcoming runs while the current run
+    trains. It only touches MongoDB and the dataset and encoding caches, never the
+    RabbitMQ connection, which belongs to the main thread.
+    """
+
+    def __init__(self, lookahead: int = PREWARM_LOOKAHEAD, interval: float = PREWARM_INTERVAL):
+        super().__init__(name="prewarmer", daemon=True)
+        self.lookahead = lookahead
+        self.interval  = interval
+        self._wake     = threading.Event()
+        # Runs this worker is processing; they may still be listed as pending
+        self._current  = set()
+
+    def wake(self, current_run_ids=()):
+        """
+        Makes the prewarmer look at the pending runs right away, e.g. when a task starts.
+
+        :param current_run_ids: Ids of the runs of the task that just started.
+        """
+        self._current = set(current_run_ids)
+        self._wake.set()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                current = self._current
+                runs = [run for run in pending_runs(self.lookahead + len(current)) if run["id"] not in current][:self.lookahead]
+            except Exception as e:
+                print(f"Prewarm: could not read pending runs: {e}", flush=True)
+                continue
+
+            for run in runs:
+                try:
+                    prewarm_run(run)
+                except Exception as e:
+                    # Best effort: the run reports the error itself once it is processed
+                    print(f"Prewarm of run {run.get('id')} failed: {e}", flush=True)
@@ -0,0 +1,75 @@
+import os
+import time
+
+import numpy as np
+
+from protocol import StatusMessage
+
+
+# A progress message is sent once both limits are reached: at least this many
+# seconds and this fraction of the run since the previous message.
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "2"))
+PROGRESS_STEP     = float(os.getenv("PROGRESS_STEP", "0.01"))
+
+
+class ProgressReporter:
+    """
+    Coalesces the per-epoch progress of a run into a few messages carrying the
+    current loss and an ETA.
+    """
+
+    def __init__(self, run_id, send, interval: float = PROGRESS_INTERVAL, step: float = PROGRESS_STEP):
+        """
+        :param run_id: The benchmarkRuns id the progress belongs to.
+        :param send: Function publishing a progress message (a ``protocol.StatusMessage``).
+        :param interval: Minimum number of seconds between two messages.
+        :param step: Minimum progress (fraction of the run) between two messages.
+        """
+        self.run_id   = run_id
+        self.send     = send
+        self.interval = interval
+        self.step     = step
+        self.last_time     = float("-inf")
+        self.last_progress = 0.0
+        # Reference point of the ETA, taken after the first epoch so compilation
+        # does not distort the rate
+        self.start = None
+
+    def eta(self, progress: float, now: float) -> float | None:
+        """
+        Estimates the seconds left from the rate since the first reported epoch.
+        """
+        if self.start is None:
+            return None
+        start_time, start_progress = self.start
+        if progress <= start_progress:
+            return None
+        return (now - start_time) / (progress - start_progress) * (1 - progress)
+
+    def update(self, epoch_index: int, epoch_count: int, loss=None):
+        """
+        Records a finished epoch and sends a progress message if it is due.
+
+        :param epoch_index: Index of the finished epoch.
+        :param epoch_count: Total number of epochs.
+        :param loss: Current loss; an array (e.g. the losses of a batch of candidates)
+                     is averaged. Only read when a message is sent, so device arrays
+                     are not synchronised every epoch.
+        """
+        now = time.monotonic()
+        progress = (epoch_index + 1) / epoch_count
+        if self.start is None:
+            self.start = (now, progress)
+
+        if now - self.last_time < self.interval or progress - self.last_progress < self.step:
+            return
+
+        self.last_time = now
+        self.last_progress = progress
+        self.send(StatusMessage(
+            id       = self.run_id,
+            status   = 'progress',
+            progress = progress,
+            eta      = self.eta(progress, now),
+            loss     = None if loss is None else float(np.mean(loss))
+        ))
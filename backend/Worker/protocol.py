@@ -0,0 +1,318 @@
+import ast
+import base64
+import json
+import os
+import types
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional, Union, get_args, get_origin, get_type_hints
+
+import numpy as np
+
+
+#
+#   Task/result message protocol.
+#
+#   This file is the single definition of the messages exchanged by the API and
+#   the workers. Worker/protocol.py is a verbatim copy, as the worker image is built
+#   from its own directory; after editing, regenerate it with
+#
+#       cp fastapi_app/protocol.py Worker/protocol.py
+#
+#   (test_run.py fails while the copies differ).
+#
+#   Every message is one of the typed messages below: a ``TaskMessage`` or
+#   ``SweepMessage`` sent to the task lanes, a ``StatusMessage`` sent back on the
+#   result queue and a ``ControlMessage`` broadcast to all workers. They are
+#   serialised as JSON or msgpack dictionaries, named by the AMQP content type, and
+#   tagged with the protocol version in the headers. Numpy arrays (loss curves,
+#   params, predictions) travel as raw bytes with dtype and shape instead of float
+#   lists. Decoding validates a message against its type. Fields are only ever
+#   added: readers ignore fields they do not know and fall back to defaults for
+#   missing ones, so older workers keep running when the API starts sending new
+#   hyperparameters.
+#
+PROTOCOL_VERSION = 1
+VERSION_HEADER   = "x-protocol-version"
+
+JSON    = "application/json"
+MSGPACK = "application/msgpack"
+
+# Format of outgoing messages; incoming ones are read in whatever format they declare
+MESSAGE_FORMAT = os.getenv("MESSAGE_FORMAT", MSGPACK)
+
+ARRAY_KEY = "__ndarray__"
+
+TASK_TYPES    = ("benchmark", "preview", "crossval", "search")
+STATUSES      = ("init", "progress", "done", "pruned", "failed", "cancelled")
+CONTROL_TYPES = ("cancel",)
+
+
+def _matches(value, hint) -> bool:
+    origin = get_origin(hint)
+    if hint is Any:
+        return True
+    if origin in (Union, types.UnionType):
+        return any(_matches(value, arg) for arg in get_args(hint))
+    if hint is type(None):
+        return value is None
+    if origin is list or hint is list:
+        if isinstance(value, np.ndarray):
+            return True
+        if not isinstance(value, (list, tuple)):
+            return False
+        args = get_args(hint)
+        return not args or all(_matches(item, args[0]) for item in value)
+    if origin is dict or hint is dict:
+        return isinstance(value, dict)
+    if isinstance(value, bool) and hint in (int, float):
+        return False
+    if hint is float:
+        return isinstance(value, (int, float, np.integer, np.floating))
+    if hint is int:
+        return isinstance(value, (int, np.integer))
+    return isinstance(value, hint)
+
+
+class Message:
+    """
+    Base of the message types. Instances check the types (and allowed values) of
+    their fields when they are created.
+    """
+
+    def __post_init__(self):
+        hints = get_type_hints(type(self))
+        for message_field in fields(self):
+            value = getattr(self, message_field.name)
+            if not _matches(value, hints[message_field.name]):
+                raise ValueError(f"{type(self).__name__}.{message_field.name}: unexpected value {value!r}")
+            choices = message_field.metadata.get("choices")
+            if choices and value not in choices:
+                raise ValueError(f"{type(self).__name__}.{message_field.name}: {value!r} is not one of {', '.join(choices)}")
+
+    @classmethod
+    def from_dict(cls, message: dict):
+        """
+        Build and validate a message from a decoded dictionary.
+
+        Args:
+            message (dict): The decoded message; unknown fields are ignored.
+
+        Returns:
+            Message: The typed message.
+
+        Raises:
+            ValueError: If a required field is missing or a field has the wrong type.
+        """
+        if not isinstance(message, dict):
+            raise ValueError(f"{cls.__name__} must be a dictionary, got {type(message).__name__}")
+        names = {message_field.name for message_field in fields(cls)}
+        try:
+            return cls(**{key: value for key, value in message.items() if key in names})
+        except TypeError as e:
+            raise ValueError(f"Invalid {cls.__name__}: {e}")
+
+    def to_dict(self) -> dict:
+        """Return the message as a dictionary of builtin values (and numpy arrays)."""
+        def convert(value):
+            if isinstance(value, Message):
+                return value.to_dict()
+            if isinstance(value, list):
+                return [convert(item) for item in value]
+            return value
+        return {message_field.name: convert(getattr(self, message_field.name)) for message_field in fields(self)}
+
+
+@dataclass
+class TaskMessage(Message):
+    """A benchmark, preview, cross-validation or hyperparameter search task of one run."""
+    run_id:        int
+    encoding_id:   int
+    ansatz_id:     int
+    data_id:       int
+    task_type:     str = field(default="benchmark", metadata={"choices": TASK_TYPES})
+    measure_index: int = 0
+    # Qubits of the encoding (0 = unknown, the worker uses its default)
+    qubit_count:   int = 0
+    reduction:     Optional[str] = None
+    # Validated gate list of the encoding, so the worker does not read it from the DB
+    circuit:       Optional[list] = None
+    # Estimates the worker derives the task's memory and time limits from
+    sample_count:  Optional[int] = None
+    cost:          Optional[float] = None
+    k_folds:       Optional[int] = None
+    search_space:  Optional[dict] = None
+    # Parameters of a finished preview a promoted run starts from
+    warm_start_params: Optional[list] = None
+
+
+@dataclass
+class SweepMessage(Message):
+    """A successive-halving sweep over the runs sharing ansatz and dataset."""
+    run_id:    int
+    runs:      list[TaskMessage]
+    task_type: str = field(default="sweep", metadata={"choices": ("sweep",)})
+    reduction_factor: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, message: dict):
+        runs = message.get("runs") if isinstance(message, dict) else None
+        if isinstance(runs, list):
+            message = dict(message, runs=[TaskMessage.from_dict(run) for run in runs])
+        return super().from_dict(message)
+
+
+@dataclass
+class StatusMessage(Message):
+    """Progress, result or failure of a run, sent by the worker on the result queue."""
+    id:       int
+    status:   str = field(metadata={"choices": STATUSES})
+    # Fraction of the epochs done, with the mean loss and the seconds left
+    progress: Optional[float] = None
+    loss:     Optional[float] = None
+    eta:      Optional[float] = None
+    # Result document of a finished or pruned run
+    result:   Optional[dict] = None
+    error:    Optional[str] = None
+    # Resource limit a failed run exceeded: kind, limit and estimate
+    limit:    Optional[dict] = None
+
+
+@dataclass
+class ControlMessage(Message):
+    """A command broadcast to all workers, e.g. the cancellation of a run."""
+    type:   str = field(metadata={"choices": CONTROL_TYPES})
+    run_id: int
+
+
+def parse_task(message: dict) -> Union[TaskMessage, SweepMessage]:
+    """
+    Build and validate the message of a task lane, which is a sweep or a single task.
+
+    Args:
+        message (dict): The decoded message.
+
+    Returns:
+        TaskMessage | SweepMessage: The typed task.
+    """
+    if isinstance(message, dict) and message.get("task_type") == "sweep":
+        return SweepMessage.from_dict(message)
+    return TaskMessage.from_dict(message)
+
+
+def _pack_array(array, binary: bool) -> dict:
+    array = np.ascontiguousarray(array)
+    data = array.tobytes()
+    return {
+        ARRAY_KEY: True,
+        "dtype":   array.dtype.str,
+        "shape":   list(array.shape),
+        "data":    data if binary else base64.b64encode(data).decode("ascii"),
+    }
+
+
+def _unpack_array(value: dict):
+    data = value["data"]
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    return np.frombuffer(data, dtype=np.dtype(value["dtype"])).reshape(value["shape"])
+
+
+def _default(binary: bool):
+    def default(value):
+        # numpy and jax arrays and numpy scalars
+        if hasattr(value, "__array__"):
+            array = np.asarray(value)
+            return _pack_array(array, binary) if array.ndim else array.item()
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+    return default
+
+
+def _object_hook(value: dict):
+    return _unpack_array(value) if value.get(ARRAY_KEY) is True else value
+
+
+def encode(message: Message, content_type: str = None) -> tuple[bytes, str, dict]:
+    """
+    Serialise a message.
+
+    Args:
+        message (Message): The typed message (or a plain dictionary); may contain
+            numpy arrays.
+        content_type (str): ``application/msgpack`` or ``application/json``
+            (default: ``MESSAGE_FORMAT``).
+
+    Returns:
+        tuple: ``(body, content_type, headers)`` for the AMQP message.
+    """
+    content_type = content_type or MESSAGE_FORMAT
+    if isinstance(message, Message):
+        message = message.to_dict()
+    if content_type == MSGPACK:
+        import msgpack
+        body = msgpack.packb(message, default=_default(binary=True), use_bin_type=True)
+    elif content_type == JSON:
+        body = json.dumps(message, default=_default(binary=False)).encode()
+    else:
+        raise ValueError(f"Unsupported content type: {content_type}")
+    return body, content_type, {VERSION_HEADER: PROTOCOL_VERSION}
+
+
+def decode(body: bytes, content_type: str = None, headers: dict = None, message_type=None):
+    """
+    Parse a message. Messages without a content type are JSON or, from producers
+    predating the protocol, a Python dict literal.
+
+    Args:
+        body (bytes): The raw message body.
+        content_type (str): The AMQP content type.
+        headers (dict): The AMQP headers (carry the protocol version).
+        message_type: The expected ``Message`` type, or a function building one from
+            the decoded dictionary such as ``parse_task``. Without it the plain
+            dictionary is returned.
+
+    Returns:
+        The validated message, with arrays restored as numpy arrays.
+
+    Raises:
+        ValueError: If the body can not be parsed or does not match ``message_type``.
+    """
+    message = _parse(body, content_type)
+    if message_type is None:
+        return message
+    return message_type.from_dict(message) if isinstance(message_type, type) else message_type(message)
+
+
+def _parse(body: bytes, content_type: str = None):
+    if content_type == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body, object_hook=_object_hook, raw=False)
+    if content_type == JSON:
+        return json.loads(body, object_hook=_object_hook)
+    if content_type:
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+    text = body.decode()
+    try:
+        return json.loads(text, object_hook=_object_hook)
+    except json.JSONDecodeError:
+        # Literal parsing only, no code is executed
+        try:
+            return ast.literal_eval(text)
+        except (SyntaxError, ValueError) as e:
+            raise ValueError(f"Unreadable message: {e}")
+
+
+def message_version(headers: dict = None) -> int:
+    """Return the protocol version of a message (0 for messages predating the protocol)."""
+    return int((headers or {}).get(VERSION_HEADER, 0))
+
+
+def to_builtin(value):
+    """Convert the numpy arrays of a decoded message into lists, e.g. before storing it in MongoDB."""
+    if isinstance(value, dict):
+        return {key: to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
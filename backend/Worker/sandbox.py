@@ -0,0 +1,438 @@
+import errno
+import os
+import queue
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+
+
+#
+#   Sandboxed task execution.
+#
+#   Tasks are trained in a long-lived child process, so a run that exhausts memory
+#   or never finishes takes down the child instead of the worker with its RabbitMQ
+#   connection and in-flight messages. The worker (parent) keeps all broker I/O and
+#   publishes the messages the child hands it over a socket pair. The child keeps
+#   its caches and compiled models between tasks and is only restarted after it
+#   died or breached a limit.
+#
+#   The prewarmer and the warm-up run in a second, unlimited background process, so
+#   only the task's own allocations count against its limit. They fill the caches
+#   shared through the file system (the dataset store and the XLA compilation cache),
+#   which the task child reads.
+#
+#   Every task gets limits derived from the size of the statevectors it simulates:
+#   reverse-mode differentiation keeps the state after every gate of every sample,
+#   so a run needs about ``samples x gates x 2 ** qubits`` amplitudes at once. Tasks
+#   whose estimate exceeds MEMORY_LIMIT_MB are rejected before the child allocates
+#   anything. Otherwise the child's address space may only grow by a multiple of
+#   the estimate (RLIMIT_AS), and the task is killed once it exceeds its wall-clock
+#   limit, derived from the cost estimate of the API.
+#
+
+# Memory available to one task (0 = the physical memory of the host)
+MEMORY_LIMIT_MB = int(os.getenv("MEMORY_LIMIT_MB", "0"))
+# Allowed growth of the child per task: estimate x factor, but at least MIN_TASK_MEMORY_MB
+MEMORY_SAFETY_FACTOR = float(os.getenv("MEMORY_SAFETY_FACTOR", "2"))
+MIN_TASK_MEMORY_MB   = int(os.getenv("MIN_TASK_MEMORY_MB", "1024"))
+# Bytes of one amplitude (complex64)
+AMPLITUDE_BYTES = 8
+
+# Wall-clock limit: estimated cost / AMPLITUDE_RATE x TIME_LIMIT_FACTOR, clamped to
+# [MIN_TIME_LIMIT, MAX_TIME_LIMIT] seconds. MAX_TIME_LIMIT = 0 disables the limit.
+AMPLITUDE_RATE    = float(os.getenv("AMPLITUDE_RATE", "1e7"))
+TIME_LIMIT_FACTOR = float(os.getenv("TIME_LIMIT_FACTOR", "10"))
+MIN_TIME_LIMIT    = float(os.getenv("MIN_TIME_LIMIT", "600"))
+MAX_TIME_LIMIT    = float(os.getenv("MAX_TIME_LIMIT", "86400"))
+
+# Training budget of the child (see tasks.py), used when a task carries no estimate
+LAYER_COUNT = int(os.getenv("LAYER_COUNT", "10"))
+DEFAULT_QUBIT_COUNT  = 5
+DEFAULT_SAMPLE_COUNT = 1000
+
+SANDBOX_SCRIPT = os.path.abspath(__file__)
+
+# Errors that fail the same way on every attempt (unknown ids, unsupported qubit
+# counts, malformed messages) are dead-lettered right away.
+PERMANENT_ERRORS = (ValueError, SyntaxError)
+
+
+class ResourceLimitExceeded(Exception):
+    """
+    Raised when a task is rejected for or stopped at its memory or wall-clock limit.
+    Permanent: a retry would hit the same limit.
+    """
+    permanent = True
+
+    def __init__(self, kind: str, limit: float, estimate: float | None = None, detail: str = ""):
+        """
+        :param kind: ``memory`` (bytes) or ``time`` (seconds).
+        :param limit: The limit that was exceeded.
+        :param estimate: The estimated requirement of the task, if known.
+        :param detail: What happened, e.g. how the child exited.
+        """
+        message = f"{kind} limit of {limit:.4g} {'bytes' if kind == 'memory' else 's'} exceeded"
+        if estimate is not None:
+            message += f" (estimated {estimate:.4g})"
+        super().__init__(f"{message}: {detail}" if detail else message)
+        self.kind     = kind
+        self.limit    = limit
+        self.estimate = estimate
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "limit": self.limit, "estimate": self.estimate}
+
+
+class TaskFailed(Exception):
+    """
+    An exception raised by a task in the child, rebuilt in the worker.
+    """
+
+    def __init__(self, message: str, permanent: bool):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def physical_memory() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def memory_limit() -> int:
+    """
+    Returns the memory (bytes) one task may use at most.
+    """
+    return MEMORY_LIMIT_MB * 2 ** 20 if MEMORY_LIMIT_MB > 0 else physical_memory()
+
+
+def batch_size(task: dict) -> int:
+    """
+    Returns the number of models a task trains at once (folds, candidates of a group).
+    """
+    task_type = task.get("task_type", "benchmark")
+    if task_type == "crossval":
+        return int(task.get("k_folds") or 1)
+    if task_type == "search":
+        search_space = task.get("search_space") or {}
+        if search_space.get("strategy") == "random":
+            return int(search_space.get("sample_count") or 10)
+        return max(1, len(search_space.get("learning_rates") or []))
+    return 1
+
+
+def estimate_memory(task: dict) -> float:
+    """
+    Estimates the memory (bytes) of the statevectors a task keeps for differentiation.
+
+    :param task: The decoded task; a sweep is estimated by its largest run.
+    """
+    if task.get("task_type") == "sweep":
+        return max(estimate_memory(run) for run in task["runs"])
+
+    n_qubits = int(task.get("qubit_count") or DEFAULT_QUBIT_COUNT)
+    circuit = task.get("circuit")
+    gate_count = len(circuit) if isinstance(circuit, list) else 0
+    gates_per_sample = max(gate_count, n_qubits) + LAYER_COUNT * n_qubits
+    samples = int(task.get("sample_count") or DEFAULT_SAMPLE_COUNT)
+    return float(batch_size(task) * samples * gates_per_sample * 2 ** n_qubits * AMPLITUDE_BYTES)
+
+
+def time_limit(tasks: list[dict]) -> float | None:
+    """
+    Returns the wall-clock limit (seconds) of a task or of a batch of fused tasks, or
+    None if it is disabled.
+    """
+    if MAX_TIME_LIMIT <= 0:
+        return None
+    if any(not task.get("cost") for task in tasks):
+        # Sent by an API predating the estimates
+        return MAX_TIME_LIMIT
+    cost = sum(float(task["cost"]) for task in tasks)
+    return min(MAX_TIME_LIMIT, max(MIN_TIME_LIMIT, cost / AMPLITUDE_RATE * TIME_LIMIT_FACTOR))
+
+
+def check_memory(tasks: list[dict]) -> tuple[float, int]:
+    """
+    Estimates the memory of a task or of a batch of fused tasks (trained side by side)
+    and rejects it if it can not fit.
+
+    :return: Tuple ``(estimate, allowed growth of the child)`` in bytes.
+    :raises ResourceLimitExceeded: If the estimate exceeds ``memory_limit()``.
+    """
+    estimate = sum(estimate_memory(task) for task in tasks)
+    limit = memory_limit()
+    if estimate > limit:
+        raise ResourceLimitExceeded("memory", limit, estimate, "rejected before training")
+    return estimate, int(min(limit, max(estimate * MEMORY_SAFETY_FACTOR, MIN_TASK_MEMORY_MB * 2 ** 20)))
+
+
+def spawn(mode: str) -> tuple[subprocess.Popen, Connection]:
+    """
+    Starts this script as a child process connected through a socket pair.
+
+    :param mode: ``task`` (see ``serve``) or ``background`` (see ``serve_background``).
+    :return: Tuple ``(process, connection)``.
+    """
+    parent_socket, child_socket = socket.socketpair()
+    process = subprocess.Popen(
+        [sys.executable, SANDBOX_SCRIPT, mode, str(child_socket.fileno())],
+        pass_fds=(child_socket.fileno(),)
+    )
+    child_socket.close()
+    print(f"Sandbox: started {mode} process {process.pid}", flush=True)
+    return process, Connection(parent_socket.detach())
+
+
+class Sandbox:
+    """
+    The worker's handle on the sandbox process and the background process. Used from
+    the compute thread; only ``cancel`` is called from the connection thread.
+    """
+
+    def __init__(self):
+        self.process    = None
+        self.connection = None
+        self.background = None
+        self.background_connection = None
+        self._send_lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Starts the sandbox process.
+        """
+        self.process, self.connection = spawn("task")
+
+    def start_background(self):
+        """
+        Starts the background process, which prewarms upcoming runs and warms up the
+        most common configurations right away. It runs without limits and is not
+        restarted: it only fills caches.
+        """
+        self.background, self.background_connection = spawn("background")
+
+    def wake_background(self, run_ids: list):
+        """
+        Makes the prewarmer prepare the runs following the ones that just started.
+        """
+        if self.background is not None and self.background.poll() is None:
+            try:
+                self.background_connection.send(("wake", run_ids))
+            except OSError:
+                pass
+
+    def stop(self):
+        """
+        Kills the sandbox process, e.g. after it breached a limit.
+        """
+        if self.alive():
+            self.process.kill()
+        if self.process is not None:
+            self.process.wait()
+        # ``cancel`` reads the connection under the lock
+        with self._send_lock:
+            if self.connection is not None:
+                self.connection.close()
+            self.process = self.connection = None
+
+    def _send(self, message):
+        with self._send_lock:
+            self.connection.send(message)
+
+    def cancel(self, run_id):
+        """
+        Forwards a cancellation to the task running in the sandbox. Called from the
+        connection thread, possibly while the compute thread stops the sandbox.
+        """
+        with self._send_lock:
+            process, connection = self.process, self.connection
+            if connection is None or process is None or process.poll() is not None:
+                return
+            try:
+                connection.send(("cancel", run_id))
+            except OSError:
+                pass
+
+    def execute(self, kind: str, payload, send_result, tasks: list[dict]):
+        """
+        Runs a task in the sandbox and publishes the messages it sends, returning once
+        it finished.
+
+        :param kind: ``run``, ``sweep`` or ``fused``, see ``tasks.handle``.
+        :param payload: The decoded task (or list of tasks for ``fused``).
+        :param send_result: Function publishing a result message ``(message, persistent)``.
+        :param tasks: The task dictionaries the limits are derived from.
+        :raises ResourceLimitExceeded: If the task is too large or breached a limit.
+        :raises cancellation.RunCancelled: If a run of the task was cancelled.
+        :raises TaskFailed: If the task raised an exception.
+        """
+        import cancellation
+
+        estimate, memory = check_memory(tasks)
+        seconds = time_limit(tasks)
+        run_ids = [run["run_id"] for task in tasks for run in task.get("runs", [task])]
+        try:
+            self._run(kind, payload, send_result, run_ids, estimate, memory, seconds)
+        finally:
+            cancellation.forget(run_ids)
+
+    def _run(self, kind: str, payload, send_result, run_ids: list, estimate: float, memory: int, seconds: float | None):
+        """
+        Body of ``execute``, which forgets the task's cancellations once it returns.
+        """
+        import cancellation
+
+        if not self.alive():
+            self.start()
+        # Cancellations the sandbox missed: found in the DB when the task was dequeued,
+        # or received while it was not running
+        for run_id in run_ids:
+            if cancellation.is_cancelled(run_id):
+                self._send(("cancel", run_id))
+        self._send(("task", kind, payload, memory, run_ids))
+        # Upcoming runs are prepared while this task trains
+        self.wake_background(run_ids)
+
+        deadline = time.monotonic() + seconds if seconds else None
+        while True:
+            remaining = deadline - time.monotonic() if deadline else 1.0
+            if remaining <= 0:
+                self.stop()
+                raise ResourceLimitExceeded("time", seconds, detail="task was killed")
+            try:
+                if not self.connection.poll(min(1.0, remaining)):
+                    if not self.alive():
+                        raise EOFError
+                    continue
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                code = self.process.wait()
+                self.stop()
+                if code in (-signal.SIGKILL, -signal.SIGABRT, -signal.SIGSEGV):
+                    # Killed by the OOM killer or aborted by a failed allocation
+                    raise ResourceLimitExceeded("memory", memory, estimate, f"sandbox exited with code {code}")
+                raise TaskFailed(f"Sandbox exited with code {code}", permanent=False)
+
+            if message[0] == "send":
+                send_result(message[1], message[2])
+            elif message[0] == "done":
+                return
+            elif message[0] == "cancelled":
+                raise cancellation.RunCancelled(message[1])
+            elif message[0] == "limit":
+                # Caught in the sandbox; its allocator may be in a bad state, start afresh
+                self.stop()
+                raise ResourceLimitExceeded("memory", memory, estimate, message[1])
+            elif message[0] == "error":
+                raise TaskFailed(message[1], message[2])
+
+
+def address_space() -> int:
+    """
+    Returns the current virtual memory size (bytes) of this process.
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    """
+    Whether an exception was caused by an allocation that failed at the limit.
+    """
+    if isinstance(error, MemoryError) or (isinstance(error, OSError) and error.errno == errno.ENOMEM):
+        return True
+    return "RESOURCE_EXHAUSTED" in str(error) or "Cannot allocate memory" in str(error)
+
+
+def serve(fd: int):
+    """
+    Main loop of the sandbox process: runs the tasks the worker sends, one at a time.
+    A reader thread receives the tasks and applies cancellations while a task runs.
+
+    :param fd: File descriptor of the sandbox's end of the socket pair.
+    """
+    import cancellation
+    import tasks
+
+    connection = Connection(fd)
+    send_lock = threading.Lock()
+    pending = queue.Queue()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def read():
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == "cancel":
+                    cancellation.cancel(message[1])
+                else:
+                    pending.put(message)
+        except (EOFError, OSError):
+            # The worker is gone
+            os._exit(0)
+
+    tasks.publish = lambda message, persistent: send(("send", message, persistent))
+    threading.Thread(target=read, name="sandbox-reader", daemon=True).start()
+
+    # The XLA backend reserves its thread stacks and arenas on first use; initialised
+    # here, they are part of the baseline instead of the first task's limit.
+    import jax
+    jax.block_until_ready(jax.jit(lambda x: x + 1)(jax.numpy.zeros(1)))
+
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    while True:
+        _, kind, payload, memory, run_ids = pending.get()
+        limit = address_space() + memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+        try:
+            tasks.handle(kind, payload)
+            reply = ("done",)
+        except cancellation.RunCancelled as e:
+            reply = ("cancelled", e.run_id)
+        except Exception as e:
+            traceback.print_exc()
+            if is_out_of_memory(e):
+                reply = ("limit", repr(e)[:1000])
+            else:
+                reply = ("error", str(e) or repr(e), isinstance(e, PERMANENT_ERRORS))
+        finally:
+            resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+            cancellation.forget(run_ids)
+        send(reply)
+
+
+def serve_background(fd: int):
+    """
+    Main loop of the background process: runs the prewarmer and the warm-up (see
+    ``tasks.start_background``) and wakes the prewarmer whenever a task starts.
+
+    :param fd: File descriptor of the process's end of the socket pair.
+    """
+    import tasks
+
+    connection = Connection(fd)
+    tasks.start_background()
+    try:
+        while True:
+            _, run_ids = connection.recv()
+            tasks.prewarmer.wake(run_ids)
+    except (EOFError, OSError):
+        # The worker is gone
+        os._exit(0)
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "background":
+        serve_background(int(sys.argv[2]))
+    else:
+        serve(int(sys.argv[2]))
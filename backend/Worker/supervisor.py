@@ -0,0 +1,186 @@
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+
+#
+#   Worker supervisor.
+#
+#   Runs several worker.py processes side by side, each pinned to its own set of
+#   cores and with OpenMP/BLAS limited to that many threads, so small runs that only
+#   keep a core or two busy do not leave the rest of a node idle. Crashed workers
+#   are restarted; their unacknowledged task is redelivered by RabbitMQ and resumes
+#   from its checkpoint.
+#
+
+# Number of worker processes (0 = derive from the CPU count and the typical run cost)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+# Cores per worker process (0 = derive from the typical qubit count)
+WORKER_CORES     = int(os.getenv("WORKER_CORES", "0"))
+# Qubit count assumed when the recent runs can not be read from the DB
+TYPICAL_QUBIT_COUNT = int(os.getenv("TYPICAL_QUBIT_COUNT", "5"))
+# Up to this many qubits a statevector simulation does not profit from more than one core
+SINGLE_CORE_QUBITS  = int(os.getenv("SINGLE_CORE_QUBITS", "10"))
+# Seconds before a crashed worker is restarted, doubled for every crash in a row
+RESTART_DELAY     = float(os.getenv("RESTART_DELAY", "1"))
+MAX_RESTART_DELAY = float(os.getenv("MAX_RESTART_DELAY", "60"))
+# A worker that ran this long before exiting counts as healthy again
+HEALTHY_UPTIME    = float(os.getenv("HEALTHY_UPTIME", "60"))
+
+# Must match the data-parallel mode of worker.py: every host device needs a core.
+HOST_DEVICE_COUNT = int(os.getenv("HOST_DEVICE_COUNT", "1"))
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+
+def typical_qubit_count(limit: int = 100) -> int:
+    """
+    Returns the median qubit count of the most recent benchmark runs.
+
+    :param limit: Number of runs to look at.
+    :return: The median qubit count or ``TYPICAL_QUBIT_COUNT`` if there are no runs
+             or the DB is not reachable.
+    """
+    try:
+        import db
+        runs = db.get_db()["benchmarkRuns"].find({"qubit_count": {"$gt": 0}}, {"qubit_count": 1}).sort("id", -1).limit(limit)
+        counts = [int(run["qubit_count"]) for run in runs]
+    except Exception as e:
+        print(f"Supervisor: could not read recent runs: {e}", flush=True)
+        counts = []
+    return int(statistics.median(counts)) if counts else TYPICAL_QUBIT_COUNT
+
+
+def plan_workers(cpus: list[int], n_qubits: int) -> list[list[int]]:
+    """
+    Splits the available cores between worker processes.
+
+    Every doubling of the statevector beyond ``SINGLE_CORE_QUBITS`` qubits gives a
+    worker one more doubling of cores, so small runs get one core each and large runs
+    fewer, wider workers.
+
+    :param cpus: Ids of the cores the supervisor may use.
+    :param n_qubits: Typical qubit count of a run.
+    :return: One list of core ids per worker process.
+    """
+    cores = WORKER_CORES or 2 ** max(0, n_qubits - SINGLE_CORE_QUBITS)
+    cores = min(len(cpus), max(cores, HOST_DEVICE_COUNT))
+    count = WORKER_PROCESSES or max(1, len(cpus) // cores)
+    # With an explicit process count the cores are spread evenly (or shared round robin)
+    if WORKER_PROCESSES and not WORKER_CORES:
+        cores = max(1, len(cpus) // count)
+    return [[cpus[(index * cores + offset) % len(cpus)] for offset in range(cores)] for index in range(count)]
+
+
+def worker_env(index: int, cores: list[int], worker_count: int = 1) -> dict:
+    """
+    Returns the environment of a worker process, limiting the BLAS/OpenMP libraries
+    to one thread per pinned core and, unless ``MEMORY_LIMIT_MB`` is set, the memory
+    of its tasks to an equal share of the host's memory. XLA has no flag for its
+    thread count; it sizes its CPU thread pool by the affinity mask the worker is
+    pinned to, and a worker pinned to a single core runs it single-threaded.
+
+    :param index: Index of the worker process.
+    :param cores: Ids of the cores the worker is pinned to.
+    :param worker_count: Number of worker processes sharing the host.
+    """
+    threads = str(len(cores))
+    memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // worker_count // 2 ** 20
+    env = dict(os.environ)
+    xla_flags = os.getenv("XLA_FLAGS", "")
+    if len(cores) == 1:
+        xla_flags = f"{xla_flags} --xla_cpu_multi_thread_eigen=false".strip()
+    env.update({
+        "WORKER_INDEX":         str(index),
+        "MEMORY_LIMIT_MB":      os.getenv("MEMORY_LIMIT_MB") or str(memory_mb),
+        "OMP_NUM_THREADS":      threads,
+        "MKL_NUM_THREADS":      threads,
+        "OPENBLAS_NUM_THREADS": threads,
+        "XLA_FLAGS":            xla_flags,
+    })
+    return env
+
+
+class WorkerProcess:
+    """
+    One supervised worker.py process and its restart bookkeeping.
+    """
+
+    def __init__(self, index: int, cores: list[int], worker_count: int = 1):
+        self.index   = index
+        self.cores   = cores
+        self.worker_count = worker_count
+        self.process = None
+        self.started = 0.0
+        self.crashes = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        cores = set(self.cores)
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT],
+            env = worker_env(self.index, self.cores, self.worker_count),
+            # Pin before exec, so every thread XLA starts inherits the affinity
+            preexec_fn = lambda: os.sched_setaffinity(0, cores)
+        )
+        self.started = time.monotonic()
+        print(f"Supervisor: started worker {self.index} (pid {self.process.pid}) on cores {self.cores}", flush=True)
+
+    def check(self):
+        """
+        Restarts the worker if it exited, backing off while it keeps crashing.
+        """
+        if self.process is None:
+            if time.monotonic() >= self.restart_at:
+                self.start()
+            return
+
+        code = self.process.poll()
+        if code is None:
+            return
+
+        uptime = time.monotonic() - self.started
+        self.crashes = 0 if uptime >= HEALTHY_UPTIME else self.crashes + 1
+        delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** self.crashes)
+        print(f"Supervisor: worker {self.index} exited with code {code} after {uptime:.0f}s, restarting in {delay:.0f}s", flush=True)
+        self.process = None
+        self.restart_at = time.monotonic() + delay
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def main():
+    cpus = sorted(os.sched_getaffinity(0))
+    n_qubits = typical_qubit_count()
+    plan = plan_workers(cpus, n_qubits)
+    workers = [WorkerProcess(index, cores, len(plan)) for index, cores in enumerate(plan)]
+    print(f"Supervisor: {len(workers)} worker(s) on {len(cpus)} core(s), typical run has {n_qubits} qubits", flush=True)
+
+    stopping = False
+
+    def shutdown(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while not stopping:
+        for worker in workers:
+            worker.check()
+        time.sleep(1)
+
+    for worker in workers:
+        if worker.process is not None:
+            worker.process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import math
+
+
+def rung_budgets(candidate_count: int, max_epochs: int, reduction_factor: int) -> list[int]:
+    """
+    Returns the epoch budget of every rung of a successive halving sweep.
+
+    With ``n`` candidates and reduction factor ``eta`` there are ``floor(log_eta(n)) + 1``
+    rungs. The last rung trains for ``max_epochs``, every earlier rung for ``eta`` times
+    fewer epochs than the next one (but at least one epoch).
+
+    :param candidate_count: Number of candidates entering the first rung.
+    :param max_epochs: Full epoch budget of the winners.
+    :param reduction_factor: Factor by which candidates are eliminated per rung.
+    :return: Increasing list of epoch budgets, ending with ``max_epochs``.
+    """
+    rung_count = int(math.log(max(candidate_count, 1), reduction_factor) + 1e-9) + 1
+    budgets = [max(1, round(max_epochs / reduction_factor ** (rung_count - 1 - rung))) for rung in range(rung_count)]
+    # Drop rungs that collapse to the same budget for small epoch counts.
+    return sorted(set(budgets))
+
+
+def successive_halving(candidates: list, max_epochs: int, reduction_factor: int, train, on_pruned=None, on_done=None) -> list:
+    """
+    Runs a successive halving sweep.
+
+    All candidates are trained for the budget of the first rung. The best
+    ``1 / reduction_factor`` (by the training loss of their trained params) continue
+    to the next rung, where ``train`` is expected to resume them from their
+    checkpoints; the rest are pruned. Candidates reaching the last rung are trained
+    for ``max_epochs``.
+
+    :param candidates: Candidates of the sweep (passed through to the callbacks).
+    :param max_epochs: Full epoch budget of the winners.
+    :param reduction_factor: Factor by which candidates are eliminated per rung.
+    :param train: ``train(candidate, n_epochs) -> dict`` with at least ``trained_loss``.
+    :param on_pruned: Called as ``on_pruned(candidate, result, n_epochs)`` for eliminated candidates.
+    :param on_done: Called as ``on_done(candidate, result, n_epochs)`` for candidates finishing the last rung.
+    :return: List of ``(candidate, result)`` of the candidates that finished the last rung.
+    """
+    budgets = rung_budgets(len(candidates), max_epochs, reduction_factor)
+    survivors = list(candidates)
+
+    for rung, n_epochs in enumerate(budgets):
+        results = [(candidate, train(candidate, n_epochs)) for candidate in survivors]
+
+        if rung == len(budgets) - 1:
+            for candidate, result in results:
+                if on_done:
+                    on_done(candidate, result, n_epochs)
+            return results
+
+        results.sort(key=lambda item: item[1]["trained_loss"])
+        keep = max(1, len(results) // reduction_factor)
+        for candidate, result in results[keep:]:
+            if on_pruned:
+                on_pruned(candidate, result, n_epochs)
+        survivors = [candidate for candidate, _ in results[:keep]]
+
+    return []
@@ -0,0 +1,345 @@
+import os
+
+# Number of XLA host devices the CPU is split into. With more than one device the
+# training batch is sharded across them (data-parallel mode). XLA reads this flag
+# when jax is first imported, so it has to be set before importing the benchmark.
+HOST_DEVICE_COUNT = int(os.getenv("HOST_DEVICE_COUNT", "1"))
+if HOST_DEVICE_COUNT > 1:
+    os.environ["XLA_FLAGS"] = f'{os.getenv("XLA_FLAGS", "")} --xla_force_host_platform_device_count={HOST_DEVICE_COUNT}'.strip()
+
+# Data-parallel runs measure their scaling efficiency against one extra single-device
+# step when SCALING_PROBE is 1. Off by default, since it costs an extra compilation.
+SCALING_PROBE = os.getenv("SCALING_PROBE", "0") == "1"
+
+from benchmark import run_benchmark, run_cross_validation, run_fused_benchmark, run_hyperparameter_search, warm_up
+from checkpoint import delete_checkpoint
+import cancellation
+from prewarm import Prewarmer, PREWARM_LOOKAHEAD
+from progress import ProgressReporter
+from protocol import StatusMessage
+from sweep import successive_halving
+from warmup import Warmup
+
+from functools import partial
+from typing import Union
+
+
+#
+#   Task execution inside the sandbox process (see sandbox.py).
+#
+#   Everything that trains lives here, so the worker process itself never imports
+#   jax or allocates statevectors. Result messages are handed to the worker, which
+#   publishes them.
+#
+
+EPOCH_COUNT   = int(os.getenv("EPOCH_COUNT", "100"))
+LEARNING_RATE = float(os.getenv("LEARNING_RATE", "0.2"))
+LAYER_COUNT   = int(os.getenv("LAYER_COUNT", "10"))
+
+# Training state is checkpointed every CHECKPOINT_INTERVAL epochs (0 disables it), so a
+# redelivered task resumes where the previous attempt stopped.
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "10"))
+
+# Preview runs train on a stratified fraction of the training set for a few epochs.
+PREVIEW_EPOCH_COUNT = int(os.getenv("PREVIEW_EPOCH_COUNT", "10"))
+PREVIEW_FRACTION    = float(os.getenv("PREVIEW_FRACTION", "0.25"))
+
+# Hands a message to the worker: ``publish(message, persistent)``; set by the sandbox
+publish = None
+
+run_id: Union[str, None] = None
+# Coalesces the progress messages of the run that is currently training
+progress_reporter: Union[ProgressReporter, None] = None
+
+# Prepares the datasets and encodings of upcoming runs while the current one trains
+prewarmer = Prewarmer()
+
+
+def send_result(message: StatusMessage, persistent: bool = True):
+    """
+    Sends a result message to the RESULT_QUEUE through the worker.
+
+    :param message: The status message (e.g., run ID, status, progress or result).
+    :param persistent: Whether the broker stores the message on disk. Progress messages
+                       are superseded by the next one and do not need to survive a restart.
+    """
+    publish(message, persistent)
+
+
+def warm_configuration(config: dict):
+    """
+    Compiles the model and loads the dataset of a configuration of recent runs, with
+    the hyperparameters this worker trains them with.
+
+    :param config: Dictionary of ``warmup.CONFIG_FIELDS``.
+    """
+    preview = config.get("task_type") == "preview"
+    warm_up(
+        ansatz_id      = int(config["ansatz_id"]),
+        dataset_id     = int(config["data_id"]),
+        encoding_id    = int(config["encoding_id"]),
+        n_qubits       = int(config.get("qubit_count") or 5),
+        measure_wire   = 0,
+        learning_rate  = LEARNING_RATE,
+        n_layers       = LAYER_COUNT,
+        train_fraction = PREVIEW_FRACTION if preview else 1.0,
+        reduction      = config.get("reduction")
+    )
+
+
+def start_background():
+    """
+    Starts the prewarmer and the warm-up of the most common configurations. Runs in
+    the background process, outside the memory limit of the tasks (see sandbox.py).
+    """
+    if PREWARM_LOOKAHEAD > 0:
+        prewarmer.start()
+    Warmup(warm_configuration).start()
+
+
+def send_progress(epoch_index: int, epoch_count: int, loss=None):
+    # Called after every epoch, so a cancelled run stops within one epoch
+    cancellation.check(globals()["run_id"])
+    progress_reporter.update(epoch_index, epoch_count, loss)
+
+
+def build_result(task: dict, benchmark_result: dict) -> dict:
+    """
+    Builds the result document of a finished run.
+
+    :param task: The task (or sweep run) dictionary with the run's ids.
+    :param benchmark_result: Dictionary returned by the benchmark.
+    :return: The result document that is stored by the API.
+    """
+    return {
+        "run_id":       task["run_id"],
+        "encoding_id":  task["encoding_id"],
+        "ansatz_id":    task["ansatz_id"],
+        "data_id":      task["data_id"],
+        "loss":         benchmark_result["loss"],
+        "accuracy":     benchmark_result["accuracy"],
+        "instrumentation": benchmark_result["instrumentation"],
+        # Sent as a binary array, see protocol.py
+        "training_losses": benchmark_result.get("training_losses"),
+    }
+
+
+def process_run(task: dict):
+    """
+    Runs a single benchmark, cross-validation or hyperparameter search task and
+    publishes its result.
+
+    :param task: The decoded task message.
+    """
+    run_id = task["run_id"]
+    task_type = task.get("task_type", "benchmark")
+
+    globals()["run_id"] = run_id
+    globals()["progress_reporter"] = ProgressReporter(run_id, partial(send_result, persistent=False))
+
+    # Send initial status
+    send_result(StatusMessage(id=run_id, status='init'))
+
+    if task_type == "search":
+        benchmark_result = run_hyperparameter_search(
+            ansatz_id       = int(task["ansatz_id"]),
+            dataset_id      = int(task["data_id"]),
+            encoding_id     = int(task["encoding_id"]),
+            n_qubits        = int(task["qubit_count"]) or 5,
+            measure_wire    = task["measure_index"],
+            search_space    = task["search_space"],
+            n_epochs        = EPOCH_COUNT,
+            n_layers        = LAYER_COUNT,
+            progress_update = send_progress,
+            reduction       = task.get("reduction"),
+            encoding_circuit = task.get("circuit")
+        )
+    elif task_type == "crossval":
+        benchmark_result = run_cross_validation(
+            ansatz_id       = int(task["ansatz_id"]),
+            dataset_id      = int(task["data_id"]),
+            encoding_id     = int(task["encoding_id"]),
+            n_qubits        = int(task["qubit_count"]) or 5,
+            measure_wire    = task["measure_index"],
+            k_folds         = int(task["k_folds"]),
+            n_epochs        = EPOCH_COUNT,
+            learning_rate   = LEARNING_RATE,
+            n_layers        = LAYER_COUNT,
+            progress_update = send_progress,
+            reduction       = task.get("reduction"),
+            encoding_circuit = task.get("circuit")
+        )
+    else:
+        preview = task_type == "preview"
+        benchmark_result = run_benchmark(
+            ansatz_id       = int(task["ansatz_id"]),
+            dataset_id      = int(task["data_id"]),
+            encoding_id     = int(task["encoding_id"]),
+            n_qubits        = int(task["qubit_count"]) or 5,
+            measure_wire    = task["measure_index"],
+            n_epochs        = PREVIEW_EPOCH_COUNT if preview else EPOCH_COUNT,
+            learning_rate   = LEARNING_RATE,
+            n_layers        = LAYER_COUNT,
+            progress_update = send_progress,
+            data_parallel   = HOST_DEVICE_COUNT > 1,
+            scaling_probe   = SCALING_PROBE,
+            run_id          = run_id,
+            checkpoint_interval = CHECKPOINT_INTERVAL,
+            train_fraction  = PREVIEW_FRACTION if preview else 1.0,
+            initial_params  = task.get("warm_start_params"),
+            reduction       = task.get("reduction"),
+            encoding_circuit = task.get("circuit")
+        )
+    print(benchmark_result, flush=True)
+
+    # Send final status
+    result = build_result(task, benchmark_result)
+    if task_type == "search":
+        result["search"] = {
+            "candidates": benchmark_result["candidates"],
+            "best":       benchmark_result["best"],
+        }
+    elif task_type == "crossval":
+        result["cross_validation"] = benchmark_result["cross_validation"]
+    elif task_type == "preview":
+        # The params let a promoted full run warm-start from this preview.
+        result["preview"] = True
+        result["params"] = benchmark_result["params"]
+    print(result, flush=True)
+    send_result(StatusMessage(id=run_id, status='done', result=result))
+    delete_checkpoint(run_id)
+
+
+def process_sweep(task: dict):
+    """
+    Runs a successive halving sweep over the runs of a sweep task.
+
+    Every rung resumes the surviving runs from their checkpoints. Eliminated runs are
+    published with status ``pruned`` and their partial metrics, the winners with status
+    ``done`` and their full-budget results.
+
+    :param task: The decoded sweep task with a ``runs`` list.
+    """
+    runs = task["runs"]
+    # One reporter per run, so the rate behind the ETA carries over between rungs
+    reporters = {run["run_id"]: ProgressReporter(run["run_id"], partial(send_result, persistent=False)) for run in runs}
+    for run in runs:
+        send_result(StatusMessage(id=run["run_id"], status='init'))
+
+    def train(run: dict, n_epochs: int) -> dict:
+        globals()["run_id"] = run["run_id"]
+        globals()["progress_reporter"] = reporters[run["run_id"]]
+        try:
+            cancellation.check(run["run_id"])
+            return run_benchmark(
+                ansatz_id       = int(run["ansatz_id"]),
+                dataset_id      = int(run["data_id"]),
+                encoding_id     = int(run["encoding_id"]),
+                n_qubits        = int(run["qubit_count"]) or 5,
+                measure_wire    = run["measure_index"],
+                n_epochs        = n_epochs,
+                learning_rate   = LEARNING_RATE,
+                n_layers        = LAYER_COUNT,
+                # Progress is reported relative to the full budget.
+                progress_update = lambda epoch_index, _, loss=None: send_progress(epoch_index, EPOCH_COUNT, loss),
+                data_parallel   = HOST_DEVICE_COUNT > 1,
+                run_id          = run["run_id"],
+                # Every rung has to end with a checkpoint to continue from.
+                checkpoint_interval = CHECKPOINT_INTERVAL or n_epochs,
+                reduction       = run.get("reduction"),
+                encoding_circuit = run.get("circuit")
+            )
+        except cancellation.RunCancelled:
+            # Ranked last, so the sweep drops it at the end of the rung
+            return {"cancelled": True, "trained_loss": float("inf")}
+
+    def publisher(status: str):
+        def publish(run: dict, benchmark_result: dict, n_epochs: int):
+            if benchmark_result.get("cancelled"):
+                send_result(StatusMessage(id=run["run_id"], status='cancelled'))
+                delete_checkpoint(run["run_id"])
+                return
+            result = build_result(run, benchmark_result)
+            result["epochs"] = n_epochs
+            result["pruned"] = status == "pruned"
+            print(f'[{status}] Run {run["run_id"]} after {n_epochs} epochs: {result}', flush=True)
+            send_result(StatusMessage(id=run["run_id"], status=status, result=result))
+            delete_checkpoint(run["run_id"])
+        return publish
+
+    successive_halving(
+        candidates       = runs,
+        max_epochs       = EPOCH_COUNT,
+        reduction_factor = int(task.get("reduction_factor", 3)),
+        train            = train,
+        on_pruned        = publisher("pruned"),
+        on_done          = publisher("done")
+    )
+
+
+def process_fused(tasks: list):
+    """
+    Trains a batch of compatible benchmark tasks as one job (see
+    ``run_fused_benchmark``) and publishes every run's progress and result separately.
+    A cancelled run stops training and is reported as cancelled without aborting the
+    other runs of the job.
+
+    :param tasks: The decoded tasks.
+    """
+    reporters = [ProgressReporter(task["run_id"], partial(send_result, persistent=False)) for task in tasks]
+
+    def progress_update(epoch_index: int, epoch_count: int, losses, runs: list):
+        for position, index in enumerate(runs):
+            reporters[index].update(epoch_index, epoch_count, losses[position])
+
+    def is_cancelled(index: int) -> bool:
+        return cancellation.is_cancelled(tasks[index]["run_id"])
+
+    for task in tasks:
+        send_result(StatusMessage(id=task["run_id"], status='init'))
+    first = tasks[0]
+    benchmark_results = run_fused_benchmark(
+        ansatz_id       = int(first["ansatz_id"]),
+        dataset_id      = int(first["data_id"]),
+        encoding_ids    = [int(task["encoding_id"]) for task in tasks],
+        n_qubits        = int(first["qubit_count"]) or 5,
+        measure_wire    = first["measure_index"],
+        n_epochs        = EPOCH_COUNT,
+        learning_rate   = LEARNING_RATE,
+        n_layers        = LAYER_COUNT,
+        progress_update = progress_update,
+        reduction       = first.get("reduction"),
+        encoding_circuits = [task.get("circuit") for task in tasks],
+        is_cancelled    = is_cancelled
+    )
+
+    for task, benchmark_result in zip(tasks, benchmark_results):
+        if benchmark_result is None:
+            # Only the cancelled run stopped, the others trained to the end
+            print(f'Stopped cancelled run {task["run_id"]}', flush=True)
+            send_result(StatusMessage(id=task["run_id"], status='cancelled'))
+            continue
+        result = build_result(task, benchmark_result)
+        print(result, flush=True)
+        send_result(StatusMessage(id=task["run_id"], status='done', result=result))
+
+
+def handle(kind: str, payload):
+    """
+    Runs a task sent by the worker.
+
+    :param kind: ``run`` (benchmark, preview, cross-validation or search), ``sweep``
+                 or ``fused``.
+    :param payload: The decoded task, for ``fused`` a list of tasks.
+    :raises cancellation.RunCancelled: If a run was cancelled; its checkpoint is removed.
+    """
+    try:
+        if kind == "fused":
+            process_fused(payload)
+        elif kind == "sweep":
+            process_sweep(payload)
+        else:
+            process_run(payload)
+    except cancellation.RunCancelled as e:
+        delete_checkpoint(e.run_id)
+        raise
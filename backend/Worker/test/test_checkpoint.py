@@ -0,0 +1,57 @@
+import tempfile
+from unittest import TestCase, mock
+
+import jax.numpy as jnp
+import optax
+
+import checkpoint
+
+
+class CheckpointTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(checkpoint, "CHECKPOINT_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.params = jnp.zeros((2, 3))
+        self.opt_state = optax.adam(0.1).init(self.params)
+
+    def config(self, **fields):
+        config = {"ansatz_id": 1, "dataset_id": 2, "encoding_id": 3, "initial_params": None}
+        config.update(fields)
+        return checkpoint.config_key(config)
+
+    def test_round_trip(self):
+        config = self.config()
+        checkpoint.save_checkpoint(7, config, self.params + 1, self.opt_state, jnp.zeros(2), 5, [0.5] * 5)
+
+        restored = checkpoint.load_checkpoint(7, config, self.params, self.opt_state)
+        self.assertEqual(restored["epoch"], 5)
+        self.assertEqual(restored["training_losses"], [0.5] * 5)
+        self.assertTrue(jnp.all(restored["params"] == 1))
+
+    def test_config_key(self):
+        self.assertEqual(self.config(), self.config())
+        self.assertNotEqual(self.config(), self.config(encoding_id=4))
+        self.assertNotEqual(self.config(), self.config(initial_params=[[0.0, 0.1]]))
+
+    def test_other_config_starts_from_scratch(self):
+        checkpoint.save_checkpoint(7, self.config(), self.params, self.opt_state, jnp.zeros(2), 5, [0.5] * 5)
+
+        self.assertIsNone(checkpoint.load_checkpoint(7, self.config(encoding_id=4), self.params, self.opt_state))
+        self.assertIsNone(checkpoint.load_checkpoint(8, self.config(), self.params, self.opt_state))
+
+    def test_delete_removes_every_config(self):
+        for encoding_id in (3, 4):
+            checkpoint.save_checkpoint(7, self.config(encoding_id=encoding_id), self.params, self.opt_state, jnp.zeros(2), 5, [])
+        checkpoint.save_checkpoint(70, self.config(), self.params, self.opt_state, jnp.zeros(2), 5, [])
+
+        checkpoint.delete_checkpoint(7)
+        self.assertIsNone(checkpoint.load_checkpoint(7, self.config(), self.params, self.opt_state))
+        self.assertIsNone(checkpoint.load_checkpoint(7, self.config(encoding_id=4), self.params, self.opt_state))
+        self.assertIsNotNone(checkpoint.load_checkpoint(70, self.config(), self.params, self.opt_state))
+        # Deleting a run without checkpoints is a no-op
+        checkpoint.delete_checkpoint(7)
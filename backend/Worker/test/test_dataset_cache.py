@@ -0,0 +1,73 @@
+import os
+import tempfile
+from collections import OrderedDict
+from unittest import TestCase, mock
+
+import numpy as np
+
+import dataset_cache
+
+
+class DatasetCacheTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = os.path.join(directory.name, "store")
+        self.shared = os.path.join(directory.name, "shared")
+        patcher = mock.patch.multiple(
+            dataset_cache,
+            DATASET_CACHE_DIR=self.store,
+            SHARED_DATASET_DIR=self.shared,
+            _memory_cache=OrderedDict(),
+            _leases={},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [dataset_cache._release(key) for key in list(dataset_cache._leases)])
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return {"X": np.arange(6, dtype=np.float32).reshape(3, 2), "y": np.array([0, 1, 0])}
+
+    def test_sources(self):
+        arrays, source = dataset_cache.cached_arrays("a", self.build)
+        self.assertEqual(source, "miss")
+        np.testing.assert_array_equal(arrays["y"], [0, 1, 0])
+        self.assertEqual(dataset_cache.cached_arrays("a", self.build)[1], "memory")
+
+        # Another process attaches to the shared segment
+        dataset_cache._memory_cache.clear()
+        self.assertEqual(dataset_cache.cached_arrays("a", self.build)[1], "shared")
+        self.assertEqual(self.builds, 1)
+        # No key locks are left behind
+        self.assertEqual(dataset_cache._key_locks, {})
+
+    def test_lease_held_while_cached(self):
+        dataset_cache.cached_arrays("a", self.build)
+        self.assertIn("a", dataset_cache._leases)
+        with mock.patch.object(dataset_cache, "DATASET_CACHE_SIZE", 1):
+            dataset_cache.cached_arrays("b", self.build)
+        # Dropped from the LRU, so its lease is released
+        self.assertNotIn("a", dataset_cache._leases)
+        self.assertIn("b", dataset_cache._leases)
+
+    def test_leased_entries_are_not_evicted(self):
+        dataset_cache.cached_arrays("a", self.build)
+        dataset_cache._memory_cache.clear()
+        dataset_cache._release("a")
+        dataset_cache.cached_arrays("b", self.build)
+
+        with mock.patch.object(dataset_cache, "SHARED_DATASET_SIZE_MB", 0):
+            dataset_cache.evict_shared()
+        self.assertFalse(os.path.exists(os.path.join(self.shared, "a")))
+        self.assertTrue(os.path.exists(os.path.join(self.shared, "b")))
+
+    def test_evicted_after_write(self):
+        # The entry disappears between writing and leasing it
+        with mock.patch.object(dataset_cache, "_lease", return_value=None):
+            arrays, source = dataset_cache.cached_arrays("a", self.build)
+        self.assertEqual(source, "miss")
+        np.testing.assert_array_equal(arrays["X"][2], [4, 5])
+        self.assertNotIn("a", dataset_cache._leases)
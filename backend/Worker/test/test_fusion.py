@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from fusion import fuse_key
+
+
+class FuseKeyTest(TestCase):
+
+    def task(self, **fields):
+        task = {"run_id": 1, "task_type": "benchmark", "data_id": 2, "ansatz_id": 3, "encoding_id": 4,
+                "qubit_count": 5, "measure_index": 0, "reduction": None}
+        task.update(fields)
+        return task
+
+    def test_encodings_fuse(self):
+        self.assertIsNotNone(fuse_key(self.task()))
+        self.assertEqual(fuse_key(self.task(run_id=1, encoding_id=4)), fuse_key(self.task(run_id=2, encoding_id=9)))
+
+    def test_shared_fields_must_match(self):
+        key = fuse_key(self.task())
+        for field, value in [("data_id", 6), ("ansatz_id", 6), ("qubit_count", 6), ("measure_index", 1)]:
+            self.assertNotEqual(fuse_key(self.task(**{field: value})), key, field)
+
+    def test_reduction_must_match(self):
+        pca = fuse_key(self.task(reduction="pca"))
+        self.assertNotEqual(pca, fuse_key(self.task()))
+        self.assertNotEqual(pca, fuse_key(self.task(reduction="random_projection")))
+        self.assertEqual(pca, fuse_key(self.task(run_id=2, reduction="pca")))
+
+    def test_task_type_defaults_to_benchmark(self):
+        task = self.task()
+        del task["task_type"]
+        self.assertEqual(fuse_key(task), fuse_key(self.task()))
+
+    def test_runs_alone(self):
+        self.assertIsNone(fuse_key(self.task(task_type="preview")))
+        self.assertIsNone(fuse_key(self.task(task_type="sweep")))
+        self.assertIsNone(fuse_key(self.task(warm_start_params=[0.1, 0.2])))
+        self.assertIsNone(fuse_key(self.task(), retried=True))
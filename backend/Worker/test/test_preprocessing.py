@@ -0,0 +1,96 @@
+from unittest import TestCase
+
+import numpy as np
+from skimage.transform import resize
+
+import preprocessing
+
+
+def images_to_features_per_image(images, side=None):
+    """The per-image loop images_to_features replaced."""
+    if side is not None:
+        images = np.array([resize(image, (side, side), mode='reflect') for image in images])
+    features = images.reshape((images.shape[0], -1))
+    return features / features.max()
+
+
+class ImagesToFeaturesTest(TestCase):
+
+    def test_matches_per_image_resize(self):
+        rng = np.random.default_rng(0)
+        for n_images, size, side in [(50, 8, 3), (50, 8, 4), (20, 8, 22), (30, 4, 3), (1, 16, 5)]:
+            images = rng.random((n_images, size, size))
+            np.testing.assert_allclose(
+                preprocessing.images_to_features(images, side),
+                images_to_features_per_image(images, side),
+                rtol=1e-12, atol=0
+            )
+
+    def test_without_resize(self):
+        images = np.random.default_rng(1).integers(0, 16, size=(10, 3, 3)).astype(float)
+        features = preprocessing.images_to_features(images)
+        self.assertEqual(features.shape, (10, 9))
+        np.testing.assert_allclose(features, images_to_features_per_image(images))
+        # Already at the target size: reshaped only
+        np.testing.assert_allclose(preprocessing.images_to_features(images, 3), features)
+
+
+class ReductionTest(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.X_train = rng.random((40, 13))
+        self.y_train = rng.integers(0, 2, size=40)
+        self.X_test = rng.random((10, 13))
+
+    def test_shapes_and_range(self):
+        for method in preprocessing.REDUCTIONS:
+            fit = preprocessing.fit_reduction(method, self.X_train, self.y_train)
+            self.assertEqual(fit["components"].shape, (13, 13))
+            self.assertEqual(fit["mean"].shape, (13,))
+            # One fit serves every feature count
+            for n_features in (1, 4, 13):
+                X = preprocessing.apply_reduction(fit, self.X_train, n_features)
+                self.assertEqual(X.shape, (40, n_features))
+                self.assertEqual(preprocessing.apply_reduction(fit, self.X_test, n_features).shape, (10, n_features))
+                # Training features are scaled to [0, 1]
+                np.testing.assert_allclose(X.min(axis=0), 0, atol=1e-12)
+                np.testing.assert_allclose(X.max(axis=0), 1, atol=1e-12)
+
+    def test_pca_orders_by_variance(self):
+        fit = preprocessing.fit_reduction("pca", self.X_train, self.y_train)
+        projected = (self.X_train - fit["mean"]) @ fit["components"]
+        variances = projected.var(axis=0)
+        self.assertTrue(np.all(np.diff(variances) <= 1e-12))
+
+    def test_random_projection_is_seeded(self):
+        first = preprocessing.fit_reduction("random_projection", self.X_train, self.y_train)
+        second = preprocessing.fit_reduction("random_projection", self.X_train, self.y_train)
+        np.testing.assert_array_equal(first["components"], second["components"])
+
+    def test_too_many_features(self):
+        fit = preprocessing.fit_reduction("pca", self.X_train, self.y_train)
+        with self.assertRaises(ValueError):
+            preprocessing.apply_reduction(fit, self.X_train, 14)
+        with self.assertRaises(ValueError):
+            preprocessing.fit_reduction("unknown", self.X_train, self.y_train)
+
+
+class AmplitudeVectorsTest(TestCase):
+
+    def test_padded_and_normalised(self):
+        X = np.array([[3.0, 4.0, 0.0], [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+        amplitudes = preprocessing.amplitude_vectors(X, 4)
+        self.assertEqual(amplitudes.shape, (3, 4))
+        np.testing.assert_allclose(np.linalg.norm(amplitudes, axis=1), 1)
+        np.testing.assert_allclose(amplitudes[0], [0.6, 0.8, 0, 0])
+        # All-zero rows become |00>
+        np.testing.assert_array_equal(amplitudes[1], [1, 0, 0, 0])
+
+        features = preprocessing.with_amplitudes(X, 4)
+        self.assertEqual(features.shape, (3, 7))
+        np.testing.assert_array_equal(features[:, 4:], X)
+
+    def test_too_many_features(self):
+        with self.assertRaises(ValueError):
+            preprocessing.amplitude_vectors(np.ones((2, 5)), 4)
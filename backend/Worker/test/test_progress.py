@@ -0,0 +1,44 @@
+from unittest import TestCase, mock
+
+import numpy as np
+
+from progress import ProgressReporter
+
+
+class ProgressReporterTest(TestCase):
+
+    def run_epochs(self, reporter, times, epoch_count, loss=None):
+        for epoch_index, now in enumerate(times):
+            with mock.patch("progress.time.monotonic", return_value=now):
+                reporter.update(epoch_index, epoch_count, loss)
+
+    def test_throttled_by_interval(self):
+        sent = []
+        reporter = ProgressReporter(7, sent.append, interval=2, step=0.01)
+        # 100 epochs of 0.1 s: one message every 2 s
+        self.run_epochs(reporter, [0.1 * epoch for epoch in range(100)], 100)
+
+        self.assertEqual(len(sent), 5)
+        self.assertEqual({message.id for message in sent}, {7})
+        self.assertEqual({message.status for message in sent}, {"progress"})
+        self.assertEqual([message.progress for message in sent], [0.01, 0.21, 0.41, 0.61, 0.81])
+
+    def test_throttled_by_step(self):
+        sent = []
+        reporter = ProgressReporter(7, sent.append, interval=0, step=0.25)
+        # Slow epochs, but a message only every quarter of the run
+        self.run_epochs(reporter, [10.0 * epoch for epoch in range(1000)], 1000)
+
+        self.assertEqual([message.progress for message in sent], [0.25, 0.5, 0.75, 1.0])
+
+    def test_eta_and_loss(self):
+        sent = []
+        reporter = ProgressReporter(1, sent.append, interval=0, step=0)
+        # The first epoch (compilation) takes 100 s, the rest 1 s each
+        self.run_epochs(reporter, [100.0 + epoch for epoch in range(10)], 10, loss=np.array([1.0, 3.0]))
+
+        # No rate is known after the first epoch
+        self.assertIsNone(sent[0].eta)
+        self.assertAlmostEqual(sent[1].eta, 8.0)
+        self.assertAlmostEqual(sent[-1].eta, 0.0)
+        self.assertEqual(sent[-1].loss, 2.0)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import cancellation
+import sandbox
+from sandbox import ResourceLimitExceeded, Sandbox, check_memory, estimate_memory, time_limit
+
+
+def task(**fields):
+    return dict({"run_id": 1, "task_type": "benchmark", "qubit_count": 4, "sample_count": 100}, **fields)
+
+
+class EstimateMemoryTest(TestCase):
+
+    def test_statevectors_per_gate_and_sample(self):
+        # max(encoding gates, qubits) + LAYER_COUNT x qubits gates on 2 ** 4 amplitudes
+        gates = 4 + sandbox.LAYER_COUNT * 4
+        self.assertEqual(estimate_memory(task()), 100 * gates * 16 * sandbox.AMPLITUDE_BYTES)
+        # A longer encoding adds gates
+        circuit = [{"gate": "RY", "wires": [0], "params": []}] * 10
+        self.assertEqual(estimate_memory(task(circuit=circuit)), 100 * (gates + 6) * 16 * sandbox.AMPLITUDE_BYTES)
+
+    def test_doubles_per_qubit(self):
+        small, large = estimate_memory(task(qubit_count=10)), estimate_memory(task(qubit_count=11))
+        self.assertAlmostEqual(large / small, 2 * 11 / 10)
+
+    def test_batched_tasks(self):
+        single = estimate_memory(task())
+        self.assertEqual(estimate_memory(task(task_type="crossval", k_folds=5)), 5 * single)
+        search_space = {"learning_rates": [0.01, 0.1, 0.2], "optimizers": ["adam"]}
+        self.assertEqual(estimate_memory(task(task_type="search", search_space=search_space)), 3 * single)
+
+    def test_sweep_by_largest_run(self):
+        sweep = {"task_type": "sweep", "runs": [task(qubit_count=3), task(qubit_count=6), task(qubit_count=5)]}
+        self.assertEqual(estimate_memory(sweep), estimate_memory(task(qubit_count=6)))
+
+    def test_defaults(self):
+        # Tasks of an API predating the estimates
+        self.assertEqual(
+            estimate_memory({"run_id": 1}),
+            estimate_memory(task(qubit_count=sandbox.DEFAULT_QUBIT_COUNT, sample_count=sandbox.DEFAULT_SAMPLE_COUNT))
+        )
+
+
+class CheckMemoryTest(TestCase):
+
+    def test_rejects_tasks_that_can_not_fit(self):
+        with mock.patch.object(sandbox, "MEMORY_LIMIT_MB", 1024):
+            with self.assertRaises(ResourceLimitExceeded) as raised:
+                check_memory([task(qubit_count=20, sample_count=1000)])
+            self.assertEqual(raised.exception.kind, "memory")
+            self.assertEqual(raised.exception.limit, 1024 * 2 ** 20)
+
+    def test_allowed_growth(self):
+        with mock.patch.object(sandbox, "MEMORY_LIMIT_MB", 64 * 1024):
+            # Small tasks get at least MIN_TASK_MEMORY_MB
+            estimate, allowed = check_memory([task()])
+            self.assertEqual(allowed, sandbox.MIN_TASK_MEMORY_MB * 2 ** 20)
+            # Larger ones a multiple of their estimate, fused ones of the sum
+            large = task(qubit_count=12, sample_count=1000)
+            estimate, allowed = check_memory([large, large])
+            self.assertEqual(estimate, 2 * estimate_memory(large))
+            self.assertEqual(allowed, int(estimate * sandbox.MEMORY_SAFETY_FACTOR))
+            # But never more than the limit
+            estimate, allowed = check_memory([task(qubit_count=15, sample_count=1000)])
+            self.assertLess(estimate, 64 * 2 ** 30)
+            self.assertEqual(allowed, 64 * 2 ** 30)
+
+
+class TimeLimitTest(TestCase):
+
+    def test_clamped_cost_estimate(self):
+        with mock.patch.multiple(sandbox, AMPLITUDE_RATE=1e7, TIME_LIMIT_FACTOR=10, MIN_TIME_LIMIT=600, MAX_TIME_LIMIT=86400):
+            self.assertEqual(time_limit([task(cost=1e10)]), 1e4)
+            # Fused tasks add up
+            self.assertEqual(time_limit([task(cost=1e10), task(cost=2e10)]), 3e4)
+            self.assertEqual(time_limit([task(cost=1e3)]), 600)
+            self.assertEqual(time_limit([task(cost=1e15)]), 86400)
+            # Without an estimate the task gets the maximum
+            self.assertEqual(time_limit([task(), task(cost=1e10)]), 86400)
+
+    def test_disabled(self):
+        with mock.patch.object(sandbox, "MAX_TIME_LIMIT", 0):
+            self.assertIsNone(time_limit([task(cost=1e10)]))
+
+
+class SandboxTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Read by the sandbox process: a short run on private caches
+        environment = mock.patch.dict(os.environ, {
+            "DATASET_CACHE_DIR":     os.path.join(directory.name, "datasets"),
+            "CHECKPOINT_DIR":        os.path.join(directory.name, "checkpoints"),
+            "COMPILATION_CACHE_DIR": "",
+            "EPOCH_COUNT":           "3",
+            "LAYER_COUNT":           "2",
+        })
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.sandbox = Sandbox()
+        self.addCleanup(self.sandbox.stop)
+
+    def wine_task(self, **fields):
+        return task(encoding_id=0, ansatz_id=1, data_id=4, qubit_count=3, measure_index=0, sample_count=142, **fields)
+
+    def test_first_task_under_limit(self):
+        # Built-in encoding on the (in-memory) Wine dataset. Its estimate is tiny, so the
+        # task may grow by MIN_TASK_MEMORY_MB only, which the XLA backend alone would
+        # exceed if it was initialised by the task.
+        run = self.wine_task()
+        sent = []
+        with mock.patch.object(sandbox, "MIN_TASK_MEMORY_MB", 192):
+            self.sandbox.execute("run", run, lambda message, persistent=True: sent.append(message), [run])
+
+        self.assertEqual([message.status for message in sent if message.status != "progress"], ["init", "done"])
+        self.assertEqual(sent[-1].result["data_id"], 4)
+
+    def test_forwards_cancellations(self):
+        # Cancelled before the sandbox process was started, e.g. found in the DB
+        run = self.wine_task(run_id=2)
+        cancellation.cancel(2)
+        with self.assertRaises(cancellation.RunCancelled):
+            self.sandbox.execute("run", run, lambda message, persistent=True: None, [run])
+        # Forgotten once the task finished
+        self.assertFalse(cancellation.is_cancelled(2))
+
+    def test_cancel_without_process(self):
+        self.sandbox.cancel(1)
+        self.sandbox.start()
+        self.sandbox.stop()
+        self.sandbox.cancel(1)
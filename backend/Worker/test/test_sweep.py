@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from sweep import rung_budgets, successive_halving
+
+
+class RungBudgetsTest(TestCase):
+
+    def test_budgets(self):
+        # 9 candidates, eta 3: 9 -> 3 -> 1 over three rungs
+        self.assertEqual(rung_budgets(9, 90, 3), [10, 30, 90])
+        self.assertEqual(rung_budgets(8, 100, 2), [12, 25, 50, 100])
+        # Too few candidates to prune: the single rung trains fully
+        self.assertEqual(rung_budgets(2, 100, 3), [100])
+        self.assertEqual(rung_budgets(1, 100, 3), [100])
+        self.assertEqual(rung_budgets(0, 100, 3), [100])
+
+    def test_small_epoch_counts(self):
+        # Rungs never train for less than one epoch, and equal budgets are merged
+        self.assertEqual(rung_budgets(27, 3, 3), [1, 3])
+        self.assertEqual(rung_budgets(27, 1, 3), [1])
+
+    def test_increasing_and_ending_with_max_epochs(self):
+        for candidate_count in range(1, 40):
+            for reduction_factor in (2, 3, 4):
+                budgets = rung_budgets(candidate_count, 100, reduction_factor)
+                self.assertEqual(budgets[-1], 100)
+                self.assertEqual(budgets, sorted(set(budgets)))
+
+
+class SuccessiveHalvingTest(TestCase):
+
+    def test_prunes_the_worst_candidates(self):
+        losses = {name: index for index, name in enumerate("abcdefghi")}
+        trained, pruned = [], []
+
+        def train(candidate, n_epochs):
+            trained.append((candidate, n_epochs))
+            return {"trained_loss": losses[candidate]}
+
+        finished = successive_halving(list("ihgfedcba"), 90, 3, train, on_pruned=lambda candidate, _, n_epochs: pruned.append((candidate, n_epochs)))
+
+        self.assertEqual([candidate for candidate, _ in finished], ["a"])
+        self.assertEqual(sorted(pruned), sorted([(c, 10) for c in "defghi"] + [(c, 30) for c in "bc"]))
+        # Every rung trains the survivors of the previous one
+        self.assertEqual(len(trained), 9 + 3 + 1)
+        self.assertIn(("a", 90), trained)
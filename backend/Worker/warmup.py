@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+
+import db
+
+
+# Number of the most common recent configurations compiled at startup (0 disables warm-up)
+WARMUP_CONFIGS = int(os.getenv("WARMUP_CONFIGS", "3"))
+# Number of recent benchmark runs the configurations are counted in
+WARMUP_HISTORY = int(os.getenv("WARMUP_HISTORY", "200"))
+# Seconds after which the worker takes tasks from all lanes even if warm-up is not done
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "300"))
+# Written once warm-up finished, e.g. for a readiness probe; one file per worker process
+READY_FILE = os.getenv("READY_FILE", f"/tmp/worker-{os.getenv('WORKER_INDEX', '0')}.ready")
+
+# Fields that make up a configuration; runs sharing them share compiled functions and data
+CONFIG_FIELDS = ("ansatz_id", "encoding_id", "data_id", "qubit_count", "reduction", "task_type")
+
+
+def common_configurations(limit: int = WARMUP_CONFIGS, history: int = WARMUP_HISTORY) -> list[dict]:
+    """
+    Returns the most common configurations of the recent benchmark and preview runs.
+
+    :param limit: Maximum number of configurations.
+    :param history: Number of recent runs to count in.
+    :return: List of dictionaries with the ``CONFIG_FIELDS``, most common first.
+    """
+    return [group["_id"] for group in db.get_db()["benchmarkRuns"].aggregate([
+        {"$match": {"task_type": {"$in": ["benchmark", "preview", None]}}},
+        {"$sort": {"id": -1}},
+        {"$limit": history},
+        {"$group": {"_id": {field: f"${field}" for field in CONFIG_FIELDS}, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit},
+    ])]
+
+
+class Warmup(threading.Thread):
+    """
+    Background thread that preloads the datasets and compiles the models of the most
+    common configurations when a worker starts, while the worker already takes small
+    tasks. Like the prewarmer it never touches the RabbitMQ connection.
+    """
+
+    def __init__(self, warm, limit: int = WARMUP_CONFIGS, timeout: float = WARMUP_TIMEOUT, ready_file: str = READY_FILE):
+        """
+        :param warm: Function warming up one configuration (a dict with the ``CONFIG_FIELDS``).
+        :param limit: Number of configurations to warm up.
+        :param timeout: Seconds after which ``done`` reports True regardless.
+        :param ready_file: Path written once warm-up finished (empty disables it).
+        """
+        super().__init__(name="warmup", daemon=True)
+        self.warm       = warm
+        self.limit      = limit
+        self.ready_file = ready_file
+        self.ready      = threading.Event()
+        self.deadline   = time.monotonic() + timeout
+        if ready_file and os.path.exists(ready_file):
+            # Left behind by a previous process of the same worker
+            os.remove(ready_file)
+
+    def done(self) -> bool:
+        """
+        Whether warm-up finished or took too long to wait for.
+        """
+        return self.ready.is_set() or time.monotonic() >= self.deadline
+
+    def run(self):
+        start = time.monotonic()
+        warmed = []
+        try:
+            configs = common_configurations(self.limit) if self.limit > 0 else []
+        except Exception as e:
+            print(f"Warm-up: could not read recent runs: {e}", flush=True)
+            configs = []
+
+        for config in configs:
+            config_start = time.monotonic()
+            try:
+                self.warm(config)
+                warmed.append(config)
+                print(f"Warm-up: {config} ready after {time.monotonic() - config_start:.1f}s", flush=True)
+            except Exception as e:
+                # Best effort: the run reports the error itself once it is processed
+                print(f"Warm-up of {config} failed: {e}", flush=True)
+
+        duration = time.monotonic() - start
+        print(f"Warm-up finished in {duration:.1f}s ({len(warmed)}/{len(configs)} configurations)", flush=True)
+        if self.ready_file:
+            try:
+                with open(self.ready_file, "w") as f:
+                    json.dump({"pid": os.getpid(), "duration": duration, "configurations": warmed}, f, default=str)
+            except OSError as e:
+                print(f"Warm-up: could not write {self.ready_file}: {e}", flush=True)
+        self.ready.set()
@@ -1,28 +1,64 @@
-import ast
 import pika
 import os
+import threading
 import time
-import json
+import traceback
+from functools import partial
 
 from typing import Union
 
-from benchmark import run_benchmark
+import cancellation
+from checkpoint import delete_checkpoint
+import fusion
+import protocol
+from sandbox import PERMANENT_ERRORS, ResourceLimitExceeded, Sandbox
+from warmup import READY_FILE, WARMUP_TIMEOUT
 
 # Queue names
 TASK_QUEUE = 'task_queue'
+PREVIEW_QUEUE = 'preview_queue'
+SHORT_QUEUE = 'short_task_queue'
+LONG_QUEUE = 'long_task_queue'
 RESULT_QUEUE = 'result_queue'
 
+# Task lanes in order of priority. The API sends every task to a lane by its estimated
+# cost, and a worker only takes a task from a lane once all lanes above it are empty,
+# so interactive previews and short runs never wait behind large batch runs.
+TASK_LANES = [PREVIEW_QUEUE, SHORT_QUEUE, TASK_QUEUE, LONG_QUEUE]
+
+# Lanes served while the worker warms up (see warmup.py)
+WARMUP_LANES = [PREVIEW_QUEUE, SHORT_QUEUE]
+
+# Aging: a lane that was not looked at for LANE_AGING seconds is served first once,
+# so a steady stream of short tasks can not starve the long lane.
+LANE_AGING = float(os.getenv("LANE_AGING", "60"))
+
+# Seconds to wait before polling the lanes again when all of them are empty
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "1"))
+
+# A failed task is retried up to MAX_RETRIES times, after RETRY_DELAY seconds doubled
+# for every attempt. Each lane has one delay queue per attempt whose messages expire
+# back into the lane. Tasks that keep failing go to the DEAD_LETTER_QUEUE.
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
+RETRY_DELAY = float(os.getenv("RETRY_DELAY", "5"))
+DEAD_LETTER_QUEUE = 'dead_letter_queue'
+
+RETRY_HEADER  = 'x-retry-count'
+ERROR_HEADER  = 'x-last-error'
+ORIGIN_HEADER = 'x-original-queue'
+
+# Fused execution: up to FUSE_MAX_TASKS queued benchmark tasks of one lane that share
+# dataset, ansatz and qubit count are trained as one job (1 disables it). After the
+# first task, the lane is polled for FUSE_WINDOW seconds for compatible ones.
+FUSE_MAX_TASKS = int(os.getenv("FUSE_MAX_TASKS", "4"))
+FUSE_WINDOW    = float(os.getenv("FUSE_WINDOW", "0.2"))
+
 # Load RabbitMQ connection parameters from environment variables
 USER = os.getenv("RABBITMQ_USER", "erik")
 PASSWORD = os.getenv("RABBITMQ_PASS", "erik")
 HOST = os.getenv("RABBITMQ_HOST", "host.docker.internal")
 PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 
-
-EPOCH_COUNT   = int(os.getenv("EPOCH_COUNT", "100"))
-LEARNING_RATE = float(os.getenv("LEARNING_RATE", "0.2"))
-LAYER_COUNT   = int(os.getenv("LAYER_COUNT", "10"))
-
 # Set up RabbitMQ connection credentials and parameters
 credentials = pika.PlainCredentials(USER, PASSWORD)
 params = pika.ConnectionParameters(
@@ -34,8 +70,6 @@ params = pika.ConnectionParameters(
     retry_delay=5,
 )
 
-run_id: Union[str, None] = None
-
 # Establish connection to RabbitMQ server
 try:
     connection = pika.BlockingConnection(params)
@@ -46,101 +80,393 @@ except Exception as e:
 
 # Set up communication channels and declare queues
 channel = connection.channel()
-channel.queue_declare(queue=TASK_QUEUE, durable=True)
+for lane in TASK_LANES:
+    channel.queue_declare(queue=lane, durable=True)
 channel.queue_declare(queue=RESULT_QUEUE, durable=True)
+channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+
+
+def retry_queue(lane: str, attempt: int) -> str:
+    """
+    Returns the name of the delay queue holding a task of a lane before its next
+    attempt. The delay is part of the name, so workers configured with different
+    delays never declare the same queue with different arguments.
+
+    :param lane: The task lane the task came from.
+    :param attempt: Number of failed attempts so far (starting at 0).
+    """
+    return f'{lane}.retry.{int(RETRY_DELAY * 1000 * 2 ** attempt)}ms'
+
+
+# Control messages of the API (cancellations); every worker binds its own queue to
+# the fanout exchange. They are dispatched on the connection thread while it services
+# the connection, also while a task trains.
+def on_control(ch, method, properties, body):
+    try:
+        message = protocol.decode(body, properties.content_type, properties.headers, protocol.ControlMessage)
+    except ValueError as e:
+        print(f'Ignoring invalid control message: {e}', flush=True)
+        return
+    if message.type == "cancel":
+        print(f'Run {message.run_id} was cancelled', flush=True)
+        cancellation.cancel(message.run_id)
+        task_sandbox.cancel(message.run_id)
+
+
+channel.exchange_declare(exchange=cancellation.CONTROL_EXCHANGE, exchange_type='fanout')
+control_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+channel.queue_bind(exchange=cancellation.CONTROL_EXCHANGE, queue=control_queue)
+channel.basic_consume(queue=control_queue, on_message_callback=on_control, auto_ack=True)
+
+for lane in TASK_LANES:
+    for attempt in range(MAX_RETRIES):
+        channel.queue_declare(queue=retry_queue(lane, attempt), durable=True, arguments={
+            'x-message-ttl':             int(RETRY_DELAY * 1000 * 2 ** attempt),
+            'x-dead-letter-exchange':    '',
+            'x-dead-letter-routing-key': lane,
+        })
+
+# Trains the tasks in a child process with memory and wall-clock limits (see
+# sandbox.py). The background process starts warming up right away, while the worker
+# waits for tasks.
+if os.path.exists(READY_FILE):
+    os.remove(READY_FILE)
+task_sandbox = Sandbox()
+task_sandbox.start()
+task_sandbox.start_background()
+# Until warm-up finished (or WARMUP_TIMEOUT passed) only the WARMUP_LANES are
+# served, so a new worker starts contributing right away without taking a long run it
+# would compile from scratch.
+warmup_deadline = time.monotonic() + WARMUP_TIMEOUT
+
 
+def warmed_up() -> bool:
+    return not READY_FILE or os.path.exists(READY_FILE) or time.monotonic() >= warmup_deadline
 
-def send_result(message: dict):
+
+def on_connection_thread(callback):
+    """
+    Runs a callback on the thread that owns the RabbitMQ connection. pika connections
+    are not thread-safe, so the compute thread hands publishes and acks over to the
+    main thread, which runs them in order while it services the connection.
+
+    :param callback: Function without arguments using the connection or channel.
+    """
+    if threading.current_thread() is threading.main_thread():
+        callback()
+    else:
+        connection.add_callback_threadsafe(callback)
+
+
+def send_result(message: protocol.StatusMessage, persistent: bool = True):
     """
     Sends a result message to the RESULT_QUEUE in RabbitMQ.
 
-    :param message: A dictionary containing result data (e.g., task ID, status, progress).
+    :param message: The status message (e.g., run ID, status, progress or result).
+    :param persistent: Whether the broker stores the message on disk. Progress messages
+                       are superseded by the next one and do not need to survive a restart.
     """
-    body = json.dumps(message)
-    channel.basic_publish(
+    body, content_type, headers = protocol.encode(message)
+    on_connection_thread(partial(
+        channel.basic_publish,
         exchange='',
         routing_key=RESULT_QUEUE,
-        body=body.encode(),
-        properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
-    )
+        body=body,
+        properties=pika.BasicProperties(
+            content_type=content_type,
+            headers=headers,
+            delivery_mode=2 if persistent else 1
+        )
+    ))
+
+
+def retried(method, properties) -> bool:
+    """
+    Returns whether a task message was delivered before, by a retry or a redelivery.
+
+    :param method: Delivery method from RabbitMQ.
+    :param properties: Message properties.
+    """
+    return method.redelivered or bool((properties.headers or {}).get(RETRY_HEADER))
+
+
+def fused_callback(ch, batch: list):
+    """
+    Trains a batch of compatible benchmark tasks as one job in the sandbox (see
+    ``tasks.process_fused``), which publishes every run's progress and result separately.
+    The messages are acknowledged once all results are published. A cancelled run only
+    drops out of the job. If the fused job fails for any other reason, every task is
+    run on its own with the usual retry and dead-letter handling.
+
+    :param ch: The channel object.
+    :param batch: List of ``(method, properties, body, message_dict)`` of the tasks.
+    """
+    tasks = [message_dict for _, _, _, message_dict in batch]
+    run_ids = [task["run_id"] for task in tasks]
+    print(f'Get fused messages: {run_ids}', flush=True)
+    cancelled = cancellation.cancelled_in_db(run_ids) | {run_id for run_id in run_ids if cancellation.is_cancelled(run_id)}
+    for method, properties, body, message_dict in batch:
+        if message_dict["run_id"] in cancelled:
+            print(f'Skipping cancelled task {message_dict["run_id"]}', flush=True)
+            send_result(protocol.StatusMessage(id=message_dict["run_id"], status='cancelled'))
+            on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+    batch = [item for item in batch if item[3]["run_id"] not in cancelled]
+    cancellation.forget(cancelled)
+    if len(batch) < 2:
+        for method, properties, body, _ in batch:
+            callback(ch, method, properties, body)
+        return
+
+    tasks = [message_dict for _, _, _, message_dict in batch]
+    try:
+        task_sandbox.execute("fused", tasks, send_result, tasks)
+    except Exception as e:
+        print(f'Fused job {[task["run_id"] for task in tasks]} failed, running its tasks one by one: {e!r}', flush=True)
+        for method, properties, body, _ in batch:
+            callback(ch, method, properties, body)
+        return
 
+    print(f'Finished {[task["run_id"] for task in tasks]}', flush=True)
+    for method, _, _, _ in batch:
+        on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
 
-def send_progress(epoch_index: int, epoch_count: int):
-    progress_percentage = (epoch_index + 1) / epoch_count
-    send_result({'id': globals()["run_id"] , 'status': 'progress', 'progress': progress_percentage})
+
+def republish(ch, queue: str, properties, body, headers: dict):
+    """
+    Publishes a copy of a task message with additional headers.
+
+    :param ch: The channel object.
+    :param queue: Target queue.
+    :param properties: Properties of the original message.
+    :param body: The raw message body.
+    :param headers: Headers added to the original ones.
+    """
+    on_connection_thread(partial(
+        ch.basic_publish,
+        exchange='',
+        routing_key=queue,
+        body=body,
+        properties=pika.BasicProperties(
+            content_type=properties.content_type,
+            headers={**(properties.headers or {}), **headers},
+            delivery_mode=2
+        )
+    ))
+
+
+def handle_failure(ch, method, properties, body, message_dict: Union[dict, None], error: Exception):
+    """
+    Schedules a retry of a failed task or, once its retries are used up or the error
+    is permanent, moves it to the dead-letter queue and reports its runs as failed.
+    Either way the original message is acknowledged, so a failing task never blocks
+    the lane.
+
+    :param message_dict: The decoded task or None if it could not be decoded.
+    :param error: The exception the task failed with.
+    """
+    retries = int((properties.headers or {}).get(RETRY_HEADER, 0))
+    lane = method.routing_key
+    run_id = message_dict.get("run_id") if message_dict else None
+
+    permanent = isinstance(error, PERMANENT_ERRORS) or getattr(error, "permanent", False)
+    if retries < MAX_RETRIES and not permanent:
+        print(f'Task {run_id} failed (attempt {retries + 1}), retrying: {error!r}', flush=True)
+        republish(ch, retry_queue(lane, retries), properties, body, {RETRY_HEADER: retries + 1, ERROR_HEADER: repr(error)[:1000]})
+    else:
+        print(f'Task {run_id} failed (attempt {retries + 1}), moving it to {DEAD_LETTER_QUEUE}: {error!r}', flush=True)
+        republish(ch, DEAD_LETTER_QUEUE, properties, body, {RETRY_HEADER: retries, ERROR_HEADER: repr(error)[:1000], ORIGIN_HEADER: lane})
+        if message_dict:
+            for run in message_dict.get("runs", [message_dict]):
+                # A dead-lettered run is never resumed
+                delete_checkpoint(run["run_id"])
+                send_result(protocol.StatusMessage(
+                    id     = run["run_id"],
+                    status = 'failed',
+                    error  = str(error) or repr(error),
+                    limit  = error.to_dict() if isinstance(error, ResourceLimitExceeded) else None
+                ))
+
+    on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
 
 
 def callback(ch, method, properties, body):
     """
     Callback function that is triggered when a new message is received from the task queue.
-    It simulates a long-running task by sleeping and periodically sending progress updates.
+    It runs the task in the sandbox and acknowledges the message once all results have
+    been published.
+    Runs on the compute thread; the ack is handed over to the connection thread and
+    queued behind the task's result messages. Failed tasks are retried or
+    dead-lettered, see ``handle_failure``.
 
     :param ch: The channel object.
     :param method: Delivery method from RabbitMQ.
     :param properties: Message properties.
-    :param body: The raw message body (task ID expected).
+    :param body: The raw message body (task dictionary, see protocol.py).
     """
-    message = body.decode()
-    message_dict = ast.literal_eval(message)
-    run_id = message_dict["run_id"]
-    encoding_id = message_dict["encoding_id"]
-    ansatz_id = message_dict["ansatz_id"]
-    data_id = message_dict["data_id"]
-    measure_index = message_dict["measure_index"]
-    qubit_count = message_dict["qubit_count"]
-
-
-    globals()["run_id"] = run_id
-    print(f'Get message: {run_id}', flush=True)
+    try:
+        message_dict = decode_message(properties, body)
+    except Exception as e:
+        handle_failure(ch, method, properties, body, None, e)
+        return
 
-    # Send initial status
-    send_result({'id': run_id, 'status': 'init'})
-    
+    print(f'Get message: {message_dict.get("run_id")}', flush=True)
+    run_ids = [run["run_id"] for run in message_dict.get("runs", [message_dict])]
+    if cancellation.cancelled_in_db(run_ids) | {run_id for run_id in run_ids if cancellation.is_cancelled(run_id)} == set(run_ids):
+        print(f'Skipping cancelled task {message_dict.get("run_id")}', flush=True)
+        # A retried run may have left a checkpoint behind
+        for run_id in run_ids:
+            delete_checkpoint(run_id)
+        cancellation.forget(run_ids)
+        on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+        return
+    if protocol.message_version(properties.headers) > protocol.PROTOCOL_VERSION:
+        # Newer producers only add fields, which this worker ignores
+        print(f'Message uses protocol version {protocol.message_version(properties.headers)}, this worker speaks {protocol.PROTOCOL_VERSION}', flush=True)
     try:
-        benchmark_result = run_benchmark(
-            ansatz_id       = int(ansatz_id),
-            dataset_id      = int(data_id),
-            encoding_id     = int(encoding_id),
-            n_qubits        = int(qubit_count) or 5,
-            measure_wire    = measure_index,
-            n_epochs        = EPOCH_COUNT,
-            learning_rate   = LEARNING_RATE,
-            n_layers        = LAYER_COUNT,
-            progress_update = send_progress
-        )
-        print(benchmark_result, flush=True)
-
-        # Send final status
-        result = {
-            "run_id":       globals()["run_id"],
-            "encoding_id":  encoding_id,
-            "ansatz_id":    ansatz_id,
-            "data_id":      data_id,
-            "loss":         benchmark_result["loss"],
-            "accuracy":     benchmark_result["accuracy"],
-        }
-        print(result, flush=True)
-        send_result({
-            'id':     globals()["run_id"],
-            'status': 'done',
-            'result': result
-        })
+        kind = "sweep" if message_dict.get("task_type") == "sweep" else "run"
+        task_sandbox.execute(kind, message_dict, send_result, [message_dict])
 
-        print(f'Finished {message}', flush=True)
+        print(f'Finished {message_dict.get("run_id")}', flush=True)
 
         # Acknowledge message receipt and processing
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+    except cancellation.RunCancelled as e:
+        print(f'Stopped cancelled run {e.run_id}', flush=True)
+        send_result(protocol.StatusMessage(id=e.run_id, status='cancelled'))
+        on_connection_thread(partial(ch.basic_ack, delivery_tag=method.delivery_tag))
     except Exception as e:
-        ch.basic_nack(delivery_tag=method.delivery_tag)
-        print(f'Failed with exception {e = }.')
-        raise e
+        print(f'Task {message_dict.get("run_id")} failed: {e!r}', flush=True)
+        handle_failure(ch, method, properties, body, message_dict, e)
+
+
+def run_task(batch: list):
+    """
+    Runs a task (or a batch of fused tasks) on a compute thread while the main thread
+    keeps servicing the connection, so heartbeats are answered during long
+    compilations and training and the broker never drops the connection and
+    redelivers the task.
+
+    :param batch: List of ``(method, properties, body, message_dict)``, see ``next_batch``.
+    """
+    finished = threading.Event()
 
+    def compute():
+        try:
+            if len(batch) == 1:
+                method, properties, body, _ = batch[0]
+                callback(channel, method, properties, body)
+            else:
+                fused_callback(channel, batch)
+        except Exception as e:
+            # A bug outside the task's own error handling: retry or dead-letter the
+            # batch instead of taking the worker (and the next one it is
+            # redelivered to) down
+            traceback.print_exc()
+            for method, properties, body, message_dict in batch:
+                try:
+                    handle_failure(channel, method, properties, body, message_dict, e)
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            # Queued behind the task's results and its ack, so they are all sent
+            # once the main thread gets here.
+            connection.add_callback_threadsafe(finished.set)
+
+    threading.Thread(target=compute, name="compute", daemon=True).start()
+    while not finished.is_set():
+        connection.process_data_events(time_limit=1)
+
+
+# Last time each lane was served or found empty
+lane_checked = {lane: time.monotonic() for lane in TASK_LANES}
+
+
+# Task that was fetched while collecting a batch but did not fit into it; served next
+held: list = []
+
+
+def next_task():
+    """
+    Fetches the next task from the highest-priority non-empty lane. Lanes that have
+    waited longer than ``LANE_AGING`` are tried first, in priority order. During
+    warm-up only the ``WARMUP_LANES`` are served.
+
+    :return: Tuple ``(method, properties, body)`` or None if all lanes are empty.
+    """
+    if held:
+        return held.pop()
+    now = time.monotonic()
+    lanes = TASK_LANES if warmed_up() else WARMUP_LANES
+    lanes = sorted(lanes, key=lambda lane: now - lane_checked[lane] < LANE_AGING)
+    for lane in lanes:
+        method, properties, body = channel.basic_get(queue=lane)
+        # Served or empty: either way nothing in the lane is waiting on this worker
+        lane_checked[lane] = now
+        if method:
+            return method, properties, body
+    return None
+
+
+def decode_message(properties, body) -> dict:
+    """
+    Decodes and validates a task message (see protocol.py). The worker hands tasks to
+    the sandbox as plain dictionaries with all fields of their message type.
+
+    :raises ValueError: If the message can not be parsed or is no valid task.
+    """
+    return protocol.decode(body, properties.content_type, properties.headers, protocol.parse_task).to_dict()
+
+
+def decode_task(properties, body) -> Union[dict, None]:
+    try:
+        return decode_message(properties, body)
+    except Exception:
+        # Left to the callback, which dead-letters it
+        return None
+
+
+def next_batch():
+    """
+    Fetches the next task and, if it can be fused, up to ``FUSE_MAX_TASKS - 1``
+    compatible tasks queued behind it in the same lane. Messages are fetched one by
+    one with ``basic_get`` and stay unacknowledged until their results are published.
+    Collection stops at the first incompatible task, which is held back for the next
+    batch, so the order of the lane is kept.
+
+    :return: List of ``(method, properties, body, message_dict)`` or None if all
+             lanes are empty.
+    """
+    task = next_task()
+    if task is None:
+        return None
+    method, properties, body = task
+    message_dict = decode_task(properties, body)
+    batch = [(method, properties, body, message_dict)]
+    key = fusion.fuse_key(message_dict, retried(method, properties)) if message_dict else None
+    if key is None or FUSE_MAX_TASKS < 2:
+        return batch
 
-# Ensure one task is delivered and processed at a time (fair dispatch)
-channel.basic_qos(prefetch_count=1)
+    deadline = time.monotonic() + FUSE_WINDOW
+    while len(batch) < FUSE_MAX_TASKS:
+        method, properties, body = channel.basic_get(queue=batch[0][0].routing_key)
+        if method is None:
+            if time.monotonic() >= deadline:
+                break
+            connection.sleep(min(0.05, FUSE_WINDOW))
+            continue
+        message_dict = decode_task(properties, body)
+        if message_dict is None or fusion.fuse_key(message_dict, retried(method, properties)) != key:
+            held.append((method, properties, body))
+            break
+        batch.append((method, properties, body, message_dict))
+    return batch
 
-# Start consuming messages from the task queue
-channel.basic_consume(queue=TASK_QUEUE, on_message_callback=callback)
 
 print(f'Wait for tasks...', flush=True)
-channel.start_consuming()
+while True:
+    batch = next_batch()
+    if batch is None:
+        # Sleeping on the connection keeps heartbeats flowing while idle
+        connection.sleep(POLL_INTERVAL)
+        continue
+    run_task(batch)
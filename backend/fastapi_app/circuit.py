@@ -20,15 +20,21 @@ Circuit = list[Gate]
 #   Gate names.
 #
 gate_names_by_param_count: dict[int, set[str]] = {
-    0: set(['X', 'Y', 'Z', 'H', 'CNOT']),
+    0: set(['X', 'Y', 'Z', 'H', 'CNOT', 'AMPLITUDE']),
     1: set(['RX', 'RY', 'RZ']),
 }
 
-gate_names_by_wire_count: dict[int, set[str]] = {
+# Gates with 'None' act on a variable number of (at least one) wires.
+gate_names_by_wire_count: dict[int | None, set[str]] = {
     1: set(['X', 'Y', 'Z', 'H', 'RX', 'RY', 'RZ']),
     2: set(['CNOT']),
+    None: set(['AMPLITUDE']),
 }
 
+# Amplitude embedding: prepares the state of its wires from the normalised feature
+# vector (padded to 2 ** len(wires) amplitudes). It has to be the first gate.
+amplitude_gate_name = 'AMPLITUDE'
+
 gate_names: set[str] = set([name for row in gate_names_by_param_count.values() for name in row])
 
 param_count_by_gate_name: dict[str, int] = {
@@ -76,6 +82,15 @@ def err_circuit_empty() -> str:
 def err_param_input_pattern_mismatch(gate_index: int, param_index: int) -> str:
     return f'Parameter of type string has to match the input index pattern ({gate_index}, {param_index}).'
 
+def err_gate_wires_missing(gate_index: int) -> str:
+    return f'Gate expected at least one wire ({gate_index = }).'
+
+def err_gate_wires_not_distinct(gate_index: int) -> str:
+    return f'Gate wires have to be distinct ({gate_index = }).'
+
+def err_amplitude_not_first(gate_index: int) -> str:
+    return f'Amplitude embedding has to be the first gate ({gate_index = }).'
+
  
 
 #
@@ -95,8 +110,17 @@ def validate_circuit(circuit: Circuit, qubit_count: int | None = None) -> list[s
             if len(gate.params) != expected_param_count:
                 err.append(err_gate_param_count_wrong(gate_index, expected_param_count))
 
-            if len(gate.wires) != expected_wire_count:
+            if expected_wire_count is None:
+                if len(gate.wires) == 0:
+                    err.append(err_gate_wires_missing(gate_index))
+            elif len(gate.wires) != expected_wire_count:
                 err.append(err_gate_wire_count_wrong(gate_index, expected_wire_count))
+
+            if len(set(gate.wires)) != len(gate.wires):
+                err.append(err_gate_wires_not_distinct(gate_index))
+
+            if gate.gate == amplitude_gate_name and gate_index != 0:
+                err.append(err_amplitude_not_first(gate_index))
         else:
             err.append(err_gate_not_supported(gate_index))
             continue
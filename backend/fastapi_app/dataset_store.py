@@ -0,0 +1,183 @@
+import csv
+import io
+import os
+from collections import Counter
+
+import numpy as np
+from gridfs import GridFSBucket
+
+
+#
+#   Storage of uploaded datasets.
+#
+#   The raw files live in the GridFS bucket 'userDatasets'; their schema and class
+#   statistics are kept as an entry of the 'datasets' collection with source 'upload'.
+#   Everything in here is blocking and meant to run in a threadpool, reading the
+#   stored file back in chunks instead of loading it into memory.
+#
+UPLOAD_BUCKET     = "userDatasets"
+UPLOAD_FORMATS    = ("csv", "npy", "parquet")
+UPLOAD_CHUNK_SIZE = 1 << 20
+MAX_UPLOAD_SIZE   = int(os.getenv("MAX_UPLOAD_SIZE", str(1 << 30)))
+
+# Rows parsed per batch when validating CSV files
+CSV_BATCH_ROWS = 10_000
+
+
+def get_bucket(db) -> GridFSBucket:
+    """
+    Returns the GridFS bucket holding the uploaded dataset files.
+
+    Args:
+        db: The 'Quantum-Encoding-DB' database.
+
+    Returns:
+        GridFSBucket: The 'userDatasets' bucket.
+    """
+    return GridFSBucket(db, bucket_name=UPLOAD_BUCKET)
+
+
+def describe_upload(stream, format: str, label_column: str) -> dict:
+    """
+    Validates a stored dataset file and collects its schema and class statistics.
+
+    Args:
+        stream: Readable (GridFS) file object positioned at the start of the file.
+        format (str): One of ``csv``, ``npy`` or ``parquet``.
+        label_column (str): Name of the label column (ignored for ``npy``, where the
+            last column holds the labels).
+
+    Returns:
+        dict: ``columns``, ``feature_count``, ``sample_count`` and ``class_counts``.
+
+    Raises:
+        ValueError: If the file is malformed or does not match the expected layout.
+        ImportError: If a parquet file is described without pyarrow installed.
+    """
+    if format == "csv":
+        return describe_csv(stream, label_column)
+    if format == "npy":
+        return describe_npy(stream)
+    if format == "parquet":
+        return describe_parquet(stream, label_column)
+    raise ValueError(f"Unsupported format '{format}', expected one of {', '.join(UPLOAD_FORMATS)}")
+
+
+def _statistics(columns: list[str], sample_count: int, class_counts: Counter) -> dict:
+    if sample_count == 0:
+        raise ValueError("Dataset contains no samples")
+    if len(class_counts) != 2:
+        # The classifier is binary (labels are mapped to 0/1 in sorted order)
+        raise ValueError(f"Dataset needs exactly two classes, found {len(class_counts)}")
+    return {
+        "columns":       columns,
+        "feature_count": len(columns) - 1,
+        "sample_count":  sample_count,
+        "class_counts":  {str(label): int(count) for label, count in sorted(class_counts.items(), key=lambda item: str(item[0]))},
+    }
+
+
+def describe_csv(stream, label_column: str) -> dict:
+    """
+    Describes a CSV file with a header row. All columns except the label column must
+    be numeric.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+    header = next(reader, None)
+    if not header:
+        raise ValueError("CSV file has no header row")
+    if label_column not in header:
+        raise ValueError(f"Label column '{label_column}' not found in CSV header")
+
+    label_index = header.index(label_column)
+    class_counts = Counter()
+    sample_count = 0
+    batch = []
+
+    def check(batch):
+        try:
+            np.asarray(batch, dtype=np.float64)
+        except ValueError:
+            first_row = sample_count - len(batch) + 1
+            raise ValueError(f"CSV file contains non-numeric feature values in rows {first_row}-{sample_count}")
+
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(header):
+            raise ValueError(f"CSV row {sample_count + 1} has {len(row)} columns, expected {len(header)}")
+        class_counts[row[label_index]] += 1
+        batch.append(row[:label_index] + row[label_index + 1:])
+        sample_count += 1
+        if len(batch) == CSV_BATCH_ROWS:
+            check(batch)
+            batch = []
+    if batch:
+        check(batch)
+
+    return _statistics(header, sample_count, class_counts)
+
+
+def describe_npy(stream) -> dict:
+    """
+    Describes a two dimensional ``.npy`` array whose last column holds the labels.
+    """
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    except ValueError as e:
+        raise ValueError(f"Invalid npy file: {e}")
+
+    if len(shape) != 2 or shape[1] < 2:
+        raise ValueError(f"npy array must have shape (samples, features + 1), got {shape}")
+    if fortran_order:
+        raise ValueError("npy array must be stored in C order")
+    if dtype.hasobject or dtype.kind not in "biuf":
+        raise ValueError(f"npy array must be numeric, got dtype {dtype}")
+
+    n_rows, n_columns = shape
+    row_size = dtype.itemsize * n_columns
+    rows_per_chunk = max(1, UPLOAD_CHUNK_SIZE // row_size)
+    class_counts = Counter()
+    rows_read = 0
+
+    while rows_read < n_rows:
+        count = min(rows_per_chunk, n_rows - rows_read)
+        data = stream.read(count * row_size)
+        if len(data) != count * row_size:
+            raise ValueError("npy file is truncated")
+        labels, counts = np.unique(np.frombuffer(data, dtype=dtype).reshape(count, n_columns)[:, -1], return_counts=True)
+        class_counts.update(dict(zip(labels.tolist(), counts.tolist())))
+        rows_read += count
+
+    columns = [f"feature_{index}" for index in range(n_columns - 1)] + ["label"]
+    return _statistics(columns, n_rows, class_counts)
+
+
+def describe_parquet(stream, label_column: str) -> dict:
+    """
+    Describes a parquet file. Needs pyarrow, which is an optional dependency of the API.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    try:
+        parquet_file = pq.ParquetFile(stream)
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Invalid parquet file: {e}")
+
+    schema = parquet_file.schema_arrow
+    if label_column not in schema.names:
+        raise ValueError(f"Label column '{label_column}' not found in parquet schema")
+    for field in schema:
+        if field.name != label_column and not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)):
+            raise ValueError(f"Feature column '{field.name}' must be numeric, got {field.type}")
+
+    class_counts = Counter()
+    for batch in parquet_file.iter_batches(columns=[label_column]):
+        class_counts.update(batch.column(0).to_pylist())
+
+    return _statistics(schema.names, parquet_file.metadata.num_rows, class_counts)
@@ -46,22 +46,26 @@ def init_progress(id: int):
     """
     db = get_db()
     collection = db["benchmarkRuns"]
-    query = {"id": id}
+    # Messages still in flight must not revive a cancelled run
+    query = {"id": id, "status": {"$ne": "cancelled"}}
     new_values = {"$set": {"status": "progress", "progress": 0}}
     collection.update_one(query, new_values)
 
-def update_progress(id: int, progress: int):
+def update_progress(id: int, progress: int, loss: float = None, eta: float = None):
     """
     Update the progress percentage for a given benchmarkRuns object id.
 
     Args:
         id (int): The benchmarkRuns id.
         progress (int): The new progress percentage value.
+        loss (float): The current training loss, if reported.
+        eta (float): Estimated seconds until the run finishes, if known.
     """
     db = get_db()
     collection = db["benchmarkRuns"]
-    query = {"id": id}
-    new_values = {"$set": {"status": "progress", "progress": progress}}
+    # Messages still in flight must not revive a cancelled run
+    query = {"id": id, "status": {"$ne": "cancelled"}}
+    new_values = {"$set": {"status": "progress", "progress": progress, "loss": loss, "eta": eta}}
     collection.update_one(query, new_values)
 
 def finished_progress(id: int):
@@ -78,6 +82,70 @@ def finished_progress(id: int):
     new_values = {"$set": {"status": "done", "progress": 100}}
     collection.update_one(query, new_values)
 
+def pruned_progress(id: int):
+    """
+    Mark a benchmarkRuns entry as pruned by an adaptive sweep.
+
+    Args:
+        id (int): The benchmarkRuns id.
+    """
+    db = get_db()
+    collection = db["benchmarkRuns"]
+    query = {"id": id}
+    new_values = {"$set": {"status": "pruned"}}
+    collection.update_one(query, new_values)
+
+def failed_progress(id: int, error: str, limit: dict = None):
+    """
+    Mark a benchmarkRuns entry as failed after the worker gave up on its task.
+
+    Runs a sweep already finished or pruned and cancelled runs keep their status.
+
+    Args:
+        id (int): The benchmarkRuns id.
+        error (str): The error the task failed with.
+        limit (dict): The resource limit the run was rejected for or stopped at
+            (``kind``, ``limit`` and ``estimate``), if any.
+    """
+    db = get_db()
+    collection = db["benchmarkRuns"]
+    query = {"id": id, "status": {"$nin": ["done", "pruned", "cancelled"]}}
+    new_values = {"$set": {"status": "failed", "error": error}}
+    if limit:
+        new_values["$set"]["resource_limit"] = limit
+    collection.update_one(query, new_values)
+
+def cancel_run(id: int) -> bool:
+    """
+    Mark a benchmarkRuns entry as cancelled unless it already finished.
+
+    Args:
+        id (int): The benchmarkRuns id.
+
+    Returns:
+        bool: True if the run was still pending or in progress.
+    """
+    db = get_db()
+    collection = db["benchmarkRuns"]
+    query = {"id": id, "status": {"$in": ["pending", "progress"]}}
+    new_values = {"$set": {"status": "cancelled"}}
+    return collection.update_one(query, new_values).modified_count > 0
+
+def is_cancelled(id: int) -> bool:
+    """
+    Check whether a benchmarkRuns entry was cancelled or deleted.
+
+    Args:
+        id (int): The benchmarkRuns id.
+
+    Returns:
+        bool: True if the run is cancelled or does not exist anymore.
+    """
+    db = get_db()
+    collection = db["benchmarkRuns"]
+    doc = collection.find_one({"id": id}, {"status": 1})
+    return doc is None or doc.get("status") == "cancelled"
+
 def set_result(result):
     """
     Set the result of a given benchmarkRun.
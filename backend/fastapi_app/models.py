@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, model_validator, field_validator, ConfigDict
-from typing import List, Optional, Union, Dict, Any
+from typing import List, Optional, Union, Dict, Any, Literal
 
 class Gate(BaseModel):
     """Single quantum gate definition.
@@ -98,10 +98,22 @@ class ReferenceData(BaseModel):
     data: Dict[str, DatasetInfo]
 
 # Models for Run Benchmark API
+# Feature reductions the worker can map a dataset onto the qubit count with
+FeatureReduction = Literal["pca", "random_projection", "select"]
+
 class RunBenchmarkRequest(BaseModel):
     encoding_id: Union[int, List[int]]
     ansatz_id: Union[int, List[int]]
     data_id: Union[int, List[int]]
+    # Optional adaptive sweep over the requested combinations
+    sweep: Optional[Literal["successive_halving"]] = None
+    reduction_factor: int = Field(3, ge=2)
+    # Quick estimate on a data subset, sent through the high-priority lane
+    preview: bool = False
+    # Optional feature reduction of the dataset onto the qubit count
+    reduction: Optional[FeatureReduction] = None
+    # Stratified k-fold cross-validation, all folds trained in one task
+    k_folds: Optional[int] = Field(None, ge=2, le=20)
 
     @field_validator("encoding_id", "ansatz_id", "data_id", mode='before')
     @classmethod
@@ -112,10 +124,56 @@ class RunBenchmarkRequest(BaseModel):
             return [int(item) for item in v]
         raise ValueError("Value must be an integer or a list of integers")
 
+    @model_validator(mode='after')
+    def check_run_type(self):
+        if self.preview and self.sweep:
+            raise ValueError("Preview runs can not be part of a sweep")
+        if self.k_folds and (self.preview or self.sweep):
+            raise ValueError("Cross-validation runs can not be previews or part of a sweep")
+        return self
+
 class RunBenchmarkResponse(BaseModel):
     message: str
     id: int
 
+# Models for Hyperparameter Search API
+SUPPORTED_OPTIMIZERS = {"adam", "sgd", "rmsprop", "adagrad"}
+
+class HyperparameterSearchRequest(BaseModel):
+    """Search space for a hyperparameter search run.
+
+    With ``strategy="grid"`` every combination of ``learning_rates``,
+    ``optimizers`` and ``layer_counts`` is trained. With ``strategy="random"``
+    ``learning_rates`` is a ``[low, high]`` range that ``sample_count``
+    learning rates are drawn from (log-uniform).
+    """
+    encoding_id: int
+    ansatz_id: int
+    data_id: int
+    strategy: Literal["grid", "random"] = "grid"
+    learning_rates: List[float]
+    optimizers: List[str] = Field(default_factory=lambda: ["adam"])
+    layer_counts: Optional[List[int]] = None
+    sample_count: int = Field(10, gt=0)
+    seed: int = 0
+    reduction: Optional[FeatureReduction] = None
+
+    @field_validator("optimizers")
+    @classmethod
+    def check_optimizers(cls, v):
+        unknown = [name for name in v if name not in SUPPORTED_OPTIMIZERS]
+        if unknown or not v:
+            raise ValueError(f"Optimizers must be a non-empty subset of {sorted(SUPPORTED_OPTIMIZERS)}")
+        return v
+
+    @model_validator(mode='after')
+    def check_learning_rates(self):
+        if not self.learning_rates or any(lr <= 0 for lr in self.learning_rates):
+            raise ValueError("Learning rates must be positive")
+        if self.strategy == "random" and (len(self.learning_rates) != 2 or self.learning_rates[0] >= self.learning_rates[1]):
+            raise ValueError("Random search expects learning_rates as a [low, high] range")
+        return self
+
 # Models for Benchmark Result API
 class BenchmarkResult(BaseModel):
     run_id: int
@@ -1,12 +1,18 @@
 import os
 import pika
-import json
 import threading
 from threading import Lock
 import db
+from fastapi_app import protocol
 
 # Constants for RabbitMQ queues
 TASK_QUEUE = 'task_queue'
+PREVIEW_QUEUE = 'preview_queue'
+# Lanes of short and long tasks, see scheduling.py
+SHORT_QUEUE = 'short_task_queue'
+LONG_QUEUE = 'long_task_queue'
+# Fanout exchange for control messages every worker receives (e.g. cancellations)
+CONTROL_EXCHANGE = 'control'
 RESULT_QUEUE = 'result_queue'
 
 # Environment variables for RabbitMQ connection credentials and host
@@ -68,7 +74,11 @@ class RabbitMQ:
             channel = connection.channel()
             # Declare queues as durable to survive RabbitMQ restarts
             channel.queue_declare(queue=TASK_QUEUE, durable=True)
+            channel.queue_declare(queue=PREVIEW_QUEUE, durable=True)
+            channel.queue_declare(queue=SHORT_QUEUE, durable=True)
+            channel.queue_declare(queue=LONG_QUEUE, durable=True)
             channel.queue_declare(queue=RESULT_QUEUE, durable=True)
+            channel.exchange_declare(exchange=CONTROL_EXCHANGE, exchange_type='fanout')
 
             # Thread-safe assignment of connection and channel
             with self.lock:
@@ -89,16 +99,20 @@ class RabbitMQ:
         self.close()
         self.connect()
 
-    def send_message(self, message: str, max_retries=3):
+    def send_message(self, message: protocol.Message, max_retries=3, queue=TASK_QUEUE, exchange=''):
         """
-        Send a task message (task_id as string) to the TASK_QUEUE with retries.
+        Send a task message to a task queue with retries.
 
         Args:
-            task_id (str): The unique identifier for the task to send.
+            message (Message): The ``TaskMessage`` or ``SweepMessage`` (see protocol.py).
             max_retries (int): Number of times to retry sending on failure (default: 3).
+            queue (str): Task lane to publish to; the workers drain PREVIEW_QUEUE,
+                SHORT_QUEUE, TASK_QUEUE and LONG_QUEUE in this order (default: TASK_QUEUE).
+            exchange (str): Exchange to publish to (default: the default exchange).
 
         This method ensures thread safety and reconnects on failures.
         """
+        body, content_type, headers = protocol.encode(message)
         attempt = 0
 
         while attempt < max_retries:
@@ -109,12 +123,16 @@ class RabbitMQ:
                         raise pika.exceptions.AMQPChannelError("Channel is closed")
                     # Publish message persistently
                     self.channel.basic_publish(
-                        exchange='',
-                        routing_key=TASK_QUEUE,
-                        body=message.encode(),
-                        properties=pika.BasicProperties(delivery_mode=2)  # Persistent delivery
+                        exchange=exchange,
+                        routing_key=queue,
+                        body=body,
+                        properties=pika.BasicProperties(
+                            content_type=content_type,
+                            headers=headers,
+                            delivery_mode=2  # Persistent delivery
+                        )
                     )
-                    print(f"[x] Sent task {message}", flush=True)
+                    print(f"[x] Sent {getattr(message, 'task_type', message.__class__.__name__)} {message.run_id}", flush=True)
                     return  # Success, exit method
 
             except pika.exceptions.AMQPError as e:
@@ -127,7 +145,16 @@ class RabbitMQ:
                 self.reconnect()
                 attempt += 1
 
-        print(f"[!] Failed to send task {message} after {max_retries} attempts", flush=True)
+        print(f"[!] Failed to send task {message.run_id} after {max_retries} attempts", flush=True)
+
+    def send_control(self, message: protocol.ControlMessage):
+        """
+        Broadcast a control message to all workers through the fanout CONTROL_EXCHANGE.
+
+        Args:
+            message (ControlMessage): The control message, e.g. the cancellation of a run.
+        """
+        self.send_message(message, queue='', exchange=CONTROL_EXCHANGE)
 
     def start_result_consumer(self):
         """
@@ -136,8 +163,14 @@ class RabbitMQ:
         The consumer updates the progress in the database depending on message status:
 
         - 'init': initializes progress for the task
-        - 'progress': updates current progress percentage
+        - 'progress': updates current progress percentage, loss and ETA (seconds left)
         - 'done': marks task as finished
+        - 'pruned': stores the partial result of a run eliminated by a sweep
+        - 'failed': marks a run whose task the worker gave up on, with the error and
+          the resource limit it exceeded, if any
+        - 'cancelled': confirms that a worker stopped a cancelled run
+
+        Results of runs that were cancelled or deleted in the meantime are dropped.
 
         This method ensures only one consumer thread runs at a time.
         """
@@ -150,26 +183,35 @@ class RabbitMQ:
             """
             Callback executed on receiving a message from RESULT_QUEUE.
 
-            Parses the JSON message and updates the database accordingly.
+            Parses and validates the ``StatusMessage`` (JSON, msgpack or legacy JSON
+            without a content type) and updates the database accordingly.
             Acknowledges message on success, negative-acknowledges on failure without requeue.
             """
             try:
-                message = json.loads(body.decode())
-                task_id = message.get("id")
-                status = message.get("status")
-                result = message.get("result")
+                message = protocol.decode(body, properties.content_type, properties.headers, protocol.StatusMessage)
+                task_id = message.id
+                status = message.status
+                result = protocol.to_builtin(message.result)
 
                 if status == "init":
                     db.init_progress(task_id)
                 elif status == "progress":
-                    db.update_progress(task_id, message.get("progress", 0))
+                    db.update_progress(task_id, message.progress or 0, message.loss, message.eta)
+                elif status in ("done", "pruned") and db.is_cancelled(task_id):
+                    print(f"[!] Dropping result of cancelled run {task_id}", flush=True)
                 elif status == "done":
                     db.set_result(result)
                     db.finished_progress(task_id)
-                else:
-                    print(f"[!] Unknown status: {status}", flush=True)
-
-                print(f"[{status}] Task {task_id} → {db.get_benchmarkRuns(task_id)}", flush=True)
+                elif status == "pruned":
+                    db.set_result(result)
+                    db.pruned_progress(task_id)
+                elif status == "failed":
+                    db.failed_progress(task_id, message.error or "", protocol.to_builtin(message.limit))
+                elif status == "cancelled":
+                    db.cancel_run(task_id)
+
+                if status != "progress":
+                    print(f"[{status}] Task {task_id} → {db.get_benchmarkRuns(task_id)}", flush=True)
                 ch.basic_ack(delivery_tag=method.delivery_tag)
 
             except Exception as e:
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi_app.models import ReferenceData, EncodingInfo, AnsatzInfo, DatasetInfo
-from fastapi_app.db import get_db
+from fastapi_app.db import get_db, get_next_id
+from fastapi_app import dataset_store
 from datetime import datetime, UTC
+from typing import Literal
 import traceback
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -22,6 +25,18 @@ Endpoints
 ``GET    /dataset``
     Retrieve all stored reference data entries.
 
+``POST   /dataset/upload``
+    Upload a CSV/NPY/Parquet dataset as a streamed request body. The file is
+    written to GridFS chunk by chunk and described in the ``datasets``
+    collection, so it can be benchmarked like the built-in datasets. The
+    classifier is binary, so the labels must take exactly two values.
+
+``GET    /dataset/upload``
+    Retrieve the schema and class statistics of all uploaded datasets.
+
+``DELETE /dataset/upload/{dataset_id}``
+    Remove an uploaded dataset and its stored file.
+
 ``GET    /dataset/{object_id}``
     Retrieve a specific reference data entry by MongoDB object id.
 
@@ -54,6 +69,97 @@ def list_all_reference_data():
         doc["_id"] = str(doc["_id"])
     return docs
 
+def serialize_upload(doc: dict) -> dict:
+    doc["_id"] = str(doc["_id"])
+    doc["file_id"] = str(doc["file_id"])
+    return doc
+
+@router.post("/dataset/upload", response_model=dict)
+async def upload_dataset(
+    request: Request,
+    name: str,
+    format: Literal["csv", "npy", "parquet"],
+    label_column: str = "label",
+    description: str = "",
+):
+    db = get_db()
+    bucket = dataset_store.get_bucket(db)
+    file_id = ObjectId()
+    upload = bucket.open_upload_stream_with_id(file_id, name, metadata={"format": format})
+
+    # The body is consumed as a stream and handed to GridFS in ~1 MiB pieces; all
+    # blocking pymongo calls run in the threadpool so the event loop stays free.
+    size = 0
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > dataset_store.MAX_UPLOAD_SIZE:
+                await run_in_threadpool(upload.abort)
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {dataset_store.MAX_UPLOAD_SIZE} bytes")
+            buffer.extend(chunk)
+            if len(buffer) >= dataset_store.UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(upload.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(upload.write, bytes(buffer))
+        await run_in_threadpool(upload.close)
+    except HTTPException:
+        raise
+    except Exception:
+        traceback.print_exc()
+        await run_in_threadpool(upload.abort)
+        raise HTTPException(status_code=500, detail="DB error")
+
+    if size == 0:
+        await run_in_threadpool(bucket.delete, file_id)
+        raise HTTPException(status_code=400, detail="Empty upload")
+
+    def describe():
+        with bucket.open_download_stream(file_id) as stream:
+            return dataset_store.describe_upload(stream, format, label_column)
+
+    try:
+        statistics = await run_in_threadpool(describe)
+    except (ValueError, ImportError) as e:
+        await run_in_threadpool(bucket.delete, file_id)
+        status_code = 501 if isinstance(e, ImportError) else 422
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+    try:
+        doc = {
+            "id": await run_in_threadpool(get_next_id, "datasets"),
+            "name": name,
+            "description": description,
+            "source": "upload",
+            "format": format,
+            "file_id": file_id,
+            "size": size,
+            "label_column": label_column if format != "npy" else "label",
+            **statistics,
+            "timestamp": datetime.now(UTC),
+        }
+        await run_in_threadpool(db.datasets.insert_one, doc)
+        return {"message": f"Uploaded dataset with ID {doc['id']}", "id": doc["id"], **statistics}
+    except Exception:
+        traceback.print_exc()
+        await run_in_threadpool(bucket.delete, file_id)
+        raise HTTPException(status_code=500, detail="DB error")
+
+@router.get("/dataset/upload")
+def list_uploaded_datasets():
+    db = get_db()
+    return [serialize_upload(doc) for doc in db.datasets.find({"source": "upload"})]
+
+@router.delete("/dataset/upload/{dataset_id}")
+def delete_uploaded_dataset(dataset_id: int):
+    db = get_db()
+    doc = db.datasets.find_one_and_delete({"id": dataset_id, "source": "upload"})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Not found")
+    dataset_store.get_bucket(db).delete(doc["file_id"])
+    return {"message": f"Deleted dataset {dataset_id}"}
+
 @router.get("/dataset/{object_id}")
 def get_reference_data_by_id(object_id: str):
     db = get_db()
@@ -66,6 +66,9 @@ def get_all_benchmark_results():
             # Some legacy documents might miss run_id; skip them
             if "run_id" not in doc:
                 continue
+            # Preview estimates are not part of the benchmark results
+            if doc.get("preview"):
+                continue
             results.append(BenchmarkResult(
                 run_id=doc["run_id"],
                 encoding_id=doc["encoding_id"],
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException, Body
-from fastapi_app.models import RunBenchmarkRequest, RunBenchmarkResponse
-from fastapi_app.db import get_db, get_next_id
+from fastapi_app.models import RunBenchmarkRequest, RunBenchmarkResponse, HyperparameterSearchRequest
+from fastapi_app.db import get_db, get_next_id, cancel_run
 from fastapi_app.rabbitmq import rabbitmq
+from fastapi_app.protocol import TaskMessage, SweepMessage, ControlMessage
+from fastapi_app.scheduling import dataset_sample_count, run_cost, select_lane
 from datetime import datetime, UTC
-from typing import List
+from typing import Dict, List
 import traceback
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -20,7 +22,26 @@ mounted under ``/api``.
 Endpoints
 ---------
 ``POST   /run``
-    Create a benchmark run request and send it to the worker.
+    Create a benchmark run request and send it to the worker. With
+    ``sweep="successive_halving"`` the runs sharing ansatz and dataset are sent
+    as one adaptive sweep that prunes the weaker encodings early. With
+    ``preview=true`` the runs train briefly on a data subset and are sent
+    through the high-priority preview lane. With ``reduction`` the worker maps
+    the dataset onto the qubit count with PCA, a random projection or feature
+    selection instead of the dataset's own downscaling. With ``k_folds`` every
+    run is a stratified k-fold cross-validation whose folds train in one task.
+    Every task is sent to the short, normal or long lane by its estimated cost
+    (see scheduling.py), so small runs do not wait behind large ones.
+
+``POST   /run/{run_id}/promote``
+    Start a full run that warm-starts from a finished preview run.
+
+``POST   /run/{run_id}/cancel``
+    Cancel a pending or running run. Workers skip it when they dequeue it or
+    stop it after the current epoch.
+
+``POST   /run/search``
+    Create a hyperparameter search run that trains all candidates in one task.
 
 ``GET    /run``
     List all benchmark run requests.
@@ -32,9 +53,42 @@ Endpoints
     Update the parameters of an existing run request.
 
 ``DELETE /run/{object_id}``
-    Delete a benchmark run entry.
+    Delete a benchmark run entry; an unfinished run is cancelled first.
 """
 
+def circuit_qubit_count(circuit) -> int:
+    """Return the qubit count a gate list acts on (0 if it has no wires)."""
+    indices = []
+    for gate in circuit or []:
+        # Support 'wires' as well as the legacy 'target'/'control' keys
+        indices.extend(gate.get("wires", gate.get("target", [])))
+        if isinstance(gate.get("control"), list):
+            indices.extend(gate["control"])
+    return max(indices) + 1 if indices else 0
+
+def estimate_qubit_count(db, enc_id) -> int:
+    """Estimate the qubit count of an encoding (best effort; non-critical)."""
+    qubits_count = 0
+    try:
+        # Encodings are keyed by their integer id, not by an ObjectId
+        enc_doc = db.encodings.find_one({"id": enc_id}, {"circuit": 1, "qubit_count": 1})
+        if enc_doc:
+            qubits_count = enc_doc.get("qubit_count") or circuit_qubit_count(enc_doc.get("circuit"))
+    except Exception:
+        traceback.print_exc()
+    return qubits_count
+
+def load_encoding_circuits(db, encoding_ids) -> Dict[int, list]:
+    """Load the validated circuits of encodings, so tasks can carry them and the
+    worker does not have to read them from the DB."""
+    circuits = {}
+    try:
+        for doc in db.encodings.find({"id": {"$in": list(encoding_ids)}}, {"id": 1, "circuit": 1}):
+            circuits[doc["id"]] = doc["circuit"]
+    except Exception:
+        traceback.print_exc()
+    return circuits
+
 @router.post("/run", response_model=RunBenchmarkResponse)
 async def start_benchmark(request: RunBenchmarkRequest = Body(...)):
     try:
@@ -46,8 +100,17 @@ async def start_benchmark(request: RunBenchmarkRequest = Body(...)):
         data_ids = request.data_id if isinstance(request.data_id, list) else [request.data_id]
 
         created_ids: List[str] = []
+        circuits = load_encoding_circuits(db, encoding_ids)
+        # Sweep mode: runs sharing ansatz and dataset compete in one sweep task
+        sweeps: Dict[tuple, List[dict]] = {}
+        task_type = "crossval" if request.k_folds else "preview" if request.preview else "benchmark"
 
         for enc_id, anz_id, d_id in product(encoding_ids, ansatz_ids, data_ids):
+            qubits_count = estimate_qubit_count(db, enc_id)
+            sample_count = dataset_sample_count(db, d_id)
+            cost = run_cost(db, qubits_count, circuits.get(enc_id), d_id, task_type, request.k_folds, sample_count=sample_count)
+            lane = select_lane(cost, request.preview)
+
             # Insert benchmark run into the database
             run_id = get_next_id("benchmarkRuns")
             result = db.benchmarkRuns.insert_one({
@@ -55,39 +118,40 @@ async def start_benchmark(request: RunBenchmarkRequest = Body(...)):
                 "encoding_id": enc_id,
                 "ansatz_id": anz_id,
                 "data_id": d_id,
+                "task_type": task_type,
+                "sweep": request.sweep,
+                "k_folds": request.k_folds,
+                "reduction": request.reduction,
+                "qubit_count": qubits_count,
+                "cost": cost,
+                "lane": lane,
                 "status": "pending",
                 "timestamp": datetime.now(UTC)
             })
 
-            # Estimate qubit count (best effort; non-critical)
-            qubits_count = 0
-            try:
-                enc_doc = db.encodingHistory.find_one({"_id": ObjectId(enc_id)})
-                if enc_doc and "circuit" in enc_doc:
-                    circuit_def = enc_doc["circuit"].get("circuit", [])
-                    indices = []
-                    for gate in circuit_def:
-                        # Support both 'target' and 'wires' keys
-                        indices.extend(gate.get("target", gate.get("wires", [])))
-                        if "control" in gate and isinstance(gate.get("control"), list):
-                            indices.extend(gate["control"])
-                    if indices:
-                        qubits_count = max(indices) + 1
-            except Exception:
-                traceback.print_exc()
-
             # Send task to RabbitMQ
-            task_data = {
-                "run_id": run_id,
-                "encoding_id": enc_id,
-                "ansatz_id": anz_id,
-                "data_id": d_id,
-                "measure_index": 0,
-                "qubit_count": qubits_count
-            }
+            task_data = TaskMessage(
+                run_id=run_id,
+                task_type=task_type,
+                encoding_id=enc_id,
+                ansatz_id=anz_id,
+                data_id=d_id,
+                measure_index=0,
+                qubit_count=qubits_count,
+                reduction=request.reduction,
+                circuit=circuits.get(enc_id),
+                # Let the worker derive the run's memory and time limits
+                sample_count=sample_count,
+                cost=cost,
+                k_folds=request.k_folds or None
+            )
+
+            if request.sweep:
+                sweeps.setdefault((anz_id, d_id), []).append((task_data, cost))
+                continue
 
             try:
-                rabbitmq.send_message(str(task_data))
+                rabbitmq.send_message(task_data, queue=lane)
             except Exception:
                 traceback.print_exc()
                 db.benchmarkRuns.update_one(
@@ -99,6 +163,28 @@ async def start_benchmark(request: RunBenchmarkRequest = Body(...)):
 
             created_ids.append(run_id)
 
+        for sweep_runs in sweeps.values():
+            runs = [run for run, _ in sweep_runs]
+            run_ids = [run.run_id for run in runs]
+            sweep_data = SweepMessage(
+                run_id=run_ids[0],
+                reduction_factor=request.reduction_factor,
+                runs=runs
+            )
+
+            try:
+                # Pruning cuts the budget, but the winners still train fully
+                rabbitmq.send_message(sweep_data, queue=select_lane(sum(cost for _, cost in sweep_runs)))
+            except Exception:
+                traceback.print_exc()
+                db.benchmarkRuns.update_many(
+                    {"id": {"$in": run_ids}},
+                    {"$set": {"status": "failed", "error": "Failed to send to worker"}}
+                )
+                continue
+
+            created_ids.extend(run_ids)
+
         if not created_ids:
             raise HTTPException(status_code=500, detail="Failed to start any benchmark task")
 
@@ -113,6 +199,153 @@ async def start_benchmark(request: RunBenchmarkRequest = Body(...)):
         # TODO: Replace with more specific error message
         raise HTTPException(status_code=500, detail="DB error")
 
+@router.post("/run/search", response_model=RunBenchmarkResponse)
+async def start_hyperparameter_search(request: HyperparameterSearchRequest = Body(...)):
+    try:
+        db = get_db()
+        search_space = request.model_dump(
+            include={"strategy", "learning_rates", "optimizers", "layer_counts", "sample_count", "seed"}
+        )
+
+        qubits_count = estimate_qubit_count(db, request.encoding_id)
+        circuit = load_encoding_circuits(db, [request.encoding_id]).get(request.encoding_id)
+        sample_count = dataset_sample_count(db, request.data_id)
+        cost = run_cost(db, qubits_count, circuit, request.data_id, "search", search_space=search_space, sample_count=sample_count)
+        lane = select_lane(cost)
+
+        run_id = get_next_id("benchmarkRuns")
+        db.benchmarkRuns.insert_one({
+            "id": run_id,
+            "task_type": "search",
+            "encoding_id": request.encoding_id,
+            "ansatz_id": request.ansatz_id,
+            "data_id": request.data_id,
+            "search_space": search_space,
+            "reduction": request.reduction,
+            "qubit_count": qubits_count,
+            "cost": cost,
+            "lane": lane,
+            "status": "pending",
+            "timestamp": datetime.now(UTC)
+        })
+
+        task_data = TaskMessage(
+            run_id=run_id,
+            task_type="search",
+            encoding_id=request.encoding_id,
+            ansatz_id=request.ansatz_id,
+            data_id=request.data_id,
+            measure_index=0,
+            qubit_count=qubits_count,
+            search_space=search_space,
+            reduction=request.reduction,
+            circuit=circuit,
+            sample_count=sample_count,
+            cost=cost
+        )
+
+        try:
+            rabbitmq.send_message(task_data, queue=lane)
+        except Exception:
+            traceback.print_exc()
+            db.benchmarkRuns.update_one(
+                {"id": run_id},
+                {"$set": {"status": "failed", "error": "Failed to send to worker"}}
+            )
+            raise HTTPException(status_code=500, detail="Failed to start hyperparameter search")
+
+        return RunBenchmarkResponse(
+            message=f"Successfully created hyperparameter search task: {run_id}",
+            id=run_id
+        )
+
+    except HTTPException:
+        raise
+    except Exception:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail="DB error")
+
+@router.post("/run/{run_id}/promote", response_model=RunBenchmarkResponse)
+def promote_preview_run(run_id: int):
+    db = get_db()
+    preview_run = db.benchmarkRuns.find_one({"id": run_id})
+    if not preview_run:
+        raise HTTPException(status_code=404, detail="Not found")
+    if preview_run.get("task_type") != "preview":
+        raise HTTPException(status_code=400, detail="Only preview runs can be promoted")
+    preview_result = db.benchmarkResults.find_one({"run_id": run_id})
+    if not preview_result or "params" not in preview_result:
+        raise HTTPException(status_code=409, detail="Preview run has not finished yet")
+
+    qubits_count = estimate_qubit_count(db, preview_run["encoding_id"])
+    circuit = load_encoding_circuits(db, [preview_run["encoding_id"]]).get(preview_run["encoding_id"])
+    sample_count = dataset_sample_count(db, preview_run["data_id"])
+    cost = run_cost(db, qubits_count, circuit, preview_run["data_id"], sample_count=sample_count)
+    lane = select_lane(cost)
+
+    full_run_id = get_next_id("benchmarkRuns")
+    db.benchmarkRuns.insert_one({
+        "id": full_run_id,
+        "task_type": "benchmark",
+        "encoding_id": preview_run["encoding_id"],
+        "ansatz_id": preview_run["ansatz_id"],
+        "data_id": preview_run["data_id"],
+        "promoted_from": run_id,
+        "reduction": preview_run.get("reduction"),
+        "qubit_count": qubits_count,
+        "cost": cost,
+        "lane": lane,
+        "status": "pending",
+        "timestamp": datetime.now(UTC)
+    })
+
+    task_data = TaskMessage(
+        run_id=full_run_id,
+        task_type="benchmark",
+        encoding_id=preview_run["encoding_id"],
+        ansatz_id=preview_run["ansatz_id"],
+        data_id=preview_run["data_id"],
+        measure_index=0,
+        qubit_count=qubits_count,
+        warm_start_params=preview_result["params"],
+        reduction=preview_run.get("reduction"),
+        circuit=circuit,
+        sample_count=sample_count,
+        cost=cost
+    )
+
+    try:
+        rabbitmq.send_message(task_data, queue=lane)
+    except Exception:
+        traceback.print_exc()
+        db.benchmarkRuns.update_one(
+            {"id": full_run_id},
+            {"$set": {"status": "failed", "error": "Failed to send to worker"}}
+        )
+        raise HTTPException(status_code=500, detail="Failed to start full run")
+
+    return RunBenchmarkResponse(
+        message=f"Promoted preview run {run_id} to full run {full_run_id}",
+        id=full_run_id
+    )
+
+@router.post("/run/{run_id}/cancel")
+def cancel_benchmark_run(run_id: int):
+    db = get_db()
+    if not db.benchmarkRuns.find_one({"id": run_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not cancel_run(run_id):
+        raise HTTPException(status_code=409, detail="Run has already finished")
+
+    try:
+        # Workers training the run stop after the current epoch
+        rabbitmq.send_control(ControlMessage(type="cancel", run_id=run_id))
+    except Exception:
+        # Workers still skip the run when they dequeue it
+        traceback.print_exc()
+
+    return {"message": f"Cancelled run {run_id}"}
+
 @router.get("/run")
 def list_all_benchmark_runs():
     db = get_db()
@@ -137,9 +370,14 @@ def delete_benchmark_run_by_id(object_id: str):
         obj_id = ObjectId(object_id)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid ID")
-    result = db.benchmarkRuns.delete_one({"_id": obj_id})
-    if result.deleted_count == 0:
+    run = db.benchmarkRuns.find_one_and_delete({"_id": obj_id})
+    if run is None:
         raise HTTPException(status_code=404, detail="Not found")
+    if run.get("status") in ("pending", "progress"):
+        try:
+            rabbitmq.send_control(ControlMessage(type="cancel", run_id=run["id"]))
+        except Exception:
+            traceback.print_exc()
     return {"message": f"Deleted {object_id}"}
 
 @router.put("/run/{object_id}")
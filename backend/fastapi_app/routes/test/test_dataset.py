@@ -87,4 +87,55 @@ class DatasetRouteTest(TestCase):
         with MongoDbContainer('mongo:8.0') as mongodb:
             with mock_env(MONGO_URI=mongodb.get_connection_url()):
                 resp = client.post('/api/dataset', json={})
-                self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY) 
\ No newline at end of file
+                self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY) 
+
+    def test_dataset_upload(self):
+        """Upload a CSV dataset as a streamed body, list it and delete it again."""
+        with MongoDbContainer('mongo:8.0') as mongodb:
+            with mock_env(MONGO_URI=mongodb.get_connection_url()):
+                rows = ''.join(f'{i * 0.1},{i * 0.2},{i % 2}\n' for i in range(100))
+
+                def body():
+                    yield b'x0,x1,label\n'
+                    yield rows.encode()
+
+                response = client.post('/api/dataset/upload', params={'name': 'Upload', 'format': 'csv'}, content=body())
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                dataset_id = response.json()['id']
+                self.assertEqual(response.json()['feature_count'], 2)
+                self.assertEqual(response.json()['sample_count'], 100)
+                self.assertEqual(response.json()['class_counts'], {'0': 50, '1': 50})
+
+                response = client.get('/api/dataset/upload')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual([doc['id'] for doc in response.json()], [dataset_id])
+
+                response = client.delete(f'/api/dataset/upload/{dataset_id}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(get_db()['userDatasets.files'].count_documents({}), 0)
+
+                response = client.delete(f'/api/dataset/upload/{dataset_id}')
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_dataset_upload_invalid(self):
+        """Files that do not match the expected layout are rejected and not kept."""
+        with MongoDbContainer('mongo:8.0') as mongodb:
+            with mock_env(MONGO_URI=mongodb.get_connection_url()):
+                response = client.post('/api/dataset/upload', params={'name': 'Upload', 'format': 'csv'}, content=b'x0,x1\n1,2\n')
+                self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+                self.assertEqual(get_db()['userDatasets.files'].count_documents({}), 0)
+
+                response = client.post('/api/dataset/upload', params={'name': 'Upload', 'format': 'csv'}, content=b'')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_dataset_upload_not_binary(self):
+        """Uploads with more or fewer than two classes are rejected, as the classifier is binary."""
+        with MongoDbContainer('mongo:8.0') as mongodb:
+            with mock_env(MONGO_URI=mongodb.get_connection_url()):
+                for class_count in (1, 3):
+                    rows = ''.join(f'{i * 0.1},{i * 0.2},{i % class_count}\n' for i in range(30))
+                    response = client.post('/api/dataset/upload', params={'name': 'Upload', 'format': 'csv'}, content=f'x0,x1,label\n{rows}'.encode())
+                    self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+                    self.assertIn('exactly two classes', response.json()['detail'])
+                self.assertEqual(get_db()['userDatasets.files'].count_documents({}), 0)
+                self.assertEqual(get_db().datasets.count_documents({}), 0)
@@ -73,6 +73,21 @@ invalid_circuit_requests = [
                 'params': [42]
             }
         ]
+    },
+    {
+        'name': 'Amplitude embedding after another gate',
+        'circuit': [
+            {
+                'gate':   'RY',
+                'wires':  [0],
+                'params': ['input_0']
+            },
+            {
+                'gate':   'AMPLITUDE',
+                'wires':  [0, 1],
+                'params': []
+            }
+        ]
     }
 ]
 
@@ -114,6 +129,28 @@ class EncodingRouteTest(TestCase):
                 self.assertEqual(body.errors, [])
 
 
+    def test_encoding_create_amplitude(self):
+        with MongoDbContainer('mongo:8.0') as mongodb:
+            with mock_env(MONGO_URI = mongodb.get_connection_url()):
+                response = client.post('/encoding', json = {
+                    'name':  'Amplitude embedding',
+                    'circuit': [
+                        {
+                            'gate':   'AMPLITUDE',
+                            'wires':  [0, 1, 2],
+                            'params': []
+                        }
+                    ],
+                })
+
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+                body = CreateResponse(**response.json())
+
+                self.assertTrue(body.valid)
+                self.assertEqual(get_db().encodings.find_one({ 'id': body.id })['qubit_count'], 3)
+
+
     def test_encoding_create_invalid_circuit(self):
         with MongoDbContainer('mongo:8.0') as mongodb:
             with mock_env(MONGO_URI = mongodb.get_connection_url()):
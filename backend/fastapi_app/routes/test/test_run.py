@@ -1,13 +1,17 @@
 from unittest               import TestCase, mock
 from os                     import environ
+from pathlib                import Path
 
 from testcontainers.mongodb import MongoDbContainer
 from fastapi                import FastAPI, status
 from fastapi.testclient     import TestClient
+import numpy as np
 
-from ...routes.run          import router
+from ...routes.run          import router, circuit_qubit_count
 from ...db                  import get_db
-from ...rabbitmq            import rabbitmq
+from ...rabbitmq            import rabbitmq, PREVIEW_QUEUE, SHORT_QUEUE, TASK_QUEUE, LONG_QUEUE, CONTROL_EXCHANGE
+from ...scheduling          import estimate_cost, search_candidate_count, select_lane, DATASET_SAMPLE_COUNTS
+from ...                    import protocol
 
 app = FastAPI()
 app.include_router(router, prefix="/api")
@@ -82,6 +86,212 @@ class RunRouteTest(TestCase):
             runs = list(get_db().benchmarkRuns.find())
             self.assertEqual(len(runs), 4)
 
+    def test_create_sweep(self):
+        sent = []
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', lambda message, **kwargs: sent.append((message, kwargs))):
+
+            body = {
+                "encoding_id": [1, 2, 3],
+                "ansatz_id": [3],
+                "data_id": [4, 5],
+                "sweep": "successive_halving"
+            }
+            resp = client.post('/api/run', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+            # One run per combination, one sweep task per (ansatz, dataset)
+            runs = list(get_db().benchmarkRuns.find())
+            self.assertEqual(len(runs), 6)
+            self.assertEqual(len(sent), 2)
+            for message, kwargs in sent:
+                self.assertIsInstance(message, protocol.SweepMessage)
+                # A sweep is routed by the summed cost of its runs
+                costs = [run.cost for run in message.runs]
+                self.assertEqual(kwargs["queue"], select_lane(sum(costs)))
+
+    def test_create_preview_and_promote(self):
+        sent = []
+
+        def _send(message, max_retries=3, queue=TASK_QUEUE):
+            sent.append((queue, message))
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', _send):
+
+            body = {"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "preview": True}
+            resp = client.post('/api/run', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            preview_id = resp.json()['id']
+            self.assertEqual(sent[-1][0], PREVIEW_QUEUE)
+
+            # Promotion needs the finished preview result
+            resp = client.post(f'/api/run/{preview_id}/promote')
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+            get_db().benchmarkResults.insert_one({
+                "run_id": preview_id, "encoding_id": 1, "ansatz_id": 2, "data_id": 3,
+                "loss": 0.5, "accuracy": 0.9, "preview": True, "params": [[0.1, 0.2]]
+            })
+            resp = client.post(f'/api/run/{preview_id}/promote')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            full_id = resp.json()['id']
+            self.assertNotEqual(full_id, preview_id)
+            # Full runs go to the lane of their estimated cost
+            self.assertEqual(sent[-1][0], select_lane(get_db().benchmarkRuns.find_one({'id': full_id})['cost']))
+            self.assertNotEqual(sent[-1][0], PREVIEW_QUEUE)
+            self.assertEqual(sent[-1][1].warm_start_params, [[0.1, 0.2]])
+            self.assertEqual(get_db().benchmarkRuns.find_one({'id': full_id})['promoted_from'], preview_id)
+
+            # Full runs can not be promoted again
+            resp = client.post(f'/api/run/{full_id}/promote')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_task_embeds_circuit(self):
+        sent = []
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', lambda message, **_kwargs: sent.append(message)):
+
+            circuit = [{"gate": "RY", "wires": [0], "params": ["input_0"]}]
+            get_db().encodings.insert_one({"id": 1, "name": "RY", "circuit": circuit, "qubit_count": 1})
+
+            resp = client.post('/api/run', json={"encoding_id": [1, 2], "ansatz_id": 2, "data_id": 3})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+            tasks = {task.encoding_id: task for task in sent}
+            self.assertEqual(tasks[1].circuit, circuit)
+            # Unknown encodings are left to the worker
+            self.assertIsNone(tasks[2].circuit)
+            # The worker derives the run's resource limits from these estimates
+            self.assertEqual(tasks[1].sample_count, DATASET_SAMPLE_COUNTS[3])
+            # The qubit count is read from the stored encoding
+            self.assertEqual(tasks[1].qubit_count, 1)
+            self.assertEqual(tasks[2].qubit_count, 0)
+            self.assertEqual(tasks[1].cost, get_db().benchmarkRuns.find_one({'id': tasks[1].run_id})['cost'])
+
+    def test_cancel(self):
+        sent = []
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', lambda message, **kwargs: sent.append((message, kwargs))):
+
+            resp = client.post('/api/run', json={"encoding_id": 1, "ansatz_id": 2, "data_id": 3})
+            run_id = resp.json()['id']
+
+            resp = client.post(f'/api/run/{run_id}/cancel')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(get_db().benchmarkRuns.find_one({'id': run_id})['status'], 'cancelled')
+            # Broadcast to all workers
+            message, kwargs = sent[-1]
+            self.assertEqual(message, protocol.ControlMessage(type="cancel", run_id=run_id))
+            self.assertEqual(kwargs["exchange"], CONTROL_EXCHANGE)
+
+            # Cancelled or finished runs can not be cancelled again
+            resp = client.post(f'/api/run/{run_id}/cancel')
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+            resp = client.post('/api/run/999/cancel')
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_crossval(self):
+        sent = []
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', lambda message, **_kwargs: sent.append(message)):
+
+            resp = client.post('/api/run', json={"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "k_folds": 5})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+            task = sent[-1]
+            self.assertEqual(task.task_type, "crossval")
+            self.assertEqual(task.k_folds, 5)
+            run = get_db().benchmarkRuns.find_one({'id': resp.json()['id']})
+            self.assertEqual(run["task_type"], "crossval")
+
+    def test_circuit_qubit_count(self):
+        self.assertEqual(circuit_qubit_count([{"gate": "CNOT", "wires": [0, 3], "params": []}]), 4)
+        # Legacy gate format of the encoding history
+        self.assertEqual(circuit_qubit_count([{"gate": "CNOT", "target": [1], "control": [2]}]), 3)
+        self.assertEqual(circuit_qubit_count([]), 0)
+
+    def test_cost_lanes(self):
+        small = estimate_cost(qubit_count=2, gate_count=2, sample_count=130, epochs=100, layers=2)
+        medium = estimate_cost(qubit_count=5, gate_count=10, sample_count=1000)
+        large = estimate_cost(qubit_count=14, gate_count=40, sample_count=1000)
+        self.assertLess(small, medium)
+        self.assertLess(medium, large)
+
+        self.assertEqual(select_lane(small), SHORT_QUEUE)
+        self.assertEqual(select_lane(medium), TASK_QUEUE)
+        self.assertEqual(select_lane(large), LONG_QUEUE)
+        # Previews keep their own lane whatever they cost
+        self.assertEqual(select_lane(large, preview=True), PREVIEW_QUEUE)
+
+    def test_search_candidate_count(self):
+        grid = {"learning_rates": [0.01, 0.1, 0.2], "optimizers": ["adam", "sgd"], "layer_counts": [2, 4]}
+        self.assertEqual(search_candidate_count(grid), 12)
+        # The worker defaults to adam
+        self.assertEqual(search_candidate_count({"learning_rates": [0.01, 0.1]}), 2)
+        # Random search draws sample_count candidates over all layer counts
+        self.assertEqual(search_candidate_count({"strategy": "random", "learning_rates": [0.01, 0.5], "sample_count": 8, "layer_counts": [2, 4, 6]}), 8)
+
+    def test_message_protocol(self):
+        task = protocol.TaskMessage(run_id=1, encoding_id=2, ansatz_id=3, data_id=4, reduction="pca", cost=1e6)
+        sweep = protocol.SweepMessage(run_id=1, runs=[task], reduction_factor=3)
+        result = protocol.StatusMessage(id=1, status="done", result={"loss": 0.5, "training_losses": np.arange(4, dtype=np.float32)})
+
+        for content_type in (protocol.JSON, protocol.MSGPACK):
+            body, sent_type, headers = protocol.encode(task, content_type)
+            self.assertEqual(protocol.decode(body, sent_type, headers, protocol.parse_task), task)
+            self.assertEqual(protocol.message_version(headers), protocol.PROTOCOL_VERSION)
+            body, sent_type, headers = protocol.encode(sweep, content_type)
+            self.assertEqual(protocol.decode(body, sent_type, headers, protocol.parse_task), sweep)
+
+            # Arrays travel as binary and are stored as lists
+            body, sent_type, headers = protocol.encode(result, content_type)
+            decoded = protocol.decode(body, sent_type, headers, protocol.StatusMessage)
+            np.testing.assert_array_equal(decoded.result["training_losses"], result.result["training_losses"])
+            self.assertEqual(protocol.to_builtin(decoded.result)["training_losses"], [0.0, 1.0, 2.0, 3.0])
+
+        # Messages of producers predating the protocol
+        self.assertEqual(protocol.decode(str(task.to_dict()).encode(), message_type=protocol.parse_task), task)
+        self.assertEqual(protocol.decode(b'{"id": 1, "status": "init"}', message_type=protocol.StatusMessage), protocol.StatusMessage(id=1, status="init"))
+        self.assertEqual(protocol.message_version(None), 0)
+
+    def test_message_validation(self):
+        # Unknown fields of newer producers are ignored, missing ones take their defaults
+        task = protocol.parse_task({"run_id": 1, "encoding_id": 2, "ansatz_id": 3, "data_id": 4, "new_field": True})
+        self.assertEqual(task.task_type, "benchmark")
+        self.assertEqual(task.qubit_count, 0)
+
+        for message, message_type in [
+            ({"run_id": 1, "encoding_id": 2}, protocol.parse_task),
+            ({"run_id": "1", "encoding_id": 2, "ansatz_id": 3, "data_id": 4}, protocol.parse_task),
+            ({"run_id": 1, "encoding_id": 2, "ansatz_id": 3, "data_id": 4, "task_type": "unknown"}, protocol.parse_task),
+            ({"run_id": 1, "task_type": "sweep", "runs": [{"run_id": 2}]}, protocol.parse_task),
+            ({"id": 1, "status": "finished"}, protocol.StatusMessage),
+            ({"type": "cancel"}, protocol.ControlMessage),
+            ([1, 2], protocol.StatusMessage),
+        ]:
+            body, content_type, headers = protocol.encode(message, protocol.JSON)
+            with self.assertRaises(ValueError):
+                protocol.decode(body, content_type, headers, message_type)
+
+    def test_worker_protocol_in_sync(self):
+        # The worker image is built from its own directory and carries a copy
+        worker_copy = Path(__file__).resolve().parents[3] / "Worker" / "protocol.py"
+        if not worker_copy.exists():
+            self.skipTest("Worker sources are not available")
+        self.assertEqual(worker_copy.read_text(), (Path(protocol.__file__)).read_text(),
+                         "Worker/protocol.py differs, run: cp fastapi_app/protocol.py Worker/protocol.py")
+
     def test_invalid_body(self):
         with MongoDbContainer('mongo:8.0') as mongodb, \
              mock_env(MONGO_URI=mongodb.get_connection_url()), \
@@ -91,6 +301,15 @@ class RunRouteTest(TestCase):
             resp = client.post('/api/run', json=body)
             self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
 
+            body = {"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "reduction": "tsne"}
+            resp = client.post('/api/run', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+            for body in ({"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "k_folds": 1},
+                         {"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "k_folds": 5, "preview": True}):
+                resp = client.post('/api/run', json=body)
+                self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
     def test_send_failure(self):
         """If all send_message calls fail, endpoint should return 500."""
         def _raise(*_a, **_k):
@@ -107,4 +326,44 @@ class RunRouteTest(TestCase):
     def test_get_nonexistent_run(self):
         with MongoDbContainer('mongo:8.0') as mongodb, mock_env(MONGO_URI=mongodb.get_connection_url()):
             resp = client.get('/api/run/999')
-            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND) 
\ No newline at end of file
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_search(self):
+        sent = []
+
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', lambda message, **kwargs: sent.append((message, kwargs))):
+
+            body = {
+                "encoding_id": 1,
+                "ansatz_id": 2,
+                "data_id": 3,
+                "learning_rates": [0.01, 0.1],
+                "optimizers": ["adam", "sgd"]
+            }
+            resp = client.post('/api/run/search', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+            run = get_db().benchmarkRuns.find_one({'id': resp.json()['id']})
+            self.assertEqual(run['task_type'], 'search')
+            self.assertEqual(run['search_space']['optimizers'], ['adam', 'sgd'])
+            self.assertEqual(len(sent), 1)
+            message, kwargs = sent[0]
+            self.assertEqual(message.search_space["optimizers"], ["adam", "sgd"])
+            self.assertEqual(kwargs["queue"], run["lane"])
+            self.assertEqual(kwargs["queue"], select_lane(run["cost"]))
+
+    def test_invalid_search(self):
+        with MongoDbContainer('mongo:8.0') as mongodb, \
+             mock_env(MONGO_URI=mongodb.get_connection_url()), \
+             mock.patch.object(rabbitmq, 'send_message', dummy_mq.send_message):
+
+            # Random search needs a [low, high] range
+            body = {"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "strategy": "random", "learning_rates": [0.1, 0.2, 0.3]}
+            resp = client.post('/api/run/search', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+            body = {"encoding_id": 1, "ansatz_id": 2, "data_id": 3, "learning_rates": [0.1], "optimizers": ["lbfgs"]}
+            resp = client.post('/api/run/search', json=body)
+            self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
@@ -0,0 +1,118 @@
+import os
+from math import prod
+
+from fastapi_app.rabbitmq import PREVIEW_QUEUE, SHORT_QUEUE, TASK_QUEUE, LONG_QUEUE
+
+#
+#   Cost model and lane selection of benchmark tasks.
+#
+#   The cost of a run is estimated as the number of statevector amplitude updates it
+#   simulates: every sample of every epoch applies the encoding gates and
+#   ``layers x qubits`` ansatz gates to a state of ``2 ** qubits`` amplitudes. Only
+#   the order of magnitude matters; it decides which lane a task is sent to. The
+#   workers drain the lanes in order (with aging, so long runs are not starved).
+#
+
+# Training budget of the workers (keep in sync with the worker's environment)
+EPOCH_COUNT         = int(os.getenv("EPOCH_COUNT", "100"))
+LAYER_COUNT         = int(os.getenv("LAYER_COUNT", "10"))
+PREVIEW_EPOCH_COUNT = int(os.getenv("PREVIEW_EPOCH_COUNT", "10"))
+PREVIEW_FRACTION    = float(os.getenv("PREVIEW_FRACTION", "0.25"))
+
+# Tasks below SHORT_TASK_COST go to the short lane, above LONG_TASK_COST to the long one
+SHORT_TASK_COST = float(os.getenv("SHORT_TASK_COST", "1e8"))
+LONG_TASK_COST  = float(os.getenv("LONG_TASK_COST", "1e10"))
+
+# Qubit count the worker falls back to when it is unknown
+DEFAULT_QUBIT_COUNT = 5
+
+# Samples of the built-in datasets after filtering to two classes; uploads store theirs
+DATASET_SAMPLE_COUNTS = {1: 1000, 2: 360, 3: 1250, 4: 130}
+DEFAULT_SAMPLE_COUNT  = 500
+
+
+def dataset_sample_count(db, data_id: int) -> int:
+    """Return the number of samples of a dataset (best effort)."""
+    doc = db.datasets.find_one({"id": data_id}, {"sample_count": 1})
+    if doc and doc.get("sample_count"):
+        return int(doc["sample_count"])
+    return DATASET_SAMPLE_COUNTS.get(data_id, DEFAULT_SAMPLE_COUNT)
+
+
+def search_candidate_count(search_space: dict) -> int:
+    """Return the number of candidates a hyperparameter search trains (see the worker's ``expand_search_space``)."""
+    if search_space.get("strategy") == "random":
+        # Drawn in total, each with a random layer count
+        return search_space.get("sample_count", 10)
+    layer_count = len(search_space.get("layer_counts") or [LAYER_COUNT])
+    optimizer_count = len(search_space.get("optimizers") or ["adam"])
+    return prod([len(search_space.get("learning_rates", [])), optimizer_count, layer_count])
+
+
+def estimate_cost(qubit_count: int, gate_count: int, sample_count: int, epochs: int = EPOCH_COUNT, layers: int = LAYER_COUNT) -> float:
+    """
+    Estimate the cost of a training run.
+
+    Args:
+        qubit_count (int): Qubits of the circuit (0 = unknown).
+        gate_count (int): Gates of the encoding circuit.
+        sample_count (int): Samples of the dataset.
+        epochs (int): Training epochs.
+        layers (int): Ansatz layers.
+
+    Returns:
+        float: Estimated number of simulated amplitude updates.
+    """
+    qubit_count = qubit_count or DEFAULT_QUBIT_COUNT
+    gates_per_sample = max(gate_count, qubit_count) + layers * qubit_count
+    return float(epochs * sample_count * gates_per_sample * 2 ** qubit_count)
+
+
+def run_cost(db, qubit_count: int, circuit, data_id: int, task_type: str = "benchmark", k_folds: int = None, search_space: dict = None, sample_count: int = None) -> float:
+    """
+    Estimate the cost of a benchmark, preview, cross-validation or search task.
+
+    Args:
+        db: The 'Quantum-Encoding-DB' database.
+        qubit_count (int): Qubits of the encoding (0 = unknown).
+        circuit: Gate list of the encoding, if known.
+        data_id (int): The dataset id.
+        task_type (str): ``benchmark``, ``preview``, ``crossval`` or ``search``.
+        k_folds (int): Folds of a cross-validation.
+        search_space (dict): Search space of a hyperparameter search.
+        sample_count (int): Samples of the dataset, if already known.
+
+    Returns:
+        float: Estimated number of simulated amplitude updates.
+    """
+    samples = sample_count or dataset_sample_count(db, data_id)
+    gate_count = len(circuit) if isinstance(circuit, list) else 0
+    if task_type == "preview":
+        return estimate_cost(qubit_count, gate_count, int(samples * PREVIEW_FRACTION), PREVIEW_EPOCH_COUNT)
+
+    cost = estimate_cost(qubit_count, gate_count, samples)
+    if task_type == "crossval":
+        cost *= k_folds or 1
+    elif task_type == "search":
+        cost *= search_candidate_count(search_space or {})
+    return cost
+
+
+def select_lane(cost: float, preview: bool = False) -> str:
+    """
+    Return the task lane for a task of the given cost.
+
+    Args:
+        cost (float): Estimated cost, see ``run_cost``.
+        preview (bool): Whether the task is an interactive preview.
+
+    Returns:
+        str: The queue the task is sent to.
+    """
+    if preview:
+        return PREVIEW_QUEUE
+    if cost < SHORT_TASK_COST:
+        return SHORT_QUEUE
+    if cost > LONG_TASK_COST:
+        return LONG_QUEUE
+    return TASK_QUEUE